@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import statistics
+import contextlib
+import subprocess
+
+import core
+import script
+
+
+# 合成素材的规格：matched 全部相同；mismatched 每隔几个文件换一种分辨率/帧率/采样率
+BASE_SPEC = {"size": "160x120", "rate": 25, "sample_rate": 48000}
+VARIANTS = [
+    {"size": "192x108"},
+    {"rate": 30},
+    {"sample_rate": 44100},
+]
+STAGES = ("probe", "consistency", "plan", "concat")
+
+
+def _template(spec, path, duration):
+    # bitexact 保证同一规格每次生成的文件逐字节相同
+    subprocess.run(["ffmpeg", "-v", "error", "-y",
+                    "-f", "lavfi", "-i", f"testsrc=s={spec['size']}:r={spec['rate']}:d={duration}",
+                    "-f", "lavfi", "-i", f"sine=f=440:r={spec['sample_rate']}:d={duration}",
+                    "-c:v", "libx264", "-preset", "ultrafast", "-g", str(spec["rate"]), "-pix_fmt", "yuv420p",
+                    "-c:a", "aac", "-shortest", "-fflags", "+bitexact", "-flags:v", "+bitexact",
+                    "-flags:a", "+bitexact", path], check=True)
+
+
+def generate(root, count, mismatched=False, duration=1, every=10):
+    """
+    生成一组确定性的合成素材：每种规格只编码一次模板，其余文件硬链接（不支持时复制）
+    :param mismatched: 每 every 个文件里放一个离群规格，依次轮换 VARIANTS
+    :return: 按文件名排序的路径列表
+    """
+    os.makedirs(root, exist_ok=True)
+    templates = {}
+    paths = []
+    for i in range(count):
+        variant = (i // every) % len(VARIANTS) if mismatched and i % every == every - 1 else None
+        if variant not in templates:
+            spec = dict(BASE_SPEC, **(VARIANTS[variant] if variant is not None else {}))
+            templates[variant] = os.path.join(root, f".template_{variant}.mp4")
+            if not os.path.exists(templates[variant]):
+                _template(spec, templates[variant], duration)
+        path = os.path.join(root, f"clip_{i:05d}.mp4")
+        if not os.path.exists(path):
+            try:
+                os.link(templates[variant], path)
+            except OSError:
+                shutil.copyfile(templates[variant], path)
+        paths.append(path)
+
+    return paths
+
+
+@contextlib.contextmanager
+def _quiet():
+    # 各处的 print 与 ffmpeg 子进程输出照常产生（计入耗时），只是在文件描述符层面丢弃，不刷屏
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = os.dup(1), os.dup(2)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    try:
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        yield
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        for fd in saved + (devnull,):
+            os.close(fd)
+
+
+def run_set(paths, work_dir, stages=STAGES, workers=None, cache=False):
+    """
+    对一组素材逐阶段计时
+    :param cache: 是否启用探测缓存；默认关闭，测的是冷启动
+    :return: {阶段: 秒数}
+    """
+    timings = {}
+    fpu = core.FPU(cache=cache, workers=workers)
+    v_params, a_params = fpu.concat_video, fpu.concat_audio
+    info_dict = None
+
+    with _quiet():
+        if "probe" in stages or "consistency" in stages:
+            start = time.perf_counter()
+            info_dict = fpu.videos_core_info_detect(paths, v_params, a_params)
+            timings["probe"] = time.perf_counter() - start
+
+        if "consistency" in stages:
+            start = time.perf_counter()
+            fpu.videos_consistency_detect(paths, v_params, a_params, info_dict=info_dict)
+            timings["consistency"] = time.perf_counter() - start
+
+        if "plan" in stages:
+            # 含探测在内的整条 VideoAlign 命令规划
+            start = time.perf_counter()
+            s = script.Script(paths, cache=cache).VideoAlign(os.path.join(work_dir, "aligned"), workers=workers)
+            timings["plan"] = time.perf_counter() - start
+            timings["plan_commands"] = len(s.cmd_stack)
+
+        if "concat" in stages:
+            output = os.path.join(work_dir, "concat.mp4")
+            start = time.perf_counter()
+            fpu.concat_time_sequence(paths, output, workers=workers, normalize=True)
+            timings["concat"] = time.perf_counter() - start
+            if os.path.exists(output):
+                os.remove(output)
+
+    return timings
+
+
+def run(sizes=(10, 100, 1000), kinds=("matched", "mismatched"), repeat=1, work_dir=None, stages=STAGES,
+        concat_limit=1000, workers=None, cache=False):
+    """
+    :param sizes: 各组文件数
+    :param repeat: 每组重复次数，结果取中位数
+    :param concat_limit: 超过这个文件数的组跳过 concat 阶段（端到端合并耗时随文件数线性增长）
+    :return: 可直接写成 JSON 的结果
+    """
+    work_dir = work_dir or tempfile.mkdtemp(prefix="clipforge_bench_")
+    results = {}
+    for kind in kinds:
+        for n in sizes:
+            name = f"{kind}-{n}"
+            set_dir = os.path.join(work_dir, name)
+            start = time.perf_counter()
+            paths = generate(os.path.join(set_dir, "clips"), n, mismatched=kind == "mismatched")
+            generated = time.perf_counter() - start
+
+            set_stages = [s for s in stages if s != "concat" or n <= concat_limit]
+            runs = [run_set(paths, set_dir, set_stages, workers, cache) for _ in range(repeat)]
+            timings = {k: statistics.median(r[k] for r in runs) for k in runs[0]}
+            results[name] = {"files": n, "kind": kind, "generate": generated, "stages": timings,
+                             "runs": runs if repeat > 1 else None}
+            print(f"✅ {name}: " + ", ".join(f"{k} {v:.3f}s" for k, v in timings.items() if k in STAGES))
+
+    version = subprocess.run(["ffmpeg", "-version"], stdout=subprocess.PIPE, text=True).stdout.split("\n", 1)[0]
+
+    return {"meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                     "platform": platform.platform(), "cpu_count": os.cpu_count(), "ffmpeg": version,
+                     "repeat": repeat, "cache": bool(cache)},
+            "results": results}
+
+
+def compare(current, baseline, threshold=0.10, min_seconds=0.05):
+    """
+    与基线对比，耗时增加超过 threshold（相对）且超过 min_seconds（绝对）的阶段判为回退
+    :return: [(组名, 阶段, 基线秒数, 当前秒数), ...]
+    """
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            continue
+        for stage in STAGES:
+            now, before = result["stages"].get(stage), base["stages"].get(stage)
+            if now is None or before is None:
+                continue
+            if now > before * (1 + threshold) and now - before > min_seconds:
+                regressions.append((name, stage, before, now))
+
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="ClipForgeKit 探测/对齐/合并基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--kinds", nargs="+", default=["matched", "mismatched"])
+    parser.add_argument("--stages", nargs="+", default=list(STAGES))
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--concat-limit", type=int, default=1000)
+    parser.add_argument("--work-dir", default=None, help="素材目录，复用可省去重新生成")
+    parser.add_argument("--cache", action="store_true", help="启用探测缓存（测热缓存）")
+    parser.add_argument("--out", default="bench.json")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args()
+
+    result = run(args.sizes, args.kinds, args.repeat, args.work_dir, args.stages, args.concat_limit,
+                 args.workers, args.cache)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"✅ 结果已写入 {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.threshold)
+        for name, stage, before, now in regressions:
+            print(f"❌ {name} {stage}: {before:.3f}s -> {now:.3f}s (+{(now / before - 1):.0%})")
+        print("✅ 没有性能回退。" if not regressions else f"❌ {len(regressions)} 项性能回退。")
+        sys.exit(1 if regressions else 0)
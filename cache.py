@@ -0,0 +1,359 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+
+
+def default_cache_path():
+    env = os.environ.get("CLIPFORGE_CACHE")
+    if env:
+        return env
+
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "clipforgekit", "probe.sqlite3")
+
+
+def file_fingerprint(path):
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_size, st.st_mtime_ns, st.st_ino
+
+
+class ProbeCache:
+    """
+    持久化探测缓存（SQLite）
+    以 (路径, 大小, mtime, inode) + 请求字段集 为键，超过 max_entries 时按最近访问时间淘汰（LRU）。
+    """
+
+    def __init__(self, db_path=None, max_entries=200000):
+        self.db_path = db_path or default_cache_path()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if self.db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS probe ("
+            "path TEXT NOT NULL, fields TEXT NOT NULL, size INTEGER, mtime INTEGER, inode INTEGER, "
+            "data TEXT NOT NULL, atime REAL NOT NULL, PRIMARY KEY (path, fields))")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS probe_atime ON probe (atime)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, data TEXT NOT NULL, atime REAL NOT NULL)")
+        self._count = self._conn.execute("SELECT COUNT(*) FROM probe").fetchone()[0]
+
+    def get(self, path, fields):
+        try:
+            key, size, mtime, inode = file_fingerprint(path)
+        except OSError:
+            return None
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM probe WHERE path=? AND fields=? AND size=? AND mtime=? AND inode=?",
+                (key, fields, size, mtime, inode)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE probe SET atime=? WHERE path=? AND fields=?", (time.time(), key, fields))
+            self.hits += 1
+
+        return json.loads(row[0])
+
+    def put(self, path, fields, data):
+        try:
+            key, size, mtime, inode = file_fingerprint(path)
+        except OSError:
+            return
+
+        payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            exists = self._conn.execute("SELECT 1 FROM probe WHERE path=? AND fields=?", (key, fields)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO probe (path, fields, size, mtime, inode, data, atime) VALUES (?,?,?,?,?,?,?)",
+                (key, fields, size, mtime, inode, payload, time.time()))
+            if exists is None:
+                self._count += 1
+            if self._count > self.max_entries:
+                self._evict()
+
+    def get_value(self, key):
+        """不绑定文件的键值缓存（如按片源规格缓存的调参结果），不参与 LRU 淘汰"""
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM kv WHERE key=?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE kv SET atime=? WHERE key=?", (time.time(), key))
+            self.hits += 1
+
+        return json.loads(row[0])
+
+    def put_value(self, key, data):
+        payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO kv (key, data, atime) VALUES (?,?,?)", (key, payload, time.time()))
+
+    def _evict(self):
+        # 一次多删 10%，避免每次写入都触发淘汰
+        excess = self._count - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM probe WHERE rowid IN (SELECT rowid FROM probe ORDER BY atime LIMIT ?)", (excess,))
+        self._count = self._conn.execute("SELECT COUNT(*) FROM probe").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM probe")
+            self._conn.execute("DELETE FROM kv")
+            self._count = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def default_cache():
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ProbeCache()
+        return _default_cache
+
+
+_path_caches = {}
+
+
+def resolve_cache(cache):
+    """cache=True 使用全局默认缓存，False/None 关闭缓存，也可直接传入 ProbeCache 实例或数据库路径。"""
+    if cache is True:
+        return default_cache()
+    if not cache:
+        return None
+    if isinstance(cache, str):
+        with _default_lock:
+            if cache not in _path_caches:
+                _path_caches[cache] = ProbeCache(cache)
+            return _path_caches[cache]
+    return cache
+
+
+def reset_process_state():
+    """
+    进程池子进程的 initializer：fork 出来的子进程会继承父进程已打开的 SQLite 连接与锁，
+    这里全部丢弃，让子进程按库路径重新打开自己的连接
+    """
+    global _default_cache, _default_lock
+    _default_cache = None
+    _default_lock = threading.Lock()
+    _path_caches.clear()
+
+
+def default_artifact_root():
+    return os.path.join(os.path.dirname(os.path.abspath(default_cache_path())), "artifacts")
+
+
+def content_hash(path, cache=True):
+    """文件内容的 sha256，按 (路径, 大小, mtime, inode) 记在探测缓存里，文件不变就不重复读"""
+    probe_cache = resolve_cache(cache)
+    if probe_cache is not None:
+        digest = probe_cache.get(path, "sha256")
+        if digest is not None:
+            return digest
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    if probe_cache is not None:
+        probe_cache.put(path, "sha256", digest)
+
+    return digest
+
+
+FICLONE = 0x40049409
+
+
+def reflink_or_copy(src, dst):
+    """
+    src 放到 dst：优先 reflink（写时复制），不支持时真正复制
+    不用硬链接：缓存里的产物与用户的输出共用一个 inode 时，改权限或原地改写会互相影响
+    先落到临时名再原子替换，dst 已存在时直接覆盖
+    """
+    directory, name = os.path.split(os.path.abspath(dst))
+    tmp = os.path.join(directory, f".{name}.link")
+    if os.path.exists(tmp):
+        os.remove(tmp)
+
+    try:
+        import fcntl
+        with open(src, "rb") as fs, open(tmp, "wb") as fd:
+            fcntl.ioctl(fd.fileno(), FICLONE, fs.fileno())
+    except (ImportError, OSError):
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+# 只影响日志、进度与并发，不影响输出内容的参数（带一个参数值的写在字典里）
+VOLATILE_FLAGS = {"-y": 0, "-n": 0, "-hide_banner": 0, "-nostats": 0, "-stats": 0, "-progress": 1,
+                  "-loglevel": 1, "-v": 1, "-threads": 1, "-stats_period": 1}
+
+
+class ArtifactCache:
+    """
+    内容寻址的产物缓存
+    键 = 输入文件内容哈希 + 归一化后的参数列表（去掉输出路径与不影响结果的参数）。
+    命中时把缓存里的产物 reflink（不支持时复制）到输出路径，不再运行 ffmpeg；按总大小做 LRU 淘汰。
+    """
+
+    def __init__(self, root=None, max_bytes=50 * 1024 ** 3, probe_cache=True):
+        self.root = root or default_artifact_root()
+        self.max_bytes = max_bytes
+        self.probe_cache = probe_cache
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(self.root, "index.sqlite3"), timeout=30,
+                                     check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS artifact ("
+            "key TEXT PRIMARY KEY, ext TEXT NOT NULL, size INTEGER NOT NULL, atime REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS artifact_atime ON artifact (atime)")
+        self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM artifact").fetchone()[0]
+
+    def key(self, args):
+        """
+        由完整命令参数算出缓存键；多输出、concat 清单、管道输入输出等无法可靠寻址的命令返回 None
+        滤镜参数里引用的外部文件（如字幕）不参与哈希
+        """
+        import core
+
+        args = list(args)
+        if len(args) < 2:
+            return None
+        # 多输出的命令命中时只能还原一个文件，一律不缓存
+        if len(core.output_paths(args)) != 1:
+            return None
+
+        output = args[-1]
+        if output.startswith(("-", "pipe:")) or "://" in output:
+            return None
+
+        normalized = []
+        i = 1
+        while i < len(args) - 1:
+            a = args[i]
+            if a in VOLATILE_FLAGS:
+                i += 1 + VOLATILE_FLAGS[a]
+                continue
+            if a == "-f" and args[i + 1] == "concat":
+                return None
+            if a == "-i":
+                src = args[i + 1]
+                if not os.path.isfile(src):
+                    return None
+                normalized += ["-i", f"sha256:{content_hash(src, self.probe_cache)}"]
+                i += 2
+                continue
+            normalized.append(a)
+            i += 1
+        normalized.append(os.path.splitext(output)[1].lower())
+
+        return hashlib.sha256(json.dumps(normalized, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def _object(self, key, ext):
+        return os.path.join(self.root, "objects", key[:2], key + ext)
+
+    def fetch(self, key, output_path):
+        """命中时把产物放到 output_path 并返回 True"""
+        with self._lock:
+            row = self._conn.execute("SELECT ext, size FROM artifact WHERE key=?", (key,)).fetchone()
+            obj = self._object(key, row[0]) if row else None
+            # 产物被外部改写（大小不符）时视为失效
+            if row is None or not os.path.isfile(obj) or os.path.getsize(obj) != row[1]:
+                if row is not None:
+                    self._drop(key, obj, row[1])
+                self.misses += 1
+                return False
+            self._conn.execute("UPDATE artifact SET atime=? WHERE key=?", (time.time(), key))
+            self.hits += 1
+
+        reflink_or_copy(obj, output_path)
+
+        return True
+
+    def store(self, key, output_path):
+        ext = os.path.splitext(output_path)[1].lower()
+        obj = self._object(key, ext)
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        reflink_or_copy(output_path, obj)
+        # 只读，防止被原地改写；产物是独立的副本（或 reflink），不会连带改到用户的输出
+        os.chmod(obj, 0o444)
+        size = os.path.getsize(obj)
+
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM artifact WHERE key=?", (key,)).fetchone()
+            self._conn.execute("INSERT OR REPLACE INTO artifact (key, ext, size, atime) VALUES (?,?,?,?)",
+                               (key, ext, size, time.time()))
+            self._total += size - (old[0] if old else 0)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _drop(self, key, obj, size):
+        self._conn.execute("DELETE FROM artifact WHERE key=?", (key,))
+        self._total -= size
+        try:
+            os.remove(obj)
+        except OSError:
+            pass
+
+    def _evict(self):
+        # 淘汰到上限的 90%，避免每次写入都触发
+        target = int(self.max_bytes * 0.9)
+        for key, ext, size in self._conn.execute("SELECT key, ext, size FROM artifact ORDER BY atime").fetchall():
+            if self._total <= target:
+                break
+            self._drop(key, self._object(key, ext), size)
+
+    def clear(self):
+        with self._lock:
+            for key, ext, size in self._conn.execute("SELECT key, ext, size FROM artifact").fetchall():
+                self._drop(key, self._object(key, ext), size)
+            self._total = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_artifact_caches = {}
+
+
+def resolve_artifacts(artifacts):
+    """artifacts=True 使用默认产物缓存目录，False/None 关闭，也可传入 ArtifactCache 实例或目录路径"""
+    if not artifacts:
+        return None
+    if artifacts is True or isinstance(artifacts, str):
+        root = default_artifact_root() if artifacts is True else artifacts
+        with _default_lock:
+            if root not in _artifact_caches:
+                _artifact_caches[root] = ArtifactCache(root)
+            return _artifact_caches[root]
+    return artifacts
@@ -0,0 +1,250 @@
+import re
+import shutil
+import threading
+import subprocess
+
+from cache import resolve_cache
+
+
+# 同一编码格式的编码器按速度从快到慢排列：硬件编码优先，其次常用软件编码器
+ENCODER_PREFERENCE = {
+    "h264": ["h264_nvenc", "h264_qsv", "h264_videotoolbox", "h264_amf", "libx264", "libopenh264"],
+    "hevc": ["hevc_nvenc", "hevc_qsv", "hevc_videotoolbox", "hevc_amf", "libx265"],
+    "av1": ["av1_nvenc", "av1_qsv", "av1_amf", "libsvtav1", "librav1e", "libaom-av1"],
+    "vp9": ["vp9_qsv", "libvpx-vp9"],
+    "aac": ["libfdk_aac", "aac"],
+    "mp3": ["libmp3lame"],
+    "opus": ["libopus", "opus"],
+}
+HARDWARE_SUFFIXES = ("_nvenc", "_qsv", "_videotoolbox", "_amf", "_vaapi", "_v4l2m2m")
+
+CODEC_FLAGS = ("-c", "-codec", "-c:v", "-c:a", "-vcodec", "-acodec", "-codec:v", "-codec:a")
+FILTER_FLAGS = ("-vf", "-af", "-filter:v", "-filter:a", "-filter_complex", "-lavfi")
+
+
+def _lines(binary, flag):
+    proc = subprocess.run([binary, "-hide_banner", flag], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                          text=True, errors="replace")
+    return proc.stdout.splitlines()
+
+
+def _parse_codecs(lines):
+    # " V....D libx264   libx264 H.264 / AVC ... (codec h264)"
+    codecs = {}
+    listing = False
+    for line in lines:
+        if line.strip().startswith("------"):
+            listing = True
+            continue
+        parts = line.split(None, 2)
+        if not listing or len(parts) < 2 or parts[0][0] not in "VAS":
+            continue
+        family = re.search(r"\(codec (\S+)\)\s*$", line)
+        codecs[parts[1]] = {"type": parts[0][0], "codec": family.group(1) if family else parts[1]}
+
+    return codecs
+
+
+def _parse_pix_fmts(lines):
+    fmts = []
+    listing = False
+    for line in lines:
+        if line.startswith("-----"):
+            listing = True
+            continue
+        parts = line.split()
+        if listing and len(parts) >= 2:
+            fmts.append(parts[1])
+
+    return fmts
+
+
+def _parse_filters(lines):
+    return [m.group(1) for m in (re.match(r"^\s*[T.][S.][C.]\s+(\S+)\s+\S+->\S+", line) for line in lines) if m]
+
+
+def _split(text, seps):
+    # 按分隔符切分，跳过单引号内与反斜杠转义的字符
+    parts, buf, quoted, escaped = [], [], False, False
+    for ch in text:
+        if escaped:
+            buf.append(ch)
+            escaped = False
+        elif ch == "\\":
+            buf.append(ch)
+            escaped = True
+        elif ch == "'":
+            buf.append(ch)
+            quoted = not quoted
+        elif ch in seps and not quoted:
+            parts.append("".join(buf))
+            buf = []
+        else:
+            buf.append(ch)
+    parts.append("".join(buf))
+
+    return parts
+
+
+def filter_names(graph):
+    """滤镜图里用到的滤镜名，如 "[0:v]scale=1280:-2,setsar=1[v]" -> ["scale", "setsar"]"""
+    names = []
+    for f in _split(graph, ";,"):
+        f = re.sub(r"^\s*(\[[^\]]*\]\s*)+", "", f)
+        f = re.sub(r"(\s*\[[^\]]*\])+\s*$", "", f)
+        name = f.split("=", 1)[0].split("@", 1)[0].strip()
+        if name:
+            names.append(name)
+
+    return names
+
+
+class Capabilities:
+    """
+    单个 ffmpeg 可执行文件的能力清单：编码器、解码器、像素格式、滤镜、版本
+    按 (可执行文件路径, 大小, mtime, inode) 缓存在探测缓存里，换了 ffmpeg 自动重新采集
+    """
+
+    fields = "ffmpeg capabilities"
+
+    def __init__(self, binary=None, cache=True):
+        self.binary = shutil.which(binary or "ffmpeg") or binary or "ffmpeg"
+        self.cache = resolve_cache(cache)
+        data = self.cache.get(self.binary, self.fields) if self.cache is not None else None
+        if data is None:
+            data = self._collect()
+            if self.cache is not None:
+                self.cache.put(self.binary, self.fields, data)
+
+        self.version = data["version"]
+        self.encoders = data["encoders"]
+        self.decoders = data["decoders"]
+        self.pix_fmts = set(data["pix_fmts"])
+        self.filters = set(data["filters"])
+        self.hwaccels = data["hwaccels"]
+        # 硬件编码器是否真的能用（列出来不代表有设备），首次用到时试编码一次并回写缓存
+        self.usable = data.get("usable", {})
+
+    def _collect(self):
+        version = _lines(self.binary, "-version")
+        hwaccels = [l.strip() for l in _lines(self.binary, "-hwaccels")[1:] if l.strip()]
+
+        return {"version": version[0] if version else "",
+                "encoders": _parse_codecs(_lines(self.binary, "-encoders")),
+                "decoders": _parse_codecs(_lines(self.binary, "-decoders")),
+                "pix_fmts": _parse_pix_fmts(_lines(self.binary, "-pix_fmts")),
+                "filters": _parse_filters(_lines(self.binary, "-filters")),
+                "hwaccels": hwaccels,
+                "usable": {}}
+
+    def _save(self):
+        if self.cache is not None:
+            self.cache.put(self.binary, self.fields, {
+                "version": self.version, "encoders": self.encoders, "decoders": self.decoders,
+                "pix_fmts": sorted(self.pix_fmts), "filters": sorted(self.filters), "hwaccels": self.hwaccels,
+                "usable": self.usable})
+
+    def has_encoder(self, name):
+        return name in self.encoders
+
+    def has_decoder(self, name):
+        # 解码器名（如 "h264_cuvid"）或编码格式名（如 "h264"）都可以
+        return name in self.decoders or any(info["codec"] == name for info in self.decoders.values())
+
+    def encoder_usable(self, name):
+        """编码器存在且（硬件编码器）能在本机实际编出一帧"""
+        if name not in self.encoders:
+            return False
+        if not name.endswith(HARDWARE_SUFFIXES):
+            return True
+        if name not in self.usable:
+            kind = self.encoders[name]["type"]
+            src = "color=s=256x256:d=0.1" if kind == "V" else "anullsrc=d=0.1"
+            try:
+                proc = subprocess.run([self.binary, "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", src,
+                                       "-frames:v" if kind == "V" else "-t", "1" if kind == "V" else "0.1",
+                                       "-c:v" if kind == "V" else "-c:a", name, "-f", "null", "-"],
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=30)
+                self.usable[name] = proc.returncode == 0
+            except (OSError, subprocess.TimeoutExpired):
+                self.usable[name] = False
+            self._save()
+
+        return self.usable[name]
+
+    def is_family(self, name):
+        # "-c:v h264" 这类写编码格式名的，由 ffmpeg 自选默认编码器
+        return any(info["codec"] == name and not e.endswith(HARDWARE_SUFFIXES) for e, info in self.encoders.items())
+
+    def best_encoder(self, family, default=None):
+        """
+        指定编码格式下本机最快的可用编码器
+        :param family: 编码格式（如 "h264"），也可直接给编码器名（如 "h264_nvenc"），不可用时按所属格式回退
+        """
+        if family in self.encoders and family not in ENCODER_PREFERENCE:
+            if self.encoder_usable(family):
+                return family
+            family = self.encoders[family]["codec"]
+        elif family.endswith(HARDWARE_SUFFIXES):
+            # 当前 ffmpeg 没编进这个硬件编码器，按名字前缀推断编码格式
+            family = family.split("_", 1)[0]
+        for name in ENCODER_PREFERENCE.get(family, []):
+            if self.encoder_usable(name):
+                return name
+        # 偏好表里没有的格式，取清单里第一个同格式的软件编码器
+        for name, info in self.encoders.items():
+            if info["codec"] == family and not name.endswith(HARDWARE_SUFFIXES):
+                return name
+
+        return default
+
+    def validate(self, args):
+        """
+        预检一条 ffmpeg 命令用到的编码器、像素格式与滤镜
+        :return: 问题列表，空列表表示通过
+        """
+        import core
+
+        # 每个选项归属于它之后最近的 -i（输入选项）或输出路径（输出选项），输入侧的 -c 指定的是解码器
+        ends = sorted([i for i, a in enumerate(args) if a == "-i"] + core.output_indices(args))
+        input_side = set()
+        start = 0
+        for end in ends:
+            if args[end] == "-i":
+                input_side.update(range(start, end))
+            start = end + 1
+
+        problems = []
+        for i, a in enumerate(args[:-1]):
+            value = args[i + 1]
+            if a in CODEC_FLAGS and i in input_side:
+                if not self.has_decoder(value):
+                    problems.append(f"解码器不可用: {value}")
+            elif a in CODEC_FLAGS and value != "copy" and not self.encoder_usable(value) and not self.is_family(value):
+                problems.append(f"编码器不可用: {value}")
+            elif a == "-pix_fmt" and value not in self.pix_fmts:
+                problems.append(f"像素格式不支持: {value}")
+            elif a in FILTER_FLAGS:
+                for name in filter_names(value):
+                    if name not in self.filters:
+                        problems.append(f"滤镜不存在: {name}")
+
+        return problems
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def capabilities(binary=None, cache=True):
+    """
+    按可执行文件取能力清单，同一进程内只采集一次
+    :return: Capabilities；找不到 ffmpeg 时返回 None
+    """
+    key = shutil.which(binary or "ffmpeg")
+    if key is None:
+        return None
+    with _registry_lock:
+        if key not in _registry:
+            _registry[key] = Capabilities(key, cache)
+        return _registry[key]
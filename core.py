@@ -1,8 +1,26 @@
 import os
 import json
+import time
+import shutil
+import asyncio
 import subprocess
 from pathlib import Path
-from collections import Counter
+from fractions import Fraction
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import caps
+import dedup
+import scan
+import header
+import journal
+import loudness
+import metrics
+import packets
+import pipeline
+import scheduler
+from cache import resolve_cache, resolve_artifacts, reset_process_state
+from media import MediaTable, MediaInfo
 
 
 class ffmpeg:
@@ -15,6 +33,18 @@ class ffmpeg:
         self.log_warning = ""
         self.log_error = ""
         self.access_video_codec = False
+        self.progress_callback = None
+        self.progress_enabled = False
+        self.total_duration = None
+        self.seek_range = None
+        self.artifacts = None
+        self.record = None  # 最近一次 run 的 metrics.JobRecord
+        self.preflight = True  # run 前按能力清单预检
+        self.branches = None  # split 之后每一路输出各自的滤镜链
+        self.branch = None
+        self.split_source = None
+        self.split_at = None
+        self.copy_branches = set()  # 选了 -c:v copy 的分流输出，validate 时报错
 
         if hide_banner:
             self.head_cmd.extend(["-hide_banner"])
@@ -36,22 +66,36 @@ class ffmpeg:
 
         return self
 
-    def input(self, input_path):
-        path = Path(input_path)
-        if path.is_file():
-            self.add_args(["-i", input_path])
-
-        elif path.is_dir():
-            files = sorted([str(f) for f in path.iterdir() if f.is_file()])
-            for f in files:
-                self.add_args(["-i", f])
-
-        elif isinstance(input_path, (list, tuple)):
+    def input(self, input_path, ss=None, to=None):
+        """
+        :param ss: 输入端起始时间（秒），放在 -i 之前，走快速定位
+        :param to: 输入端结束时间（秒）
+        """
+        seek = []
+        if ss is not None:
+            seek += ["-ss", f"{ss:.6f}"]
+            if to is not None:
+                seek += ["-t", f"{to - ss:.6f}"]
+        elif to is not None:
+            seek += ["-to", f"{to:.6f}"]
+        if seek:
+            self.seek_range = (ss or 0.0, to)
+
+        if isinstance(input_path, (list, tuple)):
             for f in input_path:
                 if not Path(f).is_file():
                     self.log_error += f"❌ 输入不存在: {f}\n"
                 else:
-                    self.add_args(["-i", f])
+                    self.add_args(seek + ["-i", f])
+
+        elif Path(input_path).is_file():
+            self.add_args(seek + ["-i", input_path])
+
+        elif Path(input_path).is_dir():
+            # 输入顺序决定流序号，这里要稳定的名称顺序
+            for f in scan.scan(input_path, extensions=None, sort=True):
+                self.add_args(seek + ["-i", f])
+
         else:
             self.log_error += "❌ 输入异常\n"
 
@@ -67,6 +111,8 @@ class ffmpeg:
         self.add_args(["-c:v", codec])
         if codec != "copy":
             self.access_video_codec = True
+        elif self.branch is not None:
+            self.copy_branches.add(self.branch)
 
         return self
 
@@ -143,7 +189,9 @@ class ffmpeg:
             if setsar:
                 vf_command += f"setsar=1,"
 
-            if vf_command != "":
+            if vf_command != "" and self.branch is not None:
+                self.branches[self.branch].append(vf_command[:-1])
+            elif vf_command != "":
                 self.add_args(["-vf", f"{vf_command[:-1]}"])
             else:
                 self.log_warning += "⚠️ 未指定滤镜参数，vf未生效。\n"
@@ -183,11 +231,86 @@ class ffmpeg:
 
         return self
 
+    def loudnorm(self, measured=True, target=loudness.DEFAULT_TARGET, true_peak=loudness.DEFAULT_TRUE_PEAK,
+                 lra=loudness.DEFAULT_LRA, sample_rate=48000):
+        """
+        一遍完成 EBU R128 响度归一化（需配合音频重编码）
+        :param measured: True 时对首个输入做 loudnorm 测量（按文件指纹缓存，重跑不再测量）；
+                         也可直接传 loudness.measure 的结果；False 时用单遍动态模式
+        :param target: 目标节目响度（LUFS）
+        :param sample_rate: loudnorm 输出固定 192kHz，用 -ar 重采样回这个采样率；None 时不设置
+        """
+        if measured is True:
+            inputs = self.inputs()
+            try:
+                measured = loudness.measure(inputs[0], target, true_peak, lra) if inputs else None
+            except RuntimeError as e:
+                self.log_error += f"{e}\n"
+                return self
+            if measured is None:
+                self.log_error += "❌ 未指定输入，无法测量响度，请先调用 .input()\n"
+                return self
+
+        chain = loudness.loudnorm_filter(measured or None, target, true_peak, lra)
+        if chain is None:
+            self.log_warning += "⚠️ 音轨为静音，跳过响度归一化。\n"
+            return self
+        self.add_args(["-af", chain])
+        if sample_rate:
+            self.audio_sample_rate(sample_rate)
+
+        return self
+
     def map(self, stream_spec):
         self.add_args(["-map", stream_spec])
 
         return self
 
+    def split(self, n, stream="0:v"):
+        """
+        单次解码、多路输出：用 -filter_complex 的 split 把视频流分成 n 路
+        之后用 stream(i) 切到第 i 路，照常调用 video_codec / video_quality / preset / vf / output
+        :param stream: 被分流的输入流
+        """
+        if self.branches is not None:
+            self.log_error += "❌ 已经调用过 split。\n"
+        elif not isinstance(n, int) or n < 2:
+            self.log_error += f"❌ 分流数必须是不小于 2 的整数。({n})\n"
+        else:
+            self.branches = [[] for _ in range(n)]
+            self.split_source = stream
+            self.split_at = len(self.body_cmd)
+
+        return self
+
+    def stream(self, index, audio=True):
+        """
+        切换到 split 的第 index 路输出，此后的编码参数与 vf 只作用于这一路
+        :param audio: 是否同时映射首个输入的音频流（不存在时忽略）
+        """
+        if self.branches is None or not 0 <= index < len(self.branches):
+            self.log_error += f"❌ 分流输出不存在: {index}\n"
+            return self
+
+        # 上一路的输出路径落到参数中间，end_cmd 始终只保留最后一路
+        self.body_cmd += self.end_cmd
+        self.end_cmd = []
+        self.branch = index
+        self.access_video_codec = False
+        self.map(f"[v{index}]")
+        if audio:
+            self.map("0:a?")
+
+        return self
+
+    def filter_graph(self):
+        n = len(self.branches)
+        graph = f"[{self.split_source}]split={n}" + "".join(f"[s{i}]" for i in range(n))
+        for i, chain in enumerate(self.branches):
+            graph += f";[s{i}]{','.join(chain) or 'null'}[v{i}]"
+
+        return graph
+
     def metadata(self, clean=False, title=None, artist=None, album=None, genre=None, comment=None, creation_time=None):
         if clean:
             self.add_args(["-map_metadata", "-1"])
@@ -220,28 +343,180 @@ class ffmpeg:
 
         return self
 
+    def progress(self, callback=None, total=None):
+        """
+        挂载 -progress pipe:1 并实时解析进度
+        :param callback: 每个进度区块回调一次，参数为 read_progress 产出的字典
+        :param total: 总时长（秒），默认运行时从首个输入的探测结果获取
+        """
+        if not self.progress_enabled:
+            self.head_cmd.extend(["-progress", "pipe:1", "-nostats"])
+            self.progress_enabled = True
+        self.progress_callback = callback
+        self.total_duration = total
+
+        return self
+
+    def branch_problems(self):
+        """分流输出的视频来自 filter_complex，只能重新编码，不能流复制"""
+        return [f"分流输出 {i} 的视频来自滤镜图，不能使用 -c:v copy" for i in sorted(self.copy_branches)]
+
+    def validate(self):
+        """按本机 ffmpeg 的能力清单预检编码器、像素格式与滤镜，问题记入 log_error，run 时不再启动进程"""
+        for problem in self.branch_problems():
+            self.log_error += f"❌ {problem}\n"
+        registry = caps.capabilities(self.head_cmd[0])
+        if registry is not None:
+            for problem in registry.validate(self.cmd()):
+                self.log_error += f"❌ {problem}\n"
+        self.preflight = False
+
+        return self
+
+    def artifact_cache(self, artifacts=True):
+        """
+        开启内容寻址的产物缓存：输入内容与参数都相同的命令直接复用缓存里的输出，不再运行 ffmpeg
+        :param artifacts: True 用默认缓存目录，也可传 ArtifactCache 实例或目录路径
+        """
+        self.artifacts = resolve_artifacts(artifacts)
+
+        return self
+
+    def inputs(self):
+        return input_paths(self.body_cmd)
+
+    def progress_total(self):
+        if self.total_duration is None:
+            paths = self.inputs()
+            if self.seek_range is not None and self.seek_range[1] is not None:
+                self.total_duration = self.seek_range[1] - self.seek_range[0]
+            elif paths:
+                self.total_duration = media_duration(paths[0])
+                if self.total_duration is not None and self.seek_range is not None:
+                    self.total_duration -= self.seek_range[0]
+
+        return self.total_duration
+
     def output(self, output_path):
         self.end_cmd += [output_path]
 
         return self
 
     def final_cmd_combination(self):
-        self.combined_cmd = self.head_cmd + self.body_cmd + self.end_cmd
+        self.combined_cmd = self.cmd()
 
     def cmd(self):
-        return self.head_cmd + self.body_cmd + self.end_cmd
+        body = self.body_cmd
+        if self.branches is not None:
+            body = body[:self.split_at] + ["-filter_complex", self.filter_graph()] + body[self.split_at:]
+
+        return self.head_cmd + body + self.end_cmd
 
     def run(self):
+        for snapshot in self.run_iter():
+            if self.progress_callback is not None:
+                self.progress_callback(snapshot)
+
+    def run_iter(self):
+        """执行并逐个产出进度字典（需先调用 progress()，否则不产出任何进度）"""
+        if self.preflight and self.log_error == "":
+            self.validate()
         self.final_cmd_combination()
+        command, output = self.combined_cmd, self.combined_cmd[-1]
+        artifact_key = None
+        # 输出已存在又没有 -y 时不碰产物缓存，交给 ffmpeg 自己询问或按 -n 跳过，不能替用户覆盖
+        writable = "-y" in self.combined_cmd or not os.path.exists(output)
+        if self.log_error == "" and self.artifacts is not None and writable:
+            artifact_key = self.artifacts.key(self.combined_cmd)
+            if artifact_key is not None and self.artifacts.fetch(artifact_key, output):
+                self.log_correct += f"♻️ 命中产物缓存: {output}\n"
+                self.print_log()
+                return
+            if artifact_key is not None:
+                # 缓存里的产物可能与输出共用 inode，必须写临时文件再改名，不能原地截断
+                command = command[:-1] + [journal.part_path(output)]
+
         if self.log_error == "":
             try:
-                subprocess.run(self.combined_cmd)
-                self.log_correct += f"✅ 操作完成: {self.combined_cmd[-1]}\n"
-            except subprocess.CalledProcessError as e:
-                self.log_error += f"❌ 执行失败:, {e}\n"
+                stdout = subprocess.PIPE if self.progress_enabled else None
+                start = time.monotonic()
+                proc = subprocess.Popen(command, stdout=stdout, text=True, errors="replace")
+                try:
+                    snapshot = None
+                    if self.progress_enabled:
+                        for snapshot in read_progress(proc.stdout, self.progress_total()):
+                            yield snapshot
+                    usage = metrics.wait_rusage(proc)
+                    returncode = proc.returncode
+                finally:
+                    # 调用方提前停止迭代时不留下孤儿进程
+                    if proc.poll() is None:
+                        proc.kill()
+                        proc.wait()
+                    if proc.stdout is not None:
+                        proc.stdout.close()
+
+                wall = time.monotonic() - start
+                # concat 清单要展开成清单里的文件，输入体积才算得对
+                inputs = journal.expanded_inputs(self.body_cmd)
+                if returncode == 0:
+                    if artifact_key is not None:
+                        os.replace(command[-1], output)
+                        self.artifacts.store(artifact_key, output)
+                    self.log_correct += f"✅ 操作完成: {output}\n"
+                    # 没有进度消费者时不为统计倍速额外跑一次 ffprobe，只用调用方给出的总时长
+                    duration = snapshot["out_time"] if snapshot is not None else self.total_duration
+                    self.record = metrics.JobRecord(output, command, returncode, wall, usage, inputs=inputs,
+                                                    output=output, duration=duration, status="done")
+                else:
+                    self.log_error += f"❌ 执行失败: 退出码 {returncode}\n"
+                    self.record = metrics.JobRecord(output, command, returncode, wall, usage, inputs=inputs,
+                                                    status="failed")
             except Exception as e:
                 self.log_error += f"❌ 未知错误:, {e}\n"
+            finally:
+                if artifact_key is not None and os.path.exists(command[-1]):
+                    os.remove(command[-1])
+
+        self.print_log()
 
+    async def run_async(self, timeout=None):
+        """
+        run 的 asyncio 版本，不阻塞事件循环
+        :param timeout: 超时秒数，超时后杀掉 ffmpeg 进程
+        :return: 退出码，未执行时为 None
+        """
+        if self.preflight and self.log_error == "":
+            self.validate()
+        self.final_cmd_combination()
+        returncode = None
+        if self.log_error == "":
+            try:
+                proc = await asyncio.create_subprocess_exec(*self.combined_cmd, stdin=asyncio.subprocess.DEVNULL)
+            except OSError as e:
+                self.log_error += f"❌ 未知错误:, {e}\n"
+            else:
+                try:
+                    returncode = await asyncio.wait_for(proc.wait(), timeout)
+                except asyncio.TimeoutError:
+                    self.log_error += f"❌ 执行超时({timeout}s): {self.combined_cmd[-1]}\n"
+                except asyncio.CancelledError:
+                    await _kill_async(proc)
+                    raise
+                finally:
+                    if proc.returncode is None:
+                        await _kill_async(proc)
+
+                if returncode == 0:
+                    self.log_correct += f"✅ 操作完成: {self.combined_cmd[-1]}\n"
+                elif returncode is not None:
+                    self.log_error += f"❌ 执行失败: 退出码 {returncode}\n"
+
+        self.print_log()
+
+        return returncode
+
+    def print_log(self):
         run_log = "LOG\n"
         run_log += f"️⚙️ 指令组装：{self.combined_cmd}\n"
         run_log += self.log_correct
@@ -250,12 +525,125 @@ class ffmpeg:
         print(run_log)
 
 
+async def _kill_async(proc):
+    try:
+        proc.kill()
+    except ProcessLookupError:
+        pass
+    await proc.wait()
+
+
+async def gather_limited(tasks, limit=32, timeout=None):
+    """
+    限流并发执行一批协程
+    :param tasks: 协程或返回协程的无参可调用对象（如 lambda: exe.run_async()）
+    :param limit: 同时运行的任务上限
+    :param timeout: 单个任务的超时秒数
+    :return: 与输入同序的结果列表，失败或超时的位置为对应异常对象
+    """
+    sem = asyncio.Semaphore(limit)
+
+    async def _one(task):
+        async with sem:
+            coro = task() if callable(task) else task
+            return await asyncio.wait_for(coro, timeout)
+
+    return await asyncio.gather(*(_one(t) for t in tasks), return_exceptions=True)
+
+
+def input_paths(args):
+    return [args[i + 1] for i, a in enumerate(args[:-1]) if a == "-i"]
+
+
+# 不带取值的常用选项，其余选项一律视为带一个取值
+NO_VALUE_FLAGS = {"-y", "-n", "-hide_banner", "-nostdin", "-stdin", "-nostats", "-stats", "-an", "-vn", "-sn", "-dn",
+                  "-shortest", "-re", "-copyts", "-start_at_zero", "-accurate_seek", "-noaccurate_seek",
+                  "-autorotate", "-noautorotate", "-xerror", "-benchmark", "-benchmark_all", "-debug_ts",
+                  "-ignore_unknown", "-copy_unknown", "-fix_sub_duration", "-dump", "-hex", "-report"}
+
+
+def output_indices(args):
+    """命令里所有输出路径的下标（split 多路输出时中间也有），即既不是选项也不是选项取值的参数"""
+    indices = []
+    i = 1
+    while i < len(args):
+        a = args[i]
+        if a.startswith("-") and a != "-":
+            i += 1 if a in NO_VALUE_FLAGS else 2
+            continue
+        indices.append(i)
+        i += 1
+
+    return indices
+
+
+def output_paths(args):
+    return [args[i] for i in output_indices(args)]
+
+
+def media_duration(path, cache=True):
+    """首个输入的容器时长（秒），走探测缓存；拿不到时返回 None"""
+    try:
+        return ffprobe(cache=cache).input(path, ("v", 0)).duration()
+    except (RuntimeError, FileNotFoundError, ValueError):
+        return None
+
+
+def _clock_seconds(value):
+    h, m, sec = value.split(":")
+    return int(h) * 3600 + int(m) * 60 + float(sec)
+
+
+def read_progress(stream, total=None):
+    """
+    逐行解析 ffmpeg -progress 的 key=value 输出，每个区块（progress=continue/end）产出一次
+    :return: {"frame", "fps", "out_time", "bitrate", "speed", "total", "percent", "eta", "end"}
+    """
+    fields = {}
+    for line in stream:
+        key, _, value = line.strip().partition("=")
+        if not key:
+            continue
+        fields[key] = value
+        if key != "progress":
+            continue
+
+        snapshot = {"frame": None, "fps": None, "out_time": None, "bitrate": None, "speed": None,
+                    "total": total, "percent": None, "eta": None, "end": value == "end"}
+        try:
+            snapshot["frame"] = int(fields.get("frame", 0))
+            snapshot["fps"] = float(fields.get("fps", 0))
+        except ValueError:
+            pass
+        us = fields.get("out_time_us", fields.get("out_time_ms", "N/A"))
+        if us.lstrip("-").isdigit():
+            snapshot["out_time"] = max(0, int(us)) / 1000000
+        elif ":" in fields.get("out_time", ""):
+            snapshot["out_time"] = max(0.0, _clock_seconds(fields["out_time"].lstrip("-")))
+        if fields.get("bitrate", "N/A").endswith("kbits/s"):
+            snapshot["bitrate"] = float(fields["bitrate"][:-len("kbits/s")])
+        if fields.get("speed", "N/A").endswith("x"):
+            snapshot["speed"] = float(fields["speed"][:-1])
+
+        if total and snapshot["out_time"] is not None:
+            snapshot["percent"] = min(100.0, snapshot["out_time"] / total * 100)
+            if snapshot["speed"]:
+                snapshot["eta"] = max(0.0, (total - snapshot["out_time"]) / snapshot["speed"])
+
+        yield snapshot
+        fields = {}
+
+
 class ffprobe:
-    def __init__(self, hide_banner=False):
+    def __init__(self, hide_banner=False, cache=True, fast=True):
         self.hide_banner = hide_banner
         self.body_cmd = []
         self.head_cmd = ['ffprobe', '-v', 'error']  # 默认安静模式
         self.input_target = None
+        self.cache = resolve_cache(cache)
+        self.fast = fast  # 请求字段可由容器头直接解析时跳过 ffprobe
+        self.entries = None
+        self.select = None
 
         if hide_banner:
             self.head_cmd.extend(["-hide_banner"])
@@ -268,6 +656,7 @@ class ffprobe:
             self.add_args(["-show_streams"])
         elif stream[0] in ["v", "a", "s"] and isinstance(stream[1], int):
             self.add_args(["-select_streams", f"{stream[0]}:{stream[1]}"])
+            self.select = (stream[0], stream[1])
 
         if not os.path.isfile(input_path):
             raise FileNotFoundError(f"❌ 输入文件不存在: {input_path}")
@@ -280,13 +669,48 @@ class ffprobe:
         if params is None:
             # 一股脑全拿，包含所有流信息和容器信息
             self.add_args(["-show_format", "-show_streams"])
+            self.fast = False
         elif isinstance(params, str):
             self.add_args(["-show_entries", f"stream=codec_type,index,{params}"])
+            self.entries = [p.strip() for p in params.split(",") if p.strip()]
         else:
             raise FileNotFoundError(f"❌ 输入参数格式有误: 输入格式为{type(params)}，应当为str。")
 
         return self
 
+    def cache_key(self, fmt="json"):
+        # show_entries 的字段顺序不影响结果，排序后作为缓存键
+        args = []
+        for a in self.body_cmd:
+            if a.startswith("stream="):
+                a = "stream=" + ",".join(sorted(set(a[len("stream="):].split(","))))
+            args.append(a)
+
+        return " ".join(args + ["-of", fmt])
+
+    def _lookup(self, fmt, key):
+        # 缓存 -> 容器头快速解析，都拿不到时返回 None
+        data = None
+        if self.cache is not None and fmt == "json":
+            data = self.cache.get(self.input_target[0], key)
+
+        if data is None and self.fast and fmt == "json" and self.entries is not None:
+            data = header.probe(self.input_target[0], self.entries, self.select)
+            if data is not None and self.cache is not None:
+                self.cache.put(self.input_target[0], key, data)
+
+        return data
+
+    def _parse(self, fmt, key, stdout):
+        if fmt == "json":
+            data = json.loads(stdout)
+            if self.cache is not None:
+                self.cache.put(self.input_target[0], key, data)
+        else:
+            data = stdout.strip()
+
+        return data
+
     def export(self, fmt="json", core=False):
         """
         执行 ffprobe，返回解析结果
@@ -297,44 +721,157 @@ class ffprobe:
         if not self.input_target:
             raise RuntimeError("❌ 未指定输入文件，请先调用 .input()")
 
-        command = self.head_cmd + self.body_cmd + ["-of", fmt] + self.input_target
-        print(command)
-        try:
-            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
+        return self._streams(self._data(fmt), core)
 
-            if fmt == "json":
-                data = json.loads(result.stdout)
-            else:
-                data = result.stdout.strip()
-
-            streams = data.get("streams", [])
-            if not streams:
-                return {} if not core else []
-
-            if core:
-                core_streams = []
-                found_types = {"video": False, "audio": False, "subtitle": False}
-                for s in streams:
-                    stype = s.get("codec_type")
-                    if stype == "video" and not found_types["video"]:
-                        core_streams.append(s)
-                        found_types["video"] = True
-                    elif stype == "audio" and not found_types["audio"]:
-                        core_streams.append(s)
-                        found_types["audio"] = True
-                    elif stype == "subtitle" and not found_types["subtitle"]:
-                        core_streams.append(s)
-                        found_types["subtitle"] = True
-                return core_streams
-
-            return streams
-
-        except subprocess.CalledProcessError as e:
-            raise RuntimeError(f"❌ ffprobe 执行失败: {e.stderr}")
+    def duration(self):
+        """容器时长（秒）"""
+        if not self.input_target:
+            raise RuntimeError("❌ 未指定输入文件，请先调用 .input()")
+
+        self.add_args(["-show_entries", "format=duration"])
+        self.fast = False
+        value = self._data("json").get("format", {}).get("duration")
+
+        return float(value) if value not in (None, "N/A") else None
+
+    def keyframes(self):
+        """首个视频流的关键帧时间戳（秒），逐行读取 csv 输出而不整体载入，结果与探测数据一起缓存"""
+        if not self.input_target:
+            raise RuntimeError("❌ 未指定输入文件，请先调用 .input()")
+
+        key = "keyframes v:0"
+        if self.cache is not None:
+            times = self.cache.get(self.input_target[0], key)
+            if times is not None:
+                return times
+
+        command = (self.head_cmd + ["-select_streams", "v:0", "-show_entries", "packet=pts_time,flags", "-of", "csv"]
+                   + self.input_target)
+        times = []
+        with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True) as proc:
+            for line in proc.stdout:
+                parts = line.strip().split(",")
+                if len(parts) == 3 and parts[0] == "packet" and "K" in parts[2] and parts[1] != "N/A":
+                    times.append(float(parts[1]))
+            stderr = proc.stderr.read()
+        if proc.returncode != 0:
+            raise RuntimeError(f"❌ ffprobe 执行失败: {stderr}")
+
+        times.sort()
+        if self.cache is not None:
+            self.cache.put(self.input_target[0], key, times)
+
+        return times
+
+    def packet_count(self):
+        """逐包计数得到的视频帧数（-count_packets），比头部 nb_frames 可靠"""
+        self.add_args(["-count_packets"])
+        self.show_entries("nb_read_packets")
+        streams = self.export(core=True)
+
+        return int(streams[0]["nb_read_packets"]) if streams else None
+
+    def _data(self, fmt):
+        key = self.cache_key(fmt)
+        data = self._lookup(fmt, key)
+
+        if data is None:
+            command = self.head_cmd + self.body_cmd + ["-of", fmt] + self.input_target
+            try:
+                result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
+            except subprocess.CalledProcessError as e:
+                raise RuntimeError(f"❌ ffprobe 执行失败: {e.stderr}")
+
+            data = self._parse(fmt, key, result.stdout)
+
+        return data
+
+    async def export_async(self, fmt="json", core=False, timeout=None):
+        """
+        export 的 asyncio 版本
+        :param timeout: 超时秒数，超时后杀掉 ffprobe 进程
+        """
+        if not self.input_target:
+            raise RuntimeError("❌ 未指定输入文件，请先调用 .input()")
+
+        key = self.cache_key(fmt)
+        data = await asyncio.to_thread(self._lookup, fmt, key)
+
+        if data is None:
+            command = self.head_cmd + self.body_cmd + ["-of", fmt] + self.input_target
+            proc = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE,
+                                                        stderr=asyncio.subprocess.PIPE)
+            try:
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+            except asyncio.TimeoutError:
+                raise RuntimeError(f"❌ ffprobe 执行超时({timeout}s): {self.input_target[0]}")
+            finally:
+                if proc.returncode is None:
+                    await _kill_async(proc)
+
+            if proc.returncode != 0:
+                raise RuntimeError(f"❌ ffprobe 执行失败: {stderr.decode(errors='replace')}")
+
+            data = self._parse(fmt, key, stdout.decode(errors="replace"))
+
+        return self._streams(data, core)
+
+    @staticmethod
+    def _streams(data, core):
+        streams = data.get("streams", [])
+        if not streams:
+            return {} if not core else []
+
+        if core:
+            core_streams = []
+            found_types = {"video": False, "audio": False, "subtitle": False}
+            for s in streams:
+                stype = s.get("codec_type")
+                if stype == "video" and not found_types["video"]:
+                    core_streams.append(s)
+                    found_types["video"] = True
+                elif stype == "audio" and not found_types["audio"]:
+                    core_streams.append(s)
+                    found_types["audio"] = True
+                elif stype == "subtitle" and not found_types["subtitle"]:
+                    core_streams.append(s)
+                    found_types["subtitle"] = True
+            return core_streams
+
+        return streams
+
+
+# 编解码器名 -> 默认编码器
+ENCODERS = {"h264": "libx264", "hevc": "libx265", "vp9": "libvpx-vp9", "av1": "libaom-av1", "mpeg4": "mpeg4",
+            "aac": "aac", "mp3": "libmp3lame", "opus": "libopus", "vorbis": "libvorbis", "ac3": "ac3",
+            "flac": "flac"}
+
+
+def _probe_streams(path, entries, cache):
+    # 模块级函数，保证进程池可以 pickle
+    info = ffprobe(cache=cache).input(path)
+    info.show_entries(entries)
+    return info.export(core=True)
+
+
+def _probe_media(path, entries, cache):
+    """探测为 MediaInfo，探测缓存里只存它的紧凑序列化（槽位序号变了要改版本号）"""
+    probe_cache = resolve_cache(cache)
+    key = f"media v1 {entries}"
+    if probe_cache is not None:
+        data = probe_cache.get(path, key)
+        if data is not None:
+            return MediaInfo.unpack(path, data)
+
+    info = MediaInfo.from_streams(path, _probe_streams(path, entries, False))
+    if probe_cache is not None:
+        probe_cache.put(path, key, info.pack())
+
+    return info
 
 
 class FPU:
-    def __init__(self):
+    def __init__(self, cache=True, workers=None, executor="thread"):
         self.video_core = (
             "codec_name,codec_long_name,codec_type,profile,width,height,coded_width,coded_height,pix_fmt,"
             "field_order,sample_aspect_ratio,display_aspect_ratio,r_frame_rate,avg_frame_rate,time_base,"
@@ -342,27 +879,24 @@ class FPU:
         self.audio_core = (
             "codec_name,codec_long_name,codec_type,profile,codec_tag_string,codec_tag,sample_fmt,sample_rate,"
             "channels,channel_layout,bits_per_sample,time_base,duration,duration_ts,nb_frames,bit_rate,index")
+        # concat 流复制真正要求一致的字段
+        self.concat_video = "codec_name,width,height,pix_fmt,r_frame_rate"
+        self.concat_audio = "codec_name,sample_rate,channels,channel_layout,sample_fmt"
+        self.cache = cache
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 2)
+        self.executor = executor
+        self.probe_errors = {}
         self.log_correct = ""
         self.log_warning = ""
         self.log_error = ""
 
     def video_margin_fill(self, video_path, output_path, size, codec):
-        info = ffprobe().input(video_path, ('v', 0)).show_entries("width,height").export(core=True)
-        width, height = info["width"], info["height"]
-
-        video_ratio = width / height
-        output_ratio = size[0] / size[1]
+        info = ffprobe(cache=self.cache).input(video_path, ('v', 0)).show_entries("width,height").export(core=True)
+        width, height = info[0]["width"], info[0]["height"]
 
-        keep_aspect = None
-        pad = None
-
-        if abs(video_ratio - output_ratio) < 1e-6:
-            align = size
+        align, keep_aspect, pad = self._fit(width, height, size)
+        if pad is None:
             self.log_warning += f"⚠️ {video_path}视频流比例与目标相同。\n"
-        else:
-            keep_aspect = "h" if video_ratio < output_ratio else "w"
-            align = size[0] if keep_aspect == "w" else size[1]
-            pad = size
 
         exe = ffmpeg().input(video_path)
         exe.video_codec(codec=codec)
@@ -371,45 +905,203 @@ class FPU:
 
         return exe
 
-    def videos_core_info_detect(self, input_videos):
-        def _fps_transform(info_fps):
-            num, den = map(int, info_fps.split("/"))
-            fps = num / den if den else 0
+    def rendition_ladder(self, video_path, renditions, codec="libx264", preset=None, audio_codec="aac"):
+        """
+        一次解码输出多档分辨率（split + 多路 map），省去每档各自解码一遍
+        :param renditions: [(输出路径, 目标高度, 质量), ...]，质量为 int 时按 crf，为 str 时按码率
+        :return: ffmpeg 构造器
+        """
+        exe = ffmpeg().input(video_path).split(len(renditions))
+        for i, (output_path, height, quality) in enumerate(renditions):
+            exe.stream(i).video_codec(codec).video_quality(quality)
+            if preset is not None:
+                exe.preset(preset)
+            exe.vf(size=height, keep_aspect="h", setsar=True)
+            exe.audio_codec(audio_codec)
+            exe.output(output_path)
 
-            return fps
+        return exe
 
-        info_data = {}
+    @staticmethod
+    def _fit(width, height, size):
+        # 等比缩放后补边到目标尺寸，返回 vf 需要的 (size, keep_aspect, pad)
+        video_ratio = width / height
+        output_ratio = size[0] / size[1]
 
-        for iv in input_videos:
-            info = ffprobe().input(iv)
-            info.show_entries(self.video_core + self.audio_core)
-            info = info.export(core=True)
+        if abs(video_ratio - output_ratio) < 1e-6:
+            return size, None, None
 
-            v_data = {}
-            for vi in self.video_core.split(","):
-                if vi not in ["r_frame_rate", "avg_frame_rate"]:
-                    v_data[vi] = info[0][vi]
-                else:
-                    v_data[vi] = _fps_transform(info[0][vi])
+        keep_aspect = "h" if video_ratio < output_ratio else "w"
+        align = size[0] if keep_aspect == "w" else size[1]
 
-            a_data = {}
-            for ai in self.audio_core.split(","):
-                a_data[ai] = info[1][ai]
+        return align, keep_aspect, size
 
-            s_data = {"video": v_data, "audio": a_data}
-            info_data[iv] = s_data
+    def probe_batch(self, input_videos, entries=None, workers=None, executor=None):
+        """
+        并发探测一组文件
+        :param entries: show_entries 字段，默认 video_core + audio_core
+        :param workers: 并发上限，默认 self.workers
+        :param executor: "thread" 或 "process"
+        :return: 与输入同序的 [(路径, 流列表 or None, 错误信息 or None), ...]
+        """
+        return list(self.probe_iter(input_videos, entries, workers=workers, executor=executor))
+
+    def probe_iter(self, input_videos, entries=None, workers=None, executor=None, typed=False):
+        """
+        probe_batch 的流式版本：input_videos 可以是生成器（如 scan.scan），边读入边提交探测，
+        按输入顺序逐个产出 (路径, 流列表 or None, 错误信息 or None)，在途任务数有上限
+        :param typed: True 时产出 MediaInfo 而不是流列表
+        """
+        if entries is None:
+            entries = f"{self.video_core},{self.audio_core}"
+        workers = max(1, workers or self.workers)
+        executor = executor or self.executor
+
+        cache = self.cache
+        if executor == "process":
+            pool_cls = ProcessPoolExecutor
+            # SQLite 连接无法跨进程传递：只发库路径，子进程先丢掉 fork 继承来的连接再各自打开
+            cache = resolve_cache(cache)
+            if cache is not None:
+                cache = cache.db_path
+            pool_kwargs = {"initializer": reset_process_state}
+        elif executor == "thread":
+            pool_cls = ThreadPoolExecutor
+            pool_kwargs = {}
+        else:
+            raise ValueError(f"❌ 不支持的 executor: {executor}")
+
+        def _result(iv, fut):
+            try:
+                return iv, fut.result(), None
+            except Exception as e:
+                return iv, None, str(e)
+
+        # 在途窗口只保留几倍于并发数的任务，扫描再快也不会一次性堆积十万个 future
+        window = workers * 4
+        pending = deque()
+        with pool_cls(max_workers=workers, **pool_kwargs) as pool:
+            for iv in input_videos:
+                pending.append((iv, pool.submit(_probe_media if typed else _probe_streams, iv, entries, cache)))
+                if len(pending) >= window:
+                    yield _result(*pending.popleft())
+            while pending:
+                yield _result(*pending.popleft())
+
+    def videos_core_info_detect(self, input_videos, v_params=None, a_params=None, workers=None, executor=None):
+        """
+        :return: {路径: MediaInfo}；info["video"] / info["audio"] 按流类型取，数值字段已解析，帧率为 Fraction
+        """
+        # 只探测需要的字段，字段集较小时可以走容器头快速解析
+        if v_params is None:
+            v_params = self.video_core
+        if a_params is None:
+            a_params = self.audio_core
+        v_keys = [p.strip() for p in v_params.split(",") if p.strip()]
+        a_keys = [p.strip() for p in a_params.split(",") if p.strip()]
+        entries = ",".join(dict.fromkeys(v_keys + a_keys))
+
+        info_data = {}
+
+        for iv, info, err in self.probe_iter(input_videos, entries, workers=workers, executor=executor, typed=True):
+            if err is None and not info.streams:
+                err = "没有可用的音视频流"
+
+            if err is not None:
+                self.probe_errors[iv] = err
+                self.log_error += f"❌ 侦测失败: {iv} ({err})\n"
+                continue
+
+            info_data[iv] = info
 
         self.log_correct += f"✅ {len(info_data)}个项目已侦测。\n"
 
         return info_data
 
-    def videos_consistency_detect(self, input_videos, v_params=None, a_params=None):
+    def videos_timing_detect(self, input_videos, workers=None):
+        """
+        逐包分析首个视频流的实际时间戳（需要 numpy），流头部看不出的变帧率、GOP 不规整都能查出来
+        :return: {路径: {"vfr", "measured_fps", "gop_max", "summary"}}，分析失败的文件不在结果里
+        """
+        workers = max(1, workers or self.workers)
+        timing = {}
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {iv: pool.submit(packets.timing_summary, iv, "v:0", self.cache) for iv in input_videos}
+            for iv, fut in futures.items():
+                try:
+                    summary = fut.result()
+                except ImportError as e:
+                    # 缺 numpy 时每个文件都会失败，报一次就停，不影响批次里的其他检测
+                    self.log_error += f"{e}\n"
+                    for f in futures.values():
+                        f.cancel()
+                    break
+                except (RuntimeError, FileNotFoundError) as e:
+                    self.log_error += f"❌ 包级分析失败: {iv} ({e})\n"
+                    continue
+                rate = summary["frame_rate"]
+                timing[iv] = {"vfr": rate["vfr"],
+                              "measured_fps": round(rate["measured"], 3) if rate["measured"] else None,
+                              "gop_max": summary["gop"]["max"],
+                              "summary": summary}
+                if rate["vfr"]:
+                    self.log_warning += (f"⚠️ 变帧率: {iv}（{rate['irregular']:.1%} 的帧间隔不规整，"
+                                         f"平均 {rate['fps_mean']:.3f} fps）\n")
+
+        self.log_correct += f"✅ {len(timing)}个项目已完成包级分析。\n"
+
+        return timing
+
+    def loudness_detect(self, input_videos, target=loudness.DEFAULT_TARGET, true_peak=loudness.DEFAULT_TRUE_PEAK,
+                        lra=loudness.DEFAULT_LRA, workers=None):
+        """
+        并行做 loudnorm 测量（只解码音频），结果按文件指纹缓存
+        :return: {路径: loudness.measure 的结果}，没有音轨或测量失败的文件不在结果里
+        """
+        workers = max(1, workers or self.workers)
+        measured = {}
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {iv: pool.submit(loudness.measure, iv, target, true_peak, lra, 0, self.cache)
+                       for iv in input_videos}
+            for iv, fut in futures.items():
+                try:
+                    measured[iv] = fut.result()
+                except RuntimeError:
+                    self.log_warning += f"⚠️ 没有音轨或响度测量失败，跳过: {iv}\n"
+
+        self.log_correct += f"✅ {len(measured)}个项目已完成响度测量。\n"
+
+        return measured
+
+    def videos_duplicate_detect(self, input_videos, threshold=8, frames=5, workers=None):
+        """
+        近重复检测：每个片段只解几个关键帧算感知哈希，经 LSH 索引找出重复，不做两两比较（见 dedup）
+        :param threshold: 平均汉明距离上限（0~64），不超过的一定会被找到
+        :return: 重复组 [[保留的路径, 重复路径, ...], ...]，每组保留最先出现的一个
+        """
+        groups, errors = dedup.find_duplicates(input_videos, frames, threshold, workers or self.workers, self.cache)
+        for f in errors:
+            self.log_warning += f"⚠️ 指纹计算失败，按不重复处理: {f}\n"
+        for g in groups:
+            self.log_warning += f"⚠️ 近重复: {g[1:]} 与 {g[0]} 重复\n"
+        self.log_correct += f"✅ 近重复检测完毕，{len(groups)} 组重复。\n"
+
+        return groups
+
+    def videos_consistency_detect(self, input_videos, v_params=None, a_params=None, info_dict=None, workers=None,
+                                  timing=False):
+        """
+        :param timing: 同时做包级分析（见 videos_timing_detect），把 vfr、measured_fps 作为视频参数参与比较；
+                       GOP 长度不影响能否合并，只在 report["timing"] 里报告
+        """
         if v_params is None:
             v_params = self.video_core
         if a_params is None:
             a_params = self.audio_core
 
-        info_dict = self.videos_core_info_detect(input_videos)
+        # 已有探测结果时直接复用，避免重复探测
+        if info_dict is None:
+            info_dict = self.videos_core_info_detect(input_videos, v_params, a_params, workers=workers)
         report = {"video": {}, "audio": {}, "consistency": True, "outliers_global": {}}
 
         def _params_list(params):
@@ -418,24 +1110,35 @@ class FPU:
         video_keys = _params_list(v_params)
         audio_keys = _params_list(a_params)
 
+        if timing:
+            timing_info = self.videos_timing_detect(list(info_dict), workers=workers)
+            timing_keys = ["vfr", "measured_fps"]
+            info_dict = {f: {"video": dict(d["video"], **{k: timing_info.get(f, {}).get(k) for k in timing_keys}),
+                             "audio": d["audio"]} for f, d in info_dict.items()}
+            video_keys += [k for k in timing_keys if k not in video_keys]
+            report["timing"] = timing_info
+
         outliers_global = {}
+        table = MediaTable.from_info(info_dict, video_keys, audio_keys)
 
         # 遍历两个维度
         for section, keys in [("video", video_keys), ("audio", audio_keys)]:
             for key in keys:
-                values = {}
-                for file, data in info_dict.items():
-                    values[file] = data[section][key]
+                column = f"{section}.{key}"
+                if not len(table):
+                    continue
 
-                # 统计出现次数
-                counter = Counter(values.values())
-                majority, count = counter.most_common(1)[0]
+                # 统计出现次数（按列的字典编码计数）
+                counts = table.counts(column)
+                majority = max(counts, key=counts.get)
+                count = counts[majority]
 
                 # 找出不合群的
-                outliers = {f: v for f, v in values.items() if v != majority}
+                values = table.column(column)
+                outliers = {f: v for f, v in zip(table.paths, values) if v != majority}
 
                 # 是否完全一致
-                consensus = (count == len(values))
+                consensus = (count == len(table))
                 if not consensus:
                     report["consistency"] = False
 
@@ -458,41 +1161,419 @@ class FPU:
 
         return report
 
-    def concat_time_sequence(self, input_path, output_path):
+    def compatibility_clusters(self, input_videos, v_params=None, a_params=None, info_dict=None, workers=None):
+        """
+        把文件按 concat 兼容性分桶：同一桶内的文件可以直接 -c copy 合并
+        :param v_params: 参与分组的视频字段，默认 concat_video
+        :param a_params: 参与分组的音频字段，默认 concat_audio
+        :param info_dict: 已有的 videos_core_info_detect 结果，给出时不再探测
+        :return: 按文件数从多到少排列的 [{"key": {列名: 值}, "count": n, "members": [路径, ...]}, ...]
+        """
+        v_keys = [p.strip() for p in (v_params or self.concat_video).split(",") if p.strip()]
+        a_keys = [p.strip() for p in (a_params or self.concat_audio).split(",") if p.strip()]
+
+        if info_dict is not None:
+            table = MediaTable.from_info(info_dict, v_keys, a_keys)
+        else:
+            # 直接从探测结果建列表，不经过逐文件的嵌套字典
+            # typed=True：与 info_dict 路径一样按 MediaInfo 解析出 Fraction/int，两条路径的分组键一致
+            results = self.probe_iter(input_videos, ",".join(dict.fromkeys(v_keys + a_keys)), workers=workers,
+                                      typed=True)
+            table, errors = MediaTable.from_probe(results, v_keys, a_keys)
+            for iv, err in errors.items():
+                self.probe_errors[iv] = err
+                self.log_error += f"❌ 侦测失败: {iv} ({err})\n"
+
+        clusters = table.group_by()
+        self.log_correct += f"✅ {len(table)}个项目分为{len(clusters)}个兼容组。\n"
+
+        return clusters
+
+    def concat_time_sequence(self, input_path, output_path, workers=None, normalize=False, keep_normalized=False,
+                             streamed=False, dedup=False):
+        """
+        :param normalize: 规格不一致时只把离群文件转成大部队规格（只转不一致的流），再走 -c copy 合并
+        :param streamed: 规格化结果经命名管道（NUT）直接送入合并，不写中间文件（见 pipeline.Pipeline）
+        :param dedup: 合并前剔除近重复片段（见 videos_duplicate_detect），每组保留最先出现的一个
+        """
         def _concat_list(videos_list, text_path):
             with open(text_path, "w", encoding="utf-8") as f:
                 for vp in videos_list:
                     f.write(f"file '{vp}'\n")
 
         input_files = []
+        source = []
         if isinstance(input_path, str):
-            ex = (".mp4", ".mov", ".mkv", ".avi", ".flv")
-            input_files = [os.path.join(input_path, f) for f in os.listdir(input_path) if f.lower().endswith(ex)]
-            input_files.sort()
+            # 目录源边扫描边探测，扫描到的文件同时记入 input_files
+            source = scan.collect(scan.scan(input_path), input_files)
         elif isinstance(input_path, (list, tuple)):
             input_files = list(input_path)
+            source = input_files
         else:
             self.log_error += "❌ 输入规格有误，输入应为视频源列表或目录源。\n"
 
-        if len(input_files) < 2:
-            self.log_error += "❌ 输入规格有误，目录源文件数量应为两个即以上。\n"
+        if dedup and not self.log_error:
+            # 指纹要看全部文件，目录源在这里先扫描完
+            candidates = list(source)
+            if isinstance(input_path, str):
+                candidates.sort()
+            dropped = {f for g in self.videos_duplicate_detect(candidates, workers=workers) for f in g[1:]}
+            input_files = [f for f in candidates if f not in dropped]
+            source = input_files
 
         output_dir = os.path.dirname(output_path)
         output_name = os.path.splitext(os.path.basename(output_path))[0]
         concat_list_path = os.path.join(output_dir, f"{output_name}_concat_list.txt")
-        feasibility = self.videos_consistency_detect(input_files)
-
-        if feasibility["consistency"] is True:
+        info_dict = self.videos_core_info_detect(source, self.concat_video, self.concat_audio, workers=workers)
+        if isinstance(input_path, str):
+            # 目录源按文件系统顺序边扫描边探测，合并顺序在探测完成后按文件名确定
+            input_files.sort()
+        if len(input_files) < 2:
+            self.log_error += "❌ 输入规格有误，目录源文件数量应为两个即以上。\n"
+        feasibility = self.videos_consistency_detect(input_files, self.concat_video, self.concat_audio,
+                                                     info_dict=info_dict)
+
+        # 有的文件没有音轨（或没有画面）时，流复制与规格化都接不上
+        layouts = {(info.has("video"), info.has("audio")) for info in info_dict.values()}
+
+        normalized_dir = None
+        if len(info_dict) != len(input_files):
+            self.log_error += "❌ 存在无法侦测的视频，无法进行合并。\n"
+        elif len(layouts) > 1:
+            missing = [f for f, info in info_dict.items() if not (info.has("video") and info.has("audio"))]
+            self.log_error += f"❌ 音视频流组成不一致，缺少音轨或画面的文件: {missing}\n"
+        elif feasibility["consistency"] is not True and normalize and streamed:
+            self.concat_streamed(input_files, output_path, feasibility, info_dict, workers)
+            return
+        elif feasibility["consistency"] is not True and normalize:
+            normalized_dir = os.path.join(output_dir, f".{output_name}_normalized")
+            input_files = self.normalize_outliers(input_files, feasibility, info_dict, normalized_dir, workers)
+
+        if self.log_error == "" and (feasibility["consistency"] is True or normalized_dir is not None):
             _concat_list(input_files, concat_list_path)
             exe = ffmpeg(hide_banner=True)
             exe.f(concat=True).safe(0).input(concat_list_path).video_codec().audio_codec().output(output_path).run()
             os.remove(concat_list_path)
             self.print_log()
         else:
-            self.log_error += "❌ 视频规格不同，无法进行合并。\n"
+            if feasibility["consistency"] is not True and not normalize:
+                self.log_error += "❌ 视频规格不同，无法进行合并。\n"
             print(feasibility)
             self.print_log()
 
+        if normalized_dir is not None and not keep_normalized:
+            shutil.rmtree(normalized_dir, ignore_errors=True)
+
+    def normalize_outliers(self, input_files, report, info_dict, output_dir, workers=None):
+        """
+        按一致性报告把 outliers_global 中的文件并行转成大部队规格，一致的流直接复制
+        :return: 替换为规格化文件后的输入列表；失败时记录 log_error
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        target_v = {k: v["majority"] for k, v in report["video"].items()}
+        target_a = {k: v["majority"] for k, v in report["audio"].items()}
+
+        # 规格化目录保留任务日志，中断后重跑只补做没完成的文件
+        sched = scheduler.Scheduler(workers=workers, journal=os.path.join(output_dir, ".journal.jsonl"))
+        replaced = {}
+        for f, diff in report["outliers_global"].items():
+            out = os.path.join(output_dir, f"{len(replaced):05d}_{os.path.basename(f)}")
+            exe = self._normalize_builder(f, diff, target_v, target_a, info_dict[f]["video"])
+            exe.output(out)
+            sched.add(exe)
+            replaced[f] = out
+
+        jobs = sched.run()
+        if not all(j.ok for j in jobs):
+            self.log_error += sched.log_error
+        else:
+            self.log_correct += f"✅ {len(replaced)}/{len(input_files)} 个离群文件已规格化。\n"
+
+        return [replaced.get(f, f) for f in input_files]
+
+    def concat_streamed(self, input_files, output_path, report, info_dict, workers=None):
+        """
+        离群文件边规格化边合并：每个片段的处理结果经命名管道送入 concat，只写最终文件
+        :param workers: 同时运行的片段进程数
+        """
+        target_v = {k: v["majority"] for k, v in report["video"].items()}
+        target_a = {k: v["majority"] for k, v in report["audio"].items()}
+
+        pipe = pipeline.Pipeline(fmt="nut", window=workers or 4)
+        for f in input_files:
+            diff = report["outliers_global"].get(f)
+            if diff is None:
+                pipe.add(ffmpeg().input(f).video_codec().audio_codec())
+            else:
+                pipe.add(self._normalize_builder(f, diff, target_v, target_a, info_dict[f]["video"]))
+
+        if pipe.concat(output_path):
+            self.log_correct += pipe.log_correct
+        else:
+            self.log_error += pipe.log_error
+        self.print_log()
+
+    @classmethod
+    def _normalize_builder(cls, f, diff, target_v, target_a, src):
+        """离群文件转成大部队规格的构造器（不含输出），一致的流直接复制
+        :param src: 该文件的视频探测信息
+        """
+        exe = ffmpeg(hide_banner=True, overwrite=True).input(f)
+
+        if diff["video"]:
+            exe.video_codec(ENCODERS.get(target_v.get("codec_name"), target_v.get("codec_name", "libx264")))
+            if "pix_fmt" in target_v:
+                exe.add_args(["-pix_fmt", target_v["pix_fmt"]])
+            size, keep_aspect, pad, fps = None, None, None, None
+            if "width" in target_v and "height" in target_v and \
+                    (src.get("width"), src.get("height")) != (target_v["width"], target_v["height"]):
+                size, keep_aspect, pad = cls._fit(src["width"], src["height"],
+                                                  (target_v["width"], target_v["height"]))
+            if "r_frame_rate" in diff["video"]:
+                fps = str(Fraction(target_v["r_frame_rate"]).limit_denominator(1001))
+            if size is not None or fps is not None:
+                exe.vf(size=size, keep_aspect=keep_aspect, pad=pad, fps=fps, setsar=size is not None)
+        else:
+            exe.video_codec()
+
+        if diff["audio"]:
+            exe.audio_codec(ENCODERS.get(target_a.get("codec_name"), target_a.get("codec_name", "aac")))
+            if "sample_rate" in target_a:
+                exe.audio_sample_rate(target_a["sample_rate"])
+            if "channels" in target_a:
+                exe.audio_channels(target_a["channels"])
+            if "channel_layout" in target_a:
+                exe.audio_channel_layout(target_a["channel_layout"])
+            if "sample_fmt" in target_a:
+                exe.audio_sample_fmt(target_a["sample_fmt"])
+        else:
+            exe.audio_codec()
+
+        return exe
+
+    def trim(self, video_path, output_path, start, end, accurate=False, crf=18):
+        """
+        基于关键帧索引的快速裁剪
+        :param accurate: False 时切点吸附到关键帧，全程 -c copy；
+                         True 时只重编码首尾不完整的 GOP，中间部分流复制，音频按精确区间编码一次
+        :param crf: 首尾重编码片段的质量
+        """
+        keyframes = ffprobe(cache=self.cache).input(video_path, ("v", 0)).keyframes()
+        if not keyframes or end <= start:
+            self.log_error += f"❌ 裁剪区间或关键帧无效: {video_path} [{start}, {end})\n"
+            return self
+
+        eps = 0.001
+        if not accurate:
+            before = [k for k in keyframes if k <= start + eps]
+            after = [k for k in keyframes if k >= end - eps]
+            ss = before[-1] if before else 0.0
+            to = after[0] if after else None
+            # 流复制从 -ss 之前最近的关键帧开始，略微后移确保落在目标关键帧上
+            exe = ffmpeg(hide_banner=True, overwrite=True).input(video_path, ss=ss + 0.0005 if ss else 0.0, to=to)
+            exe.map("0").add_args(["-c", "copy", "-avoid_negative_ts", "make_zero"])
+            exe.output(output_path).run()
+            self.log_error += exe.log_error
+            if not exe.log_error:
+                self.log_correct += f"✅ 已按关键帧裁剪: {output_path} [{ss:.3f}, {to if to else 'EOF'})\n"
+            return self
+
+        info = ffprobe(cache=self.cache).input(video_path).show_entries("codec_name,pix_fmt,avg_frame_rate").export(core=True)
+        video = next((st for st in info if st.get("codec_type") == "video"), {})
+        audio = next((st for st in info if st.get("codec_type") == "audio"), None)
+        encoder = ENCODERS.get(video.get("codec_name"), "libx264")
+        try:
+            fps = float(Fraction(video.get("avg_frame_rate", "0/1")))
+        except (ValueError, ZeroDivisionError):
+            fps = 0.0
+
+        # [start, 首个区间内关键帧) 重编码，关键帧之间流复制，[末个区间内关键帧, end) 重编码
+        inside = [k for k in keyframes if start - eps <= k <= end + eps]
+        pieces = []
+        if not inside or not fps:
+            pieces.append((start, end, False))
+        else:
+            copy_a, copy_b = max(start, inside[0]), min(end, inside[-1])
+            if copy_a - start > eps:
+                pieces.append((start, copy_a, False))
+            if copy_b - copy_a > eps:
+                pieces.append((copy_a, copy_b, True))
+            if end - copy_b > eps:
+                pieces.append((copy_b, end, False))
+
+        out_dir = os.path.dirname(os.path.abspath(output_path))
+        stem, ext = os.path.splitext(os.path.basename(output_path))
+        work_dir = os.path.join(out_dir, f".{stem}_trim")
+        os.makedirs(work_dir, exist_ok=True)
+
+        sched = scheduler.Scheduler(workers=len(pieces))
+        piece_paths = []
+        for n, (a, b, copy) in enumerate(pieces):
+            piece = os.path.join(work_dir, f"{n}{ext}")
+            piece_paths.append(piece)
+            exe = ffmpeg(hide_banner=True, overwrite=True)
+            if copy:
+                # 流复制按解码顺序截断：B 帧重排会让 -t/-to 多带出下一个 GOP 的包，改用帧数限定
+                exe.input(video_path, ss=a + 0.0005).map("0:v:0")
+                exe.add_args(["-an", "-frames:v", str(round((b - a) * fps))])
+                exe.video_codec()
+            else:
+                # 保留原始时间戳，用 trim 滤镜按帧精确截取，输入端 -ss 只负责快速定位
+                exe.add_args(["-copyts"])
+                exe.input(video_path, ss=max(0.0, a - 0.0005)).map("0:v:0")
+                exe.add_args(["-an", "-vf", f"trim=start={a - 0.0005:.6f}:end={b - 0.0005:.6f},setpts=PTS-STARTPTS"])
+                exe.video_codec(encoder).video_quality(crf)
+                if video.get("pix_fmt"):
+                    exe.add_args(["-pix_fmt", video["pix_fmt"]])
+            sched.add(exe.output(piece))
+
+        jobs = sched.run()
+        if not all(j.ok for j in jobs):
+            self.log_error += sched.log_error
+            return self
+
+        list_path = os.path.join(work_dir, "concat_list.txt")
+        with open(list_path, "w", encoding="utf-8") as f:
+            for pp in piece_paths:
+                f.write(f"file '{pp}'\n")
+
+        final = ffmpeg(hide_banner=True, overwrite=True).f(concat=True).safe(0).input(list_path)
+        if audio is not None:
+            final.input(video_path, ss=start, to=end).map("0:v:0").map("1:a:0")
+            final.video_codec().audio_codec(ENCODERS.get(audio.get("codec_name"), "aac"))
+        else:
+            final.map("0:v:0").video_codec()
+        final.output(output_path).run()
+        self.log_error += final.log_error
+        if not final.log_error:
+            self.log_correct += f"✅ 已精确裁剪: {output_path}（重编码 {sum(1 for p in pieces if not p[2])} 段）\n"
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        return self
+
+    def chunked_encode(self, exe, segments=None, workers=None, verify=True, keep_chunks=False):
+        """
+        分段并行重编码：按关键帧切成 N 段并行编码，再用 concat 流复制拼接
+        只输出首个视频流与音频流；音频在拼接时统一编码一次，避免分段边界的编码器延迟间隙
+        :param exe: 单输入单输出的 ffmpeg 构造器（如 video_margin_fill 的返回值）
+        :param segments: 分段数，默认等于 workers
+        :param verify: 校验输出时长与帧数是否与源一致
+        :return: 报告字典，ok 为 False 时详见 log_error
+        """
+        report = {"segments": 0, "duration": None, "frames": None, "ok": False}
+        sources = exe.inputs()
+        if len(sources) != 1 or not exe.end_cmd:
+            self.log_error += "❌ 分段编码仅支持单输入单输出的构造器。\n"
+            return report
+        if exe.log_error:
+            self.log_error += exe.log_error
+            return report
+
+        src, output_path = sources[0], exe.end_cmd[-1]
+        sched = scheduler.Scheduler(workers=workers)
+        segments = segments or sched.workers
+
+        duration = media_duration(src, self.cache)
+        keyframes = ffprobe(cache=self.cache).input(src, ("v", 0)).keyframes()
+        if not duration or not keyframes:
+            self.log_error += f"❌ 无法获取时长或关键帧: {src}\n"
+            return report
+
+        # 目标切点吸附到最近的关键帧
+        cuts = []
+        for i in range(1, segments):
+            target = duration * i / segments
+            kf = min(keyframes, key=lambda t: abs(t - target))
+            if kf > 0 and (not cuts or kf > cuts[-1]):
+                cuts.append(kf)
+        bounds = [0.0] + cuts + [None]
+
+        audio_flags = ("-c:a", "-acodec", "-b:a", "-q:a", "-ar", "-ac", "-channel_layout", "-sample_fmt", "-af")
+        global_flags = ("-map_metadata", "-metadata")
+        body = exe.body_cmd
+        video_args, audio_args, global_args = [], [], []
+        i = body.index("-i") + 2
+        pre_input = body[:body.index("-i")]
+        while i < len(body):
+            a = body[i]
+            if a in audio_flags and i + 1 < len(body):
+                audio_args += body[i:i + 2]
+                i += 2
+            elif a in global_flags and i + 1 < len(body):
+                global_args += body[i:i + 2]
+                i += 2
+            elif a == "-map" and i + 1 < len(body):
+                i += 2
+            elif a == "-an":
+                i += 1
+            else:
+                video_args.append(a)
+                i += 1
+
+        head = [a for a in exe.head_cmd if a not in ("-progress", "pipe:1", "-nostats")]
+        out_dir = os.path.dirname(os.path.abspath(output_path))
+        stem, ext = os.path.splitext(os.path.basename(output_path))
+        chunk_dir = os.path.join(out_dir, f".{stem}_chunks")
+        os.makedirs(chunk_dir, exist_ok=True)
+
+        chunk_paths = []
+        for n in range(len(bounds) - 1):
+            chunk = os.path.join(chunk_dir, f"{n:04d}{ext}")
+            chunk_paths.append(chunk)
+            # 切点减去 0.5ms，抵消 pts_time 六位小数的舍入误差，保证关键帧落在本段
+            seek = ["-ss", f"{max(0.0, bounds[n] - 0.0005):.6f}"] if bounds[n] else []
+            if bounds[n + 1] is not None:
+                seek += ["-to", f"{bounds[n + 1] - 0.0005:.6f}"]
+            args = (["ffmpeg", "-hide_banner", "-y"] + pre_input + seek + ["-i", src, "-map", "0:v:0"]
+                    + video_args + ["-an", chunk])
+            sched.add(args, name=chunk)
+
+        jobs = sched.run()
+        report["segments"] = len(jobs)
+        if not all(j.ok for j in jobs):
+            self.log_error += sched.log_error
+            return report
+
+        list_path = os.path.join(chunk_dir, "concat_list.txt")
+        with open(list_path, "w", encoding="utf-8") as f:
+            for c in chunk_paths:
+                f.write(f"file '{c}'\n")
+
+        final = ffmpeg()
+        final.head_cmd = head
+        final.f(concat=True).safe(0).input(list_path).input(src)
+        final.map("0:v:0").map("1:a?").video_codec()
+        final.add_args(audio_args or ["-c:a", "copy"])
+        final.add_args(global_args)
+        final.output(output_path).run()
+        if final.log_error:
+            self.log_error += final.log_error
+            return report
+
+        report["ok"] = True
+        if verify:
+            out_duration = media_duration(output_path, self.cache)
+            report["duration"] = (duration, out_duration)
+            if out_duration is None or abs(out_duration - duration) > 0.1:
+                report["ok"] = False
+                self.log_error += f"❌ 分段编码时长不一致: 源 {duration}s, 输出 {out_duration}s\n"
+
+            # 滤镜改变帧率时帧数本就不同，跳过帧数校验
+            if not any(a.startswith("fps=") or ",fps=" in a for a in video_args) and "-r" not in video_args:
+                src_frames = ffprobe(cache=self.cache).input(src, ("v", 0)).packet_count()
+                out_frames = ffprobe(cache=self.cache).input(output_path, ("v", 0)).packet_count()
+                report["frames"] = (src_frames, out_frames)
+                if src_frames != out_frames:
+                    report["ok"] = False
+                    self.log_error += f"❌ 分段编码帧数不一致: 源 {src_frames}, 输出 {out_frames}\n"
+
+        if report["ok"]:
+            self.log_correct += f"✅ 分段编码完成: {output_path}（{len(jobs)} 段）\n"
+            if not keep_chunks:
+                shutil.rmtree(chunk_dir, ignore_errors=True)
+
+        return report
+
     def print_log(self):
         run_log = "LOG\n"
         run_log += self.log_correct
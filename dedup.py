@@ -0,0 +1,207 @@
+import os
+import subprocess
+from itertools import combinations
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import core
+from cache import resolve_cache
+
+
+def _numpy():
+    # numpy 只有指纹计算用得到，按需导入
+    try:
+        import numpy
+    except ImportError as e:
+        raise ImportError("❌ 近重复检测需要 numpy，请先 pip install numpy") from e
+
+    return numpy
+
+
+def _dhash(raw, count):
+    """9x8 灰度帧 -> 64 位差值哈希（每行相邻像素比较亮度）"""
+    np = _numpy()
+    frames = np.frombuffer(raw, dtype=np.uint8)[:count * 72].reshape(count, 8, 9)
+    bits = frames[:, :, 1:] > frames[:, :, :-1]
+    packed = np.packbits(bits.reshape(count, 64), axis=1)
+
+    return [int.from_bytes(row.tobytes(), "big") for row in packed]
+
+
+def signature(path, frames=5, cache=True):
+    """
+    片段的感知指纹：在时长上均匀取 frames 个关键帧，缩成 9x8 灰度后计算 dHash
+    解码端 -skip_frame nokey 只解关键帧，音频/字幕不解，原始像素经管道直接读进 numpy
+    :return: {"duration": 秒, "hashes": [64 位整数, ...]}，按文件指纹缓存
+    """
+    probe_cache = resolve_cache(cache)
+    key = f"dhash v1 n={frames}"
+    if probe_cache is not None:
+        data = probe_cache.get(path, key)
+        if data is not None:
+            return data
+
+    duration = core.media_duration(path, cache) or 0.0
+    interval = duration / frames if duration > 0 else 1.0
+    # 第一个关键帧必取（短片可能只有这一个），之后每隔 interval 取一个
+    select = f"isnan(prev_selected_t)+gte(t-prev_selected_t,{interval:.3f})"
+    command = ["ffmpeg", "-v", "error", "-nostdin", "-skip_frame", "nokey", "-an", "-sn", "-dn", "-i", path,
+               "-vf", f"select='{select}',scale=9:8:flags=area,format=gray", "-fps_mode", "passthrough",
+               "-frames:v", str(frames), "-f", "rawvideo", "pipe:1"]
+    proc = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    count = len(proc.stdout) // 72
+    if proc.returncode != 0 or count == 0:
+        tail = "\n".join(proc.stderr.decode("utf-8", "replace").strip().splitlines()[-3:])
+        raise RuntimeError(f"❌ 指纹计算失败: {path}\n{tail}")
+
+    data = {"duration": duration, "hashes": _dhash(proc.stdout, count)}
+    if probe_cache is not None:
+        probe_cache.put(path, key, data)
+
+    return data
+
+
+def distance(a, b):
+    """两个指纹按位置对齐后的平均汉明距离（0~64），无法比较时返回 None"""
+    pairs = list(zip(a["hashes"], b["hashes"]))
+    if not pairs:
+        return None
+
+    return sum((x ^ y).bit_count() for x, y in pairs) / len(pairs)
+
+
+class DuplicateIndex:
+    """
+    近重复索引（LSH 分段 + 多探针）
+    每个帧哈希切成 bands 段，按 (帧序号, 段序号) 各建一张 {段值: [片段, ...]} 表。加入片段时除了本段的值，
+    还探查与它相差不超过 radius = threshold // bands 位的所有段值，命中的片段成为候选，再用平均汉明距离与时长确认。
+    召回有保证：平均距离不超过 threshold 时至少有一对对齐帧的距离不超过 threshold，按抽屉原理其中必有一段
+    相差不超过 radius 位，一定会被探到；其中一方是纯色帧（哈希为 0）时经零桶找到。
+    代价是每段要查 C(段宽, ≤radius) 个段值（threshold=8 时每帧约 760 次），与解关键帧算指纹相比仍可忽略。
+    """
+
+    def __init__(self, threshold=8, bands=None, duration_tolerance=0.05):
+        """
+        :param threshold: 平均汉明距离上限（64 位中不同的位数）
+        :param bands: 每个哈希切成几段，默认按 threshold 取，使每段的探查半径不超过 2 位（threshold=8 时 3 段）；
+                      段越多每段越短、探针越少，但桶里的片段越多
+        :param duration_tolerance: 时长相对差异上限，时长差太多的不算重复（如同一素材的长短两个版本）
+        """
+        if bands is None:
+            bands = max(1, -(-(int(threshold) + 1) // 3))
+        if not 1 <= bands <= 64:
+            raise ValueError(f"❌ bands 必须在 1~64 之间: {bands}")
+        self.threshold = threshold
+        self.bands = bands
+        self.radius = int(threshold) // bands
+        self.duration_tolerance = duration_tolerance
+        self.paths = []
+        self.signatures = []
+        self._tables = {}
+        self._zeros = {}
+        self._parent = []
+        self.candidates = 0
+
+        # 64 位不能整除时前几段多一位；每段的探针是与段值异或即得半径内全部邻居的掩码：0、单个位、两个位……
+        self._bands = []
+        shift = 0
+        for b in range(bands):
+            width = 64 // bands + (1 if b < 64 % bands else 0)
+            probes = [0]
+            for r in range(1, min(self.radius, width) + 1):
+                probes += [sum(1 << k for k in bits) for bits in combinations(range(width), r)]
+            self._bands.append((shift, (1 << width) - 1, probes))
+            shift += width
+
+    def _find(self, i):
+        while self._parent[i] != i:
+            self._parent[i] = self._parent[self._parent[i]]
+            i = self._parent[i]
+        return i
+
+    def _union(self, i, j):
+        a, b = self._find(i), self._find(j)
+        if a != b:
+            # 保留先加入的作为组代表
+            self._parent[max(a, b)] = min(a, b)
+
+    def _same(self, a, b):
+        da, db = a["duration"], b["duration"]
+        if da and db and abs(da - db) > max(da, db) * self.duration_tolerance:
+            return False
+        d = distance(a, b)
+
+        return d is not None and d <= self.threshold
+
+    def add(self, path, sig):
+        i = len(self.paths)
+        self.paths.append(path)
+        self.signatures.append(sig)
+        self._parent.append(i)
+
+        seen = set()
+
+        def _check(bucket):
+            for j in bucket:
+                if j not in seen:
+                    seen.add(j)
+                    self.candidates += 1
+                    if self._find(i) != self._find(j) and self._same(sig, self.signatures[j]):
+                        self._union(i, j)
+
+        for n, h in enumerate(sig["hashes"]):
+            # 纯色帧（黑场、白场）哈希为 0，放进分段表会与每个有零段的哈希相撞，单独放一个桶：
+            # 只有置位数不超过 threshold 的哈希才可能与它相距不超过 threshold，只有这些去查零桶
+            zeros = self._zeros.setdefault(n, [])
+            if h.bit_count() <= self.threshold:
+                _check(zeros)
+            for b, (shift, mask, probes) in enumerate(self._bands):
+                table = self._tables.setdefault((n, b), {})
+                value = (h >> shift) & mask
+                # 探针在 C 层逐个过滤，只对命中的桶逐个比较
+                for key in filter(table.__contains__, map(value.__xor__, probes)):
+                    _check(table[key])
+                if h:
+                    table.setdefault(value, []).append(i)
+            if not h:
+                zeros.append(i)
+
+        return self
+
+    def groups(self):
+        """
+        :return: 有重复的组，[[保留的路径, 重复路径, ...], ...]，组内按加入顺序
+        """
+        members = {}
+        for i in range(len(self.paths)):
+            members.setdefault(self._find(i), []).append(self.paths[i])
+
+        return [g for g in members.values() if len(g) > 1]
+
+
+def find_duplicates(paths, frames=5, threshold=8, workers=None, cache=True):
+    """
+    并行计算指纹并建索引查找近重复
+    :return: (重复组列表, {路径: 错误信息})
+    """
+    workers = workers or min(32, (os.cpu_count() or 1) * 2)
+    index = DuplicateIndex(threshold)
+    errors = {}
+
+    def _add(path, fut):
+        try:
+            index.add(path, fut.result())
+        except RuntimeError as e:
+            errors[path] = str(e)
+
+    # 与 FPU.probe_iter 相同，在途任务数有上限，按输入顺序加入索引（组内先出现的作为保留项）
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for p in paths:
+            pending.append((p, pool.submit(signature, p, frames, cache)))
+            if len(pending) >= workers * 4:
+                _add(*pending.popleft())
+        while pending:
+            _add(*pending.popleft())
+
+    return index.groups(), errors
@@ -0,0 +1,643 @@
+import os
+import mmap
+import struct
+
+
+# 容器头快速解析：只覆盖 ffprobe(core=True) 里最常用的字段，解不出来的一律返回 None 交给 ffprobe
+MP4_VIDEO_CODECS = {b"avc1": "h264", b"avc3": "h264", b"hvc1": "hevc", b"hev1": "hevc",
+                    b"av01": "av1", b"vp09": "vp9", b"mp4v": "mpeg4"}
+MP4_AUDIO_CODECS = {b"mp4a": None, b"Opus": "opus", b"ac-3": "ac3", b"ec-3": "eac3", b"fLaC": "flac"}
+MKV_CODECS = {"V_MPEG4/ISO/AVC": "h264", "V_MPEGH/ISO/HEVC": "hevc", "V_VP9": "vp9", "V_AV1": "av1",
+              "A_AAC": "aac", "A_OPUS": "opus", "A_VORBIS": "vorbis", "A_FLAC": "flac", "A_AC3": "ac3",
+              "A_EAC3": "eac3", "A_MPEG/L3": "mp3", "S_TEXT/UTF8": "subrip", "S_TEXT/ASS": "ass"}
+# 这些解码器固定输出 fltp
+FLTP_CODECS = ("aac", "mp3", "opus", "vorbis", "ac3", "eac3")
+AAC_SAMPLE_RATES = (96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350)
+CHANNEL_LAYOUTS = {1: "mono", 2: "stereo"}
+INT_MAX = 2 ** 31 - 1
+# ffprobe 只为对应类型的流输出这些字段
+VIDEO_ONLY = {"width", "height", "coded_width", "coded_height", "pix_fmt", "field_order", "sample_aspect_ratio",
+              "display_aspect_ratio", "has_b_frames", "level", "color_range", "color_space"}
+AUDIO_ONLY = {"sample_rate", "channels", "channel_layout", "sample_fmt", "bits_per_sample"}
+
+
+def av_reduce(num, den, max_value=INT_MAX):
+    """移植自 libavutil/rational.c，保证帧率有理数与 ffprobe 完全一致"""
+    a0n, a0d, a1n, a1d = 0, 1, 1, 0
+    if num == 0 or den == 0:
+        return (0, 1) if den else (1 if num else 0, 0)
+
+    from math import gcd
+    g = gcd(num, den)
+    num, den = num // g, den // g
+    if num <= max_value and den <= max_value:
+        return num, den
+
+    while den:
+        x = num // den
+        next_den = num - den * x
+        a2n = x * a1n + a0n
+        a2d = x * a1d + a0d
+        if a2n > max_value or a2d > max_value:
+            if a1n:
+                x = (max_value - a0n) // a1n
+            if a1d:
+                x = min(x, (max_value - a0d) // a1d)
+            if den * (2 * x * a1d + a0d) > num * a1d:
+                a1n, a1d = x * a1n + a0n, x * a1d + a0d
+            break
+        a0n, a0d, a1n, a1d = a1n, a1d, a2n, a2d
+        num, den = den, next_den
+
+    return a1n, a1d
+
+
+class _Bits:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def u(self, n):
+        v = 0
+        for _ in range(n):
+            byte = self.data[self.pos >> 3]
+            v = (v << 1) | ((byte >> (7 - (self.pos & 7))) & 1)
+            self.pos += 1
+        return v
+
+    def ue(self):
+        zeros = 0
+        while self.u(1) == 0:
+            zeros += 1
+            if zeros > 31:
+                raise ValueError("exp-golomb overflow")
+        return (1 << zeros) - 1 + self.u(zeros)
+
+    def se(self):
+        v = self.ue()
+        return (v + 1) // 2 if v & 1 else -(v // 2)
+
+
+def _unescape_rbsp(nal):
+    # 去掉防竞争字节 0x000003
+    out = bytearray()
+    zeros = 0
+    for b in nal:
+        if zeros >= 2 and b == 3:
+            zeros = 0
+            continue
+        out.append(b)
+        zeros = zeros + 1 if b == 0 else 0
+    return bytes(out)
+
+
+def _h264_sps(sps):
+    """解析 H.264 SPS，返回 (pix_fmt, width, height)"""
+    r = _Bits(_unescape_rbsp(sps[1:]))
+    profile_idc = r.u(8)
+    r.u(16)
+    r.ue()
+    chroma_format_idc, bit_depth = 1, 8
+    if profile_idc in (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135):
+        chroma_format_idc = r.ue()
+        if chroma_format_idc == 3:
+            r.u(1)
+        bit_depth = r.ue() + 8
+        r.ue()
+        r.u(1)
+        if r.u(1):
+            for i in range(8 if chroma_format_idc != 3 else 12):
+                if r.u(1):
+                    last, nxt = 8, 8
+                    for _ in range(16 if i < 6 else 64):
+                        if nxt:
+                            nxt = (last + r.se()) % 256
+                        last = nxt or last
+
+    r.ue()
+    poc_type = r.ue()
+    if poc_type == 0:
+        r.ue()
+    elif poc_type == 1:
+        r.u(1)
+        r.se()
+        r.se()
+        for _ in range(r.ue()):
+            r.se()
+    r.ue()
+    r.u(1)
+    mbs_w = r.ue() + 1
+    map_units_h = r.ue() + 1
+    frame_mbs_only = r.u(1)
+    if not frame_mbs_only:
+        r.u(1)
+    r.u(1)
+    crop = (0, 0, 0, 0)
+    if r.u(1):
+        crop = (r.ue(), r.ue(), r.ue(), r.ue())
+
+    full_range = False
+    if r.u(1):
+        if r.u(1):
+            if r.u(8) == 255:
+                r.u(32)
+        if r.u(1):
+            r.u(1)
+        if r.u(1):
+            r.u(3)
+            full_range = bool(r.u(1))
+
+    sub_w = 2 if chroma_format_idc in (1, 2) else 1
+    sub_h = 2 if chroma_format_idc == 1 else 1
+    crop_x = sub_w if chroma_format_idc else 1
+    crop_y = (sub_h if chroma_format_idc else 1) * (2 - frame_mbs_only)
+    width = mbs_w * 16 - crop_x * (crop[0] + crop[1])
+    height = map_units_h * 16 * (2 - frame_mbs_only) - crop_y * (crop[2] + crop[3])
+
+    return _pix_fmt(chroma_format_idc, bit_depth, jpeg=full_range), width, height
+
+
+def _pix_fmt(chroma_format_idc, bit_depth, jpeg=False):
+    if chroma_format_idc == 0:
+        return "gray" if bit_depth == 8 else f"gray{bit_depth}le"
+
+    sub = {1: "420", 2: "422", 3: "444"}.get(chroma_format_idc)
+    if sub is None:
+        return None
+    if bit_depth == 8:
+        return f"yuvj{sub}p" if jpeg else f"yuv{sub}p"
+
+    return f"yuv{sub}p{bit_depth}le"
+
+
+def _avcc(data):
+    if len(data) < 8 or data[0] != 1:
+        return None
+    if data[5] & 0x1F < 1:
+        return None
+    sps_len = struct.unpack_from(">H", data, 6)[0]
+
+    return _h264_sps(bytes(data[8:8 + sps_len]))
+
+
+def _hvcc(data):
+    if len(data) < 23 or data[0] != 1:
+        return None
+
+    # hevc 解码器不输出 yuvj 格式，位深和采样直接取配置记录
+    return _pix_fmt(data[16] & 0x03, (data[17] & 0x07) + 8), None, None
+
+
+def _aac_asc(data):
+    """AudioSpecificConfig -> (sample_rate, channels)，SBR/PS/PCE 等情况返回 None"""
+    if len(data) < 2:
+        return None
+    r = _Bits(bytes(data))
+    aot = r.u(5)
+    if aot == 31:
+        aot = 32 + r.u(6)
+    idx = r.u(4)
+    rate = r.u(24) if idx == 15 else (AAC_SAMPLE_RATES[idx] if idx < len(AAC_SAMPLE_RATES) else None)
+    channels = r.u(4)
+    if aot in (5, 29) or not rate or channels not in (1, 2, 3, 4, 5, 6):
+        return None
+
+    return rate, channels
+
+
+def _fmt_duration(ts, timescale):
+    return f"{ts / timescale:.6f}"
+
+
+# ---------------------------------------------------------------- MP4 / MOV
+
+def _mp4_boxes(buf, start, end):
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", buf, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                return
+            size = struct.unpack_from(">Q", buf, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            return
+        yield kind, pos + header, pos + size
+        pos += size
+
+
+def _mp4_child(buf, start, end, kind):
+    for k, s, e in _mp4_boxes(buf, start, end):
+        if k == kind:
+            return s, e
+    return None
+
+
+def _mp4_path(buf, start, end, *kinds):
+    span = (start, end)
+    for kind in kinds:
+        span = _mp4_child(buf, span[0], span[1], kind)
+        if span is None:
+            return None
+    return span
+
+
+def _esds(buf, start, end):
+    # 跳过 FullBox 头，逐层读取 ES/DecoderConfig/DecoderSpecificInfo 描述符
+    pos = start + 4
+    oti, asc = None, None
+    while pos < end:
+        tag = buf[pos]
+        pos += 1
+        size = 0
+        for _ in range(4):
+            b = buf[pos]
+            pos += 1
+            size = (size << 7) | (b & 0x7F)
+            if not b & 0x80:
+                break
+        if tag == 3:
+            flags = buf[pos + 2]
+            pos += 3
+            if flags & 0x80:
+                pos += 2
+            if flags & 0x40:
+                pos += 1 + buf[pos]
+            if flags & 0x20:
+                pos += 2
+        elif tag == 4:
+            oti = buf[pos]
+            pos += 13
+        elif tag == 5:
+            asc = bytes(buf[pos:pos + size])
+            break
+        else:
+            pos += size
+
+    return oti, asc
+
+
+def _mp4_track(buf, start, end, movie_timescale, fragmented=False):
+    hdlr = _mp4_path(buf, start, end, b"mdia", b"hdlr")
+    mdhd = _mp4_path(buf, start, end, b"mdia", b"mdhd")
+    stbl = _mp4_path(buf, start, end, b"mdia", b"minf", b"stbl")
+    if hdlr is None or mdhd is None or stbl is None:
+        return None
+
+    handler = bytes(buf[hdlr[0] + 8:hdlr[0] + 12])
+    if buf[mdhd[0]] == 1:
+        timescale, duration = struct.unpack_from(">IQ", buf, mdhd[0] + 20)
+    else:
+        timescale, duration = struct.unpack_from(">II", buf, mdhd[0] + 12)
+    if not timescale:
+        return None
+
+    stsd = _mp4_child(buf, stbl[0], stbl[1], b"stsd")
+    if stsd is None:
+        return None
+    entries = list(_mp4_boxes(buf, stsd[0] + 8, stsd[1]))
+    if len(entries) != 1:
+        return None
+    fourcc, es, ee = entries[0]
+
+    stream = {"time_base": f"1/{timescale}"}
+
+    # stts：总时长与 r_frame_rate（mov.c 仅在单一 delta 时直接给出）
+    stts = _mp4_child(buf, stbl[0], stbl[1], b"stts")
+    deltas = []
+    if stts is not None:
+        count = struct.unpack_from(">I", buf, stts[0] + 4)[0]
+        deltas = [struct.unpack_from(">II", buf, stts[0] + 8 + 8 * i) for i in range(count)]
+    sample_count = sum(c for c, _ in deltas)
+    stts_total = sum(c * d for c, d in deltas)
+
+    # 只有无编辑列表或平凡编辑列表时时长才与 ffprobe 一致
+    plain_edit = True
+    elst = _mp4_path(buf, start, end, b"edts", b"elst")
+    if elst is not None:
+        version = buf[elst[0]]
+        count = struct.unpack_from(">I", buf, elst[0] + 4)[0]
+        if count != 1:
+            plain_edit = False
+        elif version == 1:
+            seg, media_time = struct.unpack_from(">Qq", buf, elst[0] + 8)
+        else:
+            seg, media_time = struct.unpack_from(">Ii", buf, elst[0] + 8)
+        if plain_edit and (media_time != 0 or abs(seg * timescale - duration * movie_timescale)
+                           > timescale + movie_timescale):
+            plain_edit = False
+
+    # 分片 MP4（moov 里有 mvex）的样本都在 moof 里，stts 为空：时长与帧数交给 ffprobe
+    if plain_edit and not fragmented:
+        duration_ts = min(duration, stts_total) if stts_total else duration
+        stream["duration_ts"] = duration_ts
+        stream["duration"] = _fmt_duration(duration_ts, timescale)
+        stream["nb_frames"] = str(sample_count)
+
+    if handler == b"vide":
+        codec = MP4_VIDEO_CODECS.get(fourcc)
+        if codec is None:
+            return None
+        stream["codec_type"] = "video"
+        stream["codec_name"] = codec
+        stream["width"], stream["height"] = struct.unpack_from(">HH", buf, es + 24)
+
+        for kind, cs, ce in _mp4_boxes(buf, es + 78, ee):
+            info = None
+            if kind == b"avcC":
+                info = _avcc(buf[cs:ce])
+            elif kind == b"hvcC":
+                info = _hvcc(buf[cs:ce])
+            if info is not None and info[0]:
+                stream["pix_fmt"] = info[0]
+
+        if len(deltas) == 1 or (len(deltas) == 2 and deltas[1][0] == 1):
+            stream["r_frame_rate"] = "%d/%d" % av_reduce(timescale, deltas[0][1])
+        if sample_count and stts_total:
+            stream["avg_frame_rate"] = "%d/%d" % av_reduce(timescale * sample_count, stts_total)
+
+    elif handler == b"soun":
+        if fourcc not in MP4_AUDIO_CODECS:
+            return None
+        version = struct.unpack_from(">H", buf, es + 8)[0]
+        if version > 1:
+            return None
+        channels = struct.unpack_from(">H", buf, es + 16)[0]
+        rate = struct.unpack_from(">I", buf, es + 24)[0] >> 16
+        codec = MP4_AUDIO_CODECS[fourcc]
+        child_start = es + 28 + (16 if version == 1 else 0)
+
+        if fourcc == b"mp4a":
+            esds = _mp4_child(buf, child_start, ee, b"esds")
+            if esds is None:
+                # QuickTime 把 esds 放在 wave 原子里
+                esds = _mp4_path(buf, child_start, ee, b"wave", b"esds")
+            if esds is None:
+                return None
+            oti, asc = _esds(buf, esds[0], esds[1])
+            if oti == 0x40:
+                codec = "aac"
+                parsed = _aac_asc(asc) if asc else None
+                if parsed is None:
+                    return None
+                rate, channels = parsed
+            elif oti in (0x69, 0x6B):
+                codec = "mp3"
+            else:
+                return None
+        elif codec == "opus":
+            rate = 48000
+
+        stream["codec_type"] = "audio"
+        stream["codec_name"] = codec
+        stream["sample_rate"] = str(rate)
+        stream["channels"] = channels
+        if channels in CHANNEL_LAYOUTS and codec != "flac":
+            stream["channel_layout"] = CHANNEL_LAYOUTS[channels]
+        if codec in FLTP_CODECS:
+            stream["sample_fmt"] = "fltp"
+        stream["r_frame_rate"] = "0/0"
+        stream["avg_frame_rate"] = "0/0"
+    else:
+        return None
+
+    return stream
+
+
+def _read_mp4(buf):
+    moov = _mp4_child(buf, 0, len(buf), b"moov")
+    if moov is None:
+        return None
+
+    mvhd = _mp4_child(buf, moov[0], moov[1], b"mvhd")
+    if mvhd is None:
+        return None
+    movie_timescale = struct.unpack_from(">I", buf, mvhd[0] + (20 if buf[mvhd[0]] == 1 else 12))[0]
+
+    fragmented = _mp4_child(buf, moov[0], moov[1], b"mvex") is not None
+    streams = []
+    for kind, s, e in _mp4_boxes(buf, moov[0], moov[1]):
+        if kind != b"trak":
+            continue
+        stream = _mp4_track(buf, s, e, movie_timescale or 1, fragmented)
+        if stream is None:
+            return None
+        stream["index"] = len(streams)
+        streams.append(stream)
+
+    return streams
+
+
+# ---------------------------------------------------------------- Matroska
+
+def _ebml_vint(buf, pos, keep_marker=False):
+    first = buf[pos]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise ValueError("bad ebml vint")
+    value = first if keep_marker else first & (mask - 1)
+    unknown = value == mask - 1
+    for i in range(1, length):
+        value = (value << 8) | buf[pos + i]
+        unknown = unknown and buf[pos + i] == 0xFF
+
+    return value, length, (unknown and not keep_marker)
+
+
+def _ebml_elements(buf, start, end):
+    pos = start
+    while pos < end:
+        eid, n, _ = _ebml_vint(buf, pos, keep_marker=True)
+        size, m, unknown = _ebml_vint(buf, pos + n)
+        data = pos + n + m
+        stop = end if unknown else data + size
+        yield eid, data, min(stop, end)
+        if unknown:
+            return
+        pos = stop
+
+
+def _ebml_uint(buf, s, e):
+    return int.from_bytes(buf[s:e], "big")
+
+
+def _ebml_float(buf, s, e):
+    if e - s == 4:
+        return struct.unpack_from(">f", buf, s)[0]
+    if e - s == 8:
+        return struct.unpack_from(">d", buf, s)[0]
+    return 0.0
+
+
+def _mkv_track(buf, s, e, timecode_scale):
+    fields = {"type": None, "codec": None, "private": None, "default_duration": None,
+              "width": None, "height": None, "rate": 8000.0, "channels": 1}
+    for eid, ds, de in _ebml_elements(buf, s, e):
+        if eid == 0x83:
+            fields["type"] = _ebml_uint(buf, ds, de)
+        elif eid == 0x86:
+            fields["codec"] = bytes(buf[ds:de]).rstrip(b"\0").decode("ascii", "replace")
+        elif eid == 0x63A2:
+            fields["private"] = bytes(buf[ds:de])
+        elif eid == 0x23E383:
+            fields["default_duration"] = _ebml_uint(buf, ds, de)
+        elif eid == 0xE0:
+            for vid, vs, ve in _ebml_elements(buf, ds, de):
+                if vid == 0xB0:
+                    fields["width"] = _ebml_uint(buf, vs, ve)
+                elif vid == 0xBA:
+                    fields["height"] = _ebml_uint(buf, vs, ve)
+        elif eid == 0xE1:
+            for aid, as_, ae in _ebml_elements(buf, ds, de):
+                if aid == 0xB5:
+                    fields["rate"] = _ebml_float(buf, as_, ae)
+                elif aid == 0x9F:
+                    fields["channels"] = _ebml_uint(buf, as_, ae)
+                elif aid == 0x78B5:
+                    return None  # OutputSamplingFrequency：SBR，交给 ffprobe
+
+    codec = MKV_CODECS.get(fields["codec"])
+    if codec is None:
+        return None
+
+    stream = {"codec_name": codec, "time_base": "%d/%d" % av_reduce(timecode_scale, 1000000000)}
+    if fields["type"] == 1:
+        stream["codec_type"] = "video"
+        if fields["width"] is None or fields["height"] is None:
+            return None
+        stream["width"], stream["height"] = fields["width"], fields["height"]
+        info = None
+        if fields["private"]:
+            if codec == "h264":
+                info = _avcc(fields["private"])
+            elif codec == "hevc":
+                info = _hvcc(fields["private"])
+        if info is not None and info[0]:
+            stream["pix_fmt"] = info[0]
+        dd = fields["default_duration"]
+        if dd:
+            num, den = av_reduce(1000000000, dd, 30000)
+            stream["avg_frame_rate"] = f"{num}/{den}"
+            # matroskadec 在 5~1000fps 区间内直接把 avg 作为 r_frame_rate
+            if den * 5 < num < den * 1000:
+                stream["r_frame_rate"] = f"{num}/{den}"
+    elif fields["type"] == 2:
+        stream["codec_type"] = "audio"
+        rate, channels = int(fields["rate"]), fields["channels"]
+        if codec == "aac":
+            parsed = _aac_asc(fields["private"]) if fields["private"] else None
+            if parsed is None:
+                return None
+            rate, channels = parsed
+        elif codec == "opus":
+            rate = 48000
+        stream["sample_rate"] = str(rate)
+        stream["channels"] = channels
+        if channels in CHANNEL_LAYOUTS and codec != "flac":
+            stream["channel_layout"] = CHANNEL_LAYOUTS[channels]
+        if codec in FLTP_CODECS:
+            stream["sample_fmt"] = "fltp"
+        stream["r_frame_rate"] = "0/0"
+        stream["avg_frame_rate"] = "0/0"
+    elif fields["type"] == 17:
+        stream["codec_type"] = "subtitle"
+    else:
+        return None
+
+    return stream
+
+
+def _read_mkv(buf):
+    segment = None
+    for eid, s, e in _ebml_elements(buf, 0, len(buf)):
+        if eid == 0x18538067:
+            segment = (s, e)
+            break
+    if segment is None:
+        return None
+
+    timecode_scale = 1000000
+    streams = None
+    for eid, s, e in _ebml_elements(buf, segment[0], segment[1]):
+        if eid == 0x1549A966:
+            for iid, is_, ie in _ebml_elements(buf, s, e):
+                if iid == 0x2AD7B1:
+                    timecode_scale = _ebml_uint(buf, is_, ie)
+        elif eid == 0x1654AE6B:
+            streams = []
+            for tid, ts, te in _ebml_elements(buf, s, e):
+                if tid != 0xAE:
+                    continue
+                stream = _mkv_track(buf, ts, te, timecode_scale)
+                if stream is None:
+                    return None
+                stream["index"] = len(streams)
+                streams.append(stream)
+        elif eid == 0x1F43B675:
+            # 读到 Cluster 即停止，Tracks 不在文件头时交给 ffprobe
+            break
+
+    if streams is not None:
+        # Info 可能排在 Tracks 之后，统一按最终的 TimecodeScale 修正
+        tb = "%d/%d" % av_reduce(timecode_scale, 1000000000)
+        for st in streams:
+            st["time_base"] = tb
+
+    return streams
+
+
+def read_streams(path):
+    """读取容器头，返回 ffprobe 风格的流列表；无法识别时返回 None"""
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < 16:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                magic = buf[:4]
+                if magic == b"\x1a\x45\xdf\xa3":
+                    return _read_mkv(buf)
+                if buf[4:8] in (b"ftyp", b"moov", b"mdat", b"free", b"wide", b"skip"):
+                    return _read_mp4(buf)
+    except (OSError, ValueError, IndexError, struct.error):
+        return None
+
+    return None
+
+
+def probe(path, fields, select=None):
+    """
+    ffprobe.export 的快速路径
+    :param fields: 请求的流字段集合
+    :param select: ("v", 0) 形式的流选择，对应 -select_streams
+    :return: {"streams": [...]}，任何字段解不出来都返回 None
+    """
+    streams = read_streams(path)
+    if streams is None:
+        return None
+
+    if select is not None:
+        stype = {"v": "video", "a": "audio", "s": "subtitle"}[select[0]]
+        typed = [s for s in streams if s["codec_type"] == stype]
+        streams = typed[select[1]:select[1] + 1]
+
+    wanted = set(fields) | {"codec_type", "index"}
+    out = []
+    for s in streams:
+        required = wanted
+        if s["codec_type"] == "video":
+            required = wanted - AUDIO_ONLY
+        elif s["codec_type"] == "audio":
+            required = wanted - VIDEO_ONLY
+        if not required.issubset(s):
+            return None
+        out.append({k: s[k] for k in s if k in wanted})
+
+    return {"streams": out}
+
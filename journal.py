@@ -0,0 +1,166 @@
+import os
+import json
+import hashlib
+import threading
+
+import core
+
+
+def command_hash(args):
+    return hashlib.sha256(json.dumps(list(args), ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def is_file_output(path):
+    # 管道、网络地址、空输出不做临时文件改名
+    return bool(path) and not path.startswith(("-", "pipe:")) and "://" not in path and path != os.devnull
+
+
+def part_path(path):
+    # 保留扩展名，ffmpeg 仍能按后缀推断封装格式
+    directory, name = os.path.split(path)
+    stem, ext = os.path.splitext(name)
+
+    return os.path.join(directory, f".{stem}.part{ext}")
+
+
+def fingerprint(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return [os.path.abspath(path), None, None]
+
+    return [os.path.abspath(path), st.st_size, st.st_mtime_ns]
+
+
+def _concat_lists(args):
+    # -f concat 紧跟的输入是清单文件
+    lists = set()
+    fmt = None
+    for i, a in enumerate(args[:-1]):
+        if a == "-f":
+            fmt = args[i + 1]
+        elif a == "-i":
+            if fmt == "concat":
+                lists.add(args[i + 1])
+            fmt = None
+
+    return lists
+
+
+def _concat_entries(list_path):
+    base = os.path.dirname(os.path.abspath(list_path))
+    entries = []
+    try:
+        with open(list_path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith("file "):
+                    p = line[5:].strip().strip("'\"")
+                    entries.append(p if os.path.isabs(p) else os.path.join(base, p))
+    except OSError:
+        pass
+
+    return entries
+
+
+def expanded_inputs(args):
+    """命令的所有输入路径，concat 清单后面紧跟清单里的每个文件"""
+    lists = _concat_lists(args)
+    result = []
+    for p in core.input_paths(args):
+        result.append(p)
+        if p in lists:
+            result.extend(_concat_entries(p))
+
+    return result
+
+
+def input_fingerprints(args):
+    """
+    命令所有输入的指纹 [绝对路径, 大小, mtime]
+    concat 清单每次运行都会重写，改为按内容哈希，并展开清单里的每个文件
+    """
+    lists = _concat_lists(args)
+    result = []
+    for p in core.input_paths(args):
+        if p not in lists:
+            result.append(fingerprint(p))
+            continue
+        try:
+            with open(p, "rb") as f:
+                result.append([os.path.abspath(p), hashlib.sha256(f.read()).hexdigest()])
+        except OSError:
+            result.append([os.path.abspath(p), None])
+        result.extend(fingerprint(e) for e in _concat_entries(p))
+
+    return result
+
+
+class Journal:
+    """
+    批处理任务日志（JSONL，追加写）
+    每个成功任务记一行：输出路径、输入指纹、命令哈希、输出指纹；同一输出以最后一行为准。
+    重跑时输入、命令、输出都没变的任务直接跳过。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        # 崩溃时最后一行可能只写了一半
+                        continue
+                    self.entries[rec["output"]] = rec
+        except FileNotFoundError:
+            pass
+
+    def owns(self, output):
+        return os.path.abspath(output) in self.entries
+
+    def up_to_date(self, args):
+        """split 多路输出的命令要每个输出都有记录且完好才算最新"""
+        outputs = core.output_paths(args) if args else []
+        if not outputs or not all(is_file_output(o) for o in outputs):
+            return False
+        cmd, inputs = command_hash(args), None
+        for output in outputs:
+            rec = self.entries.get(os.path.abspath(output))
+            if rec is None or rec["cmd"] != cmd or rec["result"] != fingerprint(output):
+                return False
+            inputs = inputs or input_fingerprints(args)
+            if rec["inputs"] != inputs:
+                return False
+
+        return True
+
+    def record(self, args):
+        """每个输出各记一行"""
+        cmd, inputs = command_hash(args), input_fingerprints(args)
+        recs = [{"output": os.path.abspath(o), "cmd": cmd, "inputs": inputs, "result": fingerprint(o)}
+                for o in core.output_paths(args)]
+        lines = "".join(json.dumps(rec, ensure_ascii=False) + "\n" for rec in recs)
+        with self._lock:
+            for rec in recs:
+                self.entries[rec["output"]] = rec
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def compact(self):
+        """按当前条目重写日志，去掉被覆盖的旧行"""
+        with self._lock:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for rec in self.entries.values():
+                    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
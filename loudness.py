@@ -0,0 +1,75 @@
+import json
+import subprocess
+
+from cache import resolve_cache
+
+
+# EBU R128：节目响度 -23 LUFS，真峰值 -1 dBTP
+DEFAULT_TARGET = -23.0
+DEFAULT_TRUE_PEAK = -1.0
+DEFAULT_LRA = 7.0
+
+
+def _target_args(target, true_peak, lra):
+    return f"I={target}:TP={true_peak}:LRA={lra}"
+
+
+def _parse(stderr):
+    # loudnorm 的 print_format=json 把结果作为最后一个 {...} 块打印在 stderr 末尾
+    start, end = stderr.rfind("{"), stderr.rfind("}")
+    if start < 0 or end < start:
+        return None
+    try:
+        data = json.loads(stderr[start:end + 1])
+    except ValueError:
+        return None
+
+    return {k: float(v) for k, v in data.items() if k.startswith(("input_", "target_offset"))}
+
+
+def measure(path, target=DEFAULT_TARGET, true_peak=DEFAULT_TRUE_PEAK, lra=DEFAULT_LRA, stream=0, cache=True):
+    """
+    loudnorm 测量（第一遍），只解码音频：-vn/-sn/-dn 放在输入前，视频流根本不进解码器
+    结果按文件指纹与目标参数缓存，重跑批次不再重复测量
+    :param stream: 第几条音频流
+    :return: {"input_i", "input_tp", "input_lra", "input_thresh", "target_offset"}；
+             没有音轨或测量失败时抛出 RuntimeError
+    """
+    probe_cache = resolve_cache(cache)
+    key = f"loudnorm a:{stream} {_target_args(target, true_peak, lra)}"
+    if probe_cache is not None:
+        data = probe_cache.get(path, key)
+        if data is not None:
+            return data
+
+    command = ["ffmpeg", "-hide_banner", "-nostdin", "-nostats", "-vn", "-sn", "-dn", "-i", path,
+               "-map", f"0:a:{stream}", "-af", f"loudnorm={_target_args(target, true_peak, lra)}:print_format=json",
+               "-f", "null", "-"]
+    proc = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors="replace")
+    data = _parse(proc.stderr) if proc.returncode == 0 else None
+    if data is None:
+        tail = "\n".join(proc.stderr.strip().splitlines()[-3:])
+        raise RuntimeError(f"❌ 响度测量失败: {path}\n{tail}")
+
+    if probe_cache is not None:
+        probe_cache.put(path, key, data)
+
+    return data
+
+
+def loudnorm_filter(measured=None, target=DEFAULT_TARGET, true_peak=DEFAULT_TRUE_PEAK, lra=DEFAULT_LRA):
+    """
+    一遍完成的 loudnorm 滤镜串
+    loudnorm 输出固定为 192kHz，调用方要用 -ar 指定输出采样率（滤镜链里接 aresample 在部分声道布局下协商失败）
+    :param measured: measure() 的结果；给出时按测量值线性归一化，不给时退化为单遍动态模式
+    :return: 滤镜串；测量结果是静音（-inf）时返回 None，静音无需也无法归一化
+    """
+    chain = f"loudnorm={_target_args(target, true_peak, lra)}"
+    if measured is not None:
+        if measured["input_i"] == float("-inf"):
+            return None
+        chain += (f":measured_I={measured['input_i']}:measured_TP={measured['input_tp']}"
+                  f":measured_LRA={measured['input_lra']}:measured_thresh={measured['input_thresh']}"
+                  f":offset={measured['target_offset']}:linear=true")
+
+    return chain
@@ -0,0 +1,366 @@
+from array import array
+from operator import add, mul, attrgetter
+from itertools import repeat
+from fractions import Fraction
+from collections import Counter
+
+
+# ffprobe 字段按类型解析一次：整数、浮点、有理数（帧率、时间基保持精确），其余按原文保存
+INT_FIELDS = ("index", "width", "height", "coded_width", "coded_height", "has_b_frames", "level", "refs",
+              "sample_rate", "channels", "bits_per_sample", "bits_per_raw_sample", "bit_rate", "max_bit_rate",
+              "nb_frames", "duration_ts", "start_pts", "nb_read_frames", "nb_read_packets")
+FLOAT_FIELDS = ("duration", "start_time")
+RATIONAL_FIELDS = ("r_frame_rate", "avg_frame_rate", "time_base")
+TEXT_FIELDS = ("codec_type", "codec_name", "codec_long_name", "profile", "codec_tag_string", "codec_tag",
+               "pix_fmt", "field_order", "sample_aspect_ratio", "display_aspect_ratio", "color_range",
+               "color_space", "color_transfer", "color_primaries", "chroma_location", "sample_fmt",
+               "channel_layout")
+STREAM_FIELDS = INT_FIELDS + FLOAT_FIELDS + RATIONAL_FIELDS + TEXT_FIELDS
+_FIELD_SET = frozenset(STREAM_FIELDS)
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# 解析过的有理数按原文复用同一个对象：帧率、时间基的取值很少，MediaTable 建表时可按对象身份编码，
+# 不必对每个文件重新计算 Fraction 的哈希（Python 层实现，是整列编码里最慢的一步）
+_RATIONALS = {}
+
+
+def _rational(value):
+    # "30000/1001" -> Fraction(30000, 1001)；"0/0"、"N/A" -> None
+    if isinstance(value, Fraction) or value is None:
+        return value
+    fraction = _RATIONALS.get(value)
+    if fraction is None:
+        try:
+            fraction = Fraction(str(value))
+        except (ValueError, ZeroDivisionError):
+            return None
+        if len(_RATIONALS) < 4096:
+            _RATIONALS[value] = fraction
+
+    return fraction
+
+
+_PARSERS = {**{k: _int for k in INT_FIELDS}, **{k: _float for k in FLOAT_FIELDS},
+            **{k: _rational for k in RATIONAL_FIELDS}}
+
+
+class StreamInfo:
+    """
+    单条流的探测信息，字段用 __slots__ 存放，数值在构建时解析一次
+    支持 info["width"] / info.get("width") / dict(info) 的只读映射用法，未探测的已知字段取值为 None，
+    不认识的字段放在 extra 里
+    """
+
+    __slots__ = STREAM_FIELDS + ("extra",)
+
+    def __init__(self, data=None):
+        for k in self.__slots__:
+            setattr(self, k, None)
+        for k, v in (data or {}).items():
+            if k in _FIELD_SET:
+                parser = _PARSERS.get(k)
+                setattr(self, k, parser(v) if parser is not None else v)
+            else:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[k] = v
+
+    def __getitem__(self, key):
+        if key in _FIELD_SET:
+            return getattr(self, key)
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        return default if value is None else value
+
+    def keys(self):
+        """有值的字段名"""
+        keys = [k for k in STREAM_FIELDS if getattr(self, k) is not None]
+        return keys + list(self.extra or ())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def to_dict(self):
+        return {k: self[k] for k in self.keys()}
+
+    def pack(self):
+        """紧凑序列化：只存有值的字段，[槽位序号, 值, 槽位序号, 值, ...]，有理数存为 [分子, 分母]"""
+        packed = []
+        for i, k in enumerate(self.__slots__):
+            v = getattr(self, k)
+            if v is not None:
+                packed += [i, [v.numerator, v.denominator] if isinstance(v, Fraction) else v]
+
+        return packed
+
+    @classmethod
+    def unpack(cls, packed):
+        info = cls()
+        for i, v in zip(packed[::2], packed[1::2]):
+            k = cls.__slots__[i]
+            setattr(info, k, _rational(f"{v[0]}/{v[1]}") if k in RATIONAL_FIELDS else v)
+
+        return info
+
+    def __repr__(self):
+        return f"StreamInfo({self.to_dict()!r})"
+
+
+class MediaInfo:
+    """
+    单个文件的探测结果：路径 + 各条流的 StreamInfo，按流类型查找而不依赖流在文件里的顺序
+    info["video"] / info["audio"] 取该类型的第一条流，文件里没有这种流时给出字段全为 None 的空流
+    """
+
+    __slots__ = ("path", "streams")
+
+    def __init__(self, path, streams=()):
+        self.path = path
+        self.streams = tuple(streams)
+
+    @classmethod
+    def from_streams(cls, path, streams):
+        """由 ffprobe 的流列表（dict）构建"""
+        return cls(path, (StreamInfo(st) for st in streams or ()))
+
+    def stream(self, codec_type, n=0):
+        """第 n 条指定类型的流，没有时返回 None"""
+        for st in self.streams:
+            if st.codec_type == codec_type:
+                if n == 0:
+                    return st
+                n -= 1
+
+        return None
+
+    def has(self, codec_type):
+        return self.stream(codec_type) is not None
+
+    @property
+    def video(self):
+        return self.stream("video")
+
+    @property
+    def audio(self):
+        return self.stream("audio")
+
+    def __getitem__(self, codec_type):
+        st = self.stream(codec_type)
+        return st if st is not None else StreamInfo({"codec_type": codec_type})
+
+    def get(self, codec_type, default=None):
+        st = self.stream(codec_type)
+        return st if st is not None else default
+
+    def to_dict(self):
+        return {st.codec_type: st.to_dict() for st in reversed(self.streams)}
+
+    def pack(self):
+        return [st.pack() for st in self.streams]
+
+    @classmethod
+    def unpack(cls, path, data):
+        return cls(path, (StreamInfo.unpack(values) for values in data))
+
+    def __repr__(self):
+        return f"MediaInfo({self.path!r}, {len(self.streams)} streams)"
+
+
+_EMPTY_STREAM = StreamInfo()
+
+
+def _split_streams(data):
+    """
+    每个文件取第一条视频流和第一条音频流，一趟遍历同时拆出两列
+    :param data: MediaInfo、{"video": {...}, "audio": {...}} 或 ffprobe 流列表组成的序列
+    :return: (视频流列表, 音频流列表)，没有该类型的流时给空流
+    """
+    videos, audios = [], []
+    add_video, add_audio = videos.append, audios.append
+    for d in data:
+        if isinstance(d, dict):
+            add_video(d["video"])
+            add_audio(d["audio"])
+            continue
+        typed = isinstance(d, MediaInfo)
+        video = audio = None
+        for st in d.streams if typed else d:
+            kind = st.codec_type if typed else st.get("codec_type")
+            if kind == "video":
+                if video is None:
+                    video = st
+            elif kind == "audio" and audio is None:
+                audio = st
+        empty = _EMPTY_STREAM if typed else {}
+        add_video(empty if video is None else video)
+        add_audio(empty if audio is None else audio)
+
+    return videos, audios
+
+
+class MediaTable:
+    """
+    列式媒体表
+    每个字段一列 array('l')，存字典编码后的整数；原值按编码顺序存在 values 里。
+    列名形如 "video.codec_name" / "audio.sample_rate"，缺失的流或字段记为 None。
+    """
+
+    def __init__(self, columns):
+        self.paths = []
+        self.columns = {c: array("l") for c in columns}
+        self.values = {c: [] for c in columns}
+        self._codes = {c: {} for c in columns}
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _encode(self, column, value):
+        codes = self._codes[column]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self.values[column])
+            self.values[column].append(value)
+
+        return code
+
+    def append(self, path, row):
+        """
+        :param row: {列名: 值}，未给出的列记为 None
+        """
+        self.paths.append(path)
+        for c, col in self.columns.items():
+            col.append(self._encode(c, row.get(c)))
+
+        return self
+
+    def _fill(self, column, values, by_identity=False):
+        """
+        整列编码：逐值查编码字典（新值取当前字典长度作编码）直接写进 array，不经过逐行的 row 字典
+        :param by_identity: 先按对象身份去重再编码，用于取值对象共享、但哈希很慢的列（Fraction）
+        """
+        codes = self._codes[column]
+        if by_identity:
+            # 按首次出现顺序给不同的对象编码（通常只有几个），再按对象身份整列查表
+            values = list(values)
+            ids = list(map(id, values))
+            by_id = {i: codes.setdefault(v, len(codes)) for i, v in dict(zip(ids, values)).items()}
+            codes_list = list(map(by_id.__getitem__, ids))
+        else:
+            codes_list = list(map(codes.setdefault, values, map(len, repeat(codes))))
+        self.columns[column].fromlist(codes_list)
+        self.values[column] = list(codes)
+
+    @staticmethod
+    def column_names(v_keys, a_keys):
+        return [f"video.{k}" for k in v_keys] + [f"audio.{k}" for k in a_keys]
+
+    @classmethod
+    def _from_streams(cls, paths, videos, audios, v_keys, a_keys):
+        """按列构建：每个字段在整列流上取一次值再整列编码"""
+        table = cls(cls.column_names(v_keys, a_keys))
+        table.paths = paths
+        for side, streams, keys in (("video", videos, v_keys), ("audio", audios, a_keys)):
+            kinds = set(map(type, streams))
+            for k in keys:
+                if kinds == {StreamInfo} and k in _FIELD_SET:
+                    table._fill(f"{side}.{k}", map(attrgetter(k), streams), k in RATIONAL_FIELDS)
+                elif kinds == {dict}:
+                    table._fill(f"{side}.{k}", map(dict.get, streams, repeat(k)))
+                else:
+                    table._fill(f"{side}.{k}", (st.get(k) for st in streams))
+
+        return table
+
+    @classmethod
+    def from_info(cls, info_dict, v_keys, a_keys):
+        """由 videos_core_info_detect 的结果（MediaInfo 或 {"video": {...}, "audio": {...}}）构建"""
+        return cls._from_streams(list(info_dict), *_split_streams(info_dict.values()), v_keys, a_keys)
+
+    @classmethod
+    def from_probe(cls, results, v_keys, a_keys):
+        """
+        由 probe_batch 的结果（流列表或 MediaInfo）构建，探测失败的文件跳过
+        :return: (表, {路径: 错误信息})
+        """
+        paths, data, errors = [], [], {}
+        for path, streams, err in results:
+            if err is not None:
+                errors[path] = err
+            else:
+                paths.append(path)
+                data.append(streams)
+        return cls._from_streams(paths, *_split_streams(data), v_keys, a_keys), errors
+
+    def column(self, name):
+        values = self.values[name]
+        return [values[code] for code in self.columns[name]]
+
+    def counts(self, name):
+        """{值: 出现次数}，按首次出现顺序排列"""
+        values = self.values[name]
+        return {values[code]: n for code, n in Counter(self.columns[name]).items()}
+
+    def group_by(self, columns=None):
+        """
+        按若干列分组，同组文件这些字段完全一致
+        :param columns: 参与分组的列名，默认全部列
+        :return: 按文件数从多到少排列的 [{"key": {列名: 值}, "count": n, "members": [路径, ...]}, ...]
+        """
+        columns = list(columns or self.columns)
+        if not self.paths:
+            return []
+
+        # 逐列把编码合成一个混合进制的整数键，只有一个取值的列不参与合成
+        combined = None
+        for c in columns:
+            radix = len(self.values[c])
+            if radix < 2:
+                continue
+            if combined is None:
+                combined = self.columns[c]
+            else:
+                combined = list(map(add, map(mul, combined, repeat(radix)), self.columns[c]))
+        if combined is None:
+            combined = array("l", bytes(array("l").itemsize * len(self.paths)))
+
+        # 计数与稳定排序都在 C 层完成，排序后同组下标连续，按计数切片即得成员
+        counts = Counter(combined)
+        order = sorted(range(len(combined)), key=combined.__getitem__)
+        clusters = []
+        offset = 0
+        for k in sorted(counts):
+            members = order[offset:offset + counts[k]]
+            offset += counts[k]
+            first = members[0]
+            key = {c: self.values[c][self.columns[c][first]] for c in columns}
+            clusters.append({"key": key, "count": len(members), "members": list(map(self.paths.__getitem__, members))})
+        clusters.sort(key=lambda g: g["count"], reverse=True)
+
+        return clusters
@@ -0,0 +1,128 @@
+import os
+import sys
+import json
+import time
+
+
+def wait_rusage(proc):
+    """
+    用 os.wait4 回收子进程并取得它自己的资源占用（并发任务之间互不干扰）
+    :return: resource.struct_rusage；平台不支持或进程已被回收时返回 None
+    """
+    if not hasattr(os, "wait4"):
+        proc.wait()
+        return None
+    try:
+        _, status, usage = os.wait4(proc.pid, 0)
+    except ChildProcessError:
+        proc.wait()
+        return None
+    proc.returncode = os.waitstatus_to_exitcode(status)
+
+    return usage
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+class JobRecord:
+    def __init__(self, name, args, returncode=None, wall=0.0, usage=None, inputs=(), output=None,
+                 duration=None, started=None, status=None):
+        """
+        单个 ffmpeg 任务的资源记录
+        :param usage: wait_rusage 返回的 rusage
+        :param inputs: 输入文件路径
+        :param output: 输出文件路径
+        :param duration: 输出的媒体时长（秒），用于计算实时倍速
+        """
+        self.name = name
+        self.args = list(args)
+        self.status = status
+        self.returncode = returncode
+        self.started = started if started is not None else time.time() - wall
+        self.wall = wall
+        self.user = usage.ru_utime if usage is not None else None
+        self.sys = usage.ru_stime if usage is not None else None
+        # Linux 上 ru_maxrss 单位是 KB，macOS 上是字节
+        if usage is None:
+            self.max_rss = None
+        else:
+            self.max_rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+        sizes = [_file_size(p) for p in inputs]
+        self.input_bytes = sum(s for s in sizes if s is not None) if sizes else None
+        self.output_bytes = _file_size(output) if output else None
+        self.duration = duration
+        self.speed = duration / wall if duration and wall > 0 else None
+
+    @property
+    def cpu(self):
+        return None if self.user is None else self.user + self.sys
+
+    def to_dict(self):
+        return {"name": self.name, "status": self.status, "returncode": self.returncode, "started": self.started,
+                "wall": self.wall, "user": self.user, "sys": self.sys, "cpu": self.cpu, "max_rss": self.max_rss,
+                "input_bytes": self.input_bytes, "output_bytes": self.output_bytes, "duration": self.duration,
+                "speed": self.speed, "args": self.args}
+
+    def __repr__(self):
+        return f"JobRecord({self.name!r}, wall={self.wall:.2f}s, cpu={self.cpu}, returncode={self.returncode})"
+
+
+def write_jsonl(records, path):
+    """追加写入 JSON Lines，每个任务一行"""
+    with open(path, "a", encoding="utf-8") as f:
+        for r in records:
+            f.write(json.dumps(r.to_dict(), ensure_ascii=False) + "\n")
+
+
+PROM_METRICS = [
+    ("wall_seconds", "wall", "任务墙钟时间"),
+    ("cpu_user_seconds", "user", "子进程用户态 CPU 时间"),
+    ("cpu_system_seconds", "sys", "子进程内核态 CPU 时间"),
+    ("max_rss_bytes", "max_rss", "子进程峰值常驻内存"),
+    ("input_bytes", "input_bytes", "输入文件总大小"),
+    ("output_bytes", "output_bytes", "输出文件大小"),
+    ("speed_ratio", "speed", "实时倍速（媒体时长 / 墙钟时间）"),
+    ("exit_code", "returncode", "退出码"),
+]
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def write_prometheus(records, path, prefix="clipforge_job"):
+    """
+    写出 Prometheus textfile（node_exporter textfile collector 格式），先写临时文件再原子替换
+    每个任务一组 gauge，另附整批的 CPU 与墙钟合计
+    """
+    records = list(records)
+    lines = []
+    for metric, attr, doc in PROM_METRICS:
+        lines.append(f"# HELP {prefix}_{metric} {doc}")
+        lines.append(f"# TYPE {prefix}_{metric} gauge")
+        for r in records:
+            value = getattr(r, attr)
+            if value is not None:
+                lines.append(f'{prefix}_{metric}{{job="{_label(r.name)}",status="{_label(r.status)}"}} {value}')
+
+    cpu = sum(r.cpu for r in records if r.cpu is not None)
+    wall = sum(r.wall for r in records)
+    lines.append(f"# HELP {prefix}s_cpu_seconds_total 整批子进程 CPU 时间合计")
+    lines.append(f"# TYPE {prefix}s_cpu_seconds_total counter")
+    lines.append(f"{prefix}s_cpu_seconds_total {cpu}")
+    lines.append(f"# HELP {prefix}s_wall_seconds_total 整批任务墙钟时间合计")
+    lines.append(f"# TYPE {prefix}s_wall_seconds_total counter")
+    lines.append(f"{prefix}s_wall_seconds_total {wall}")
+    lines.append(f"# HELP {prefix}s_total 任务数")
+    lines.append(f"# TYPE {prefix}s_total gauge")
+    lines.append(f"{prefix}s_total {len(records)}")
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp, path)
@@ -0,0 +1,285 @@
+import os
+import math
+import subprocess
+from fractions import Fraction
+
+import core
+from cache import resolve_cache
+
+
+def _numpy():
+    # numpy 只有包级分析用得到，按需导入
+    try:
+        import numpy
+    except ImportError as e:
+        raise ImportError("❌ 包级分析需要 numpy，请先 pip install numpy") from e
+
+    return numpy
+
+
+# compact 输出里各列对应的字段名
+PACKET_ENTRIES = {"pts": "pts_time", "dts": "dts_time", "duration": "duration_time", "size": "size", "key": "flags"}
+FRAME_ENTRIES = {"pts": "best_effort_timestamp_time", "dts": "pkt_dts_time", "duration": "duration_time",
+                 "size": "pkt_size", "key": "key_frame"}
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class PacketTable:
+    """
+    单条流的逐包（或逐帧）时间信息，按列存成 numpy 数组：pts/dts/duration（秒，缺失为 NaN）、size（字节）、key
+    ffprobe 的 compact 输出逐行读入预分配的数组，满了按倍数扩容，内存只与包数成正比（每包约 33 字节），
+    不会像 -show_packets 的 JSON 那样整体驻留在内存里
+    """
+
+    def __init__(self, capacity=65536):
+        np = _numpy()
+        capacity = max(16, int(capacity))
+        self.pts = np.empty(capacity, dtype=np.float64)
+        self.dts = np.empty(capacity, dtype=np.float64)
+        self.duration = np.empty(capacity, dtype=np.float64)
+        self.size = np.empty(capacity, dtype=np.int64)
+        self.key = np.empty(capacity, dtype=np.bool_)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _grow(self):
+        np = _numpy()
+        capacity = len(self.pts) * 2
+        for name in ("pts", "dts", "duration", "size", "key"):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def append(self, pts, dts, duration, size, key):
+        if self.count == len(self.pts):
+            self._grow()
+        i = self.count
+        self.pts[i] = pts
+        self.dts[i] = dts
+        self.duration[i] = duration
+        self.size[i] = size
+        self.key[i] = key
+        self.count += 1
+
+    def trim(self):
+        """截掉预分配未用的部分"""
+        for name in ("pts", "dts", "duration", "size", "key"):
+            setattr(self, name, getattr(self, name)[:self.count].copy())
+
+        return self
+
+    @classmethod
+    def read(cls, path, stream="v:0", frames=False, interval=None, capacity=None):
+        """
+        流式读取 ffprobe 的包（或帧）列表
+        :param stream: 流选择，如 "v:0"、"a:0"
+        :param frames: True 时读 -show_frames（需要解码，慢得多，但能看到解码后的真实时间戳）
+        :param interval: 只读一段，原样传给 -read_intervals，如 "60%+30"
+        :param capacity: 预分配的包数，默认按容器时长与标称帧率估算
+        """
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"❌ 输入文件不存在: {path}")
+        if capacity is None:
+            capacity = _estimate_packets(path, stream)
+
+        entries = FRAME_ENTRIES if frames else PACKET_ENTRIES
+        section = "frame" if frames else "packet"
+        command = ["ffprobe", "-v", "error", "-select_streams", stream,
+                   "-show_entries", f"{section}={','.join(entries.values())}", "-of", "compact=p=0"]
+        if interval is not None:
+            command += ["-read_intervals", interval]
+        command.append(path)
+
+        pts_k, dts_k, dur_k, size_k, key_k = (entries[k] for k in ("pts", "dts", "duration", "size", "key"))
+        table = cls(capacity)
+        with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                              errors="replace") as proc:
+            for line in proc.stdout:
+                fields = dict(item.split("=", 1) for item in line.rstrip("|\n").split("|") if "=" in item)
+                if pts_k not in fields:
+                    # 帧列表里夹带的 side_data 等子段
+                    continue
+                size = fields.get(size_k)
+                key = fields.get(key_k, "")
+                table.append(_float(fields[pts_k]), _float(fields.get(dts_k)), _float(fields.get(dur_k)),
+                             int(size) if size and size.isdigit() else 0,
+                             key == "1" if frames else "K" in key)
+            stderr = proc.stderr.read()
+        if proc.returncode != 0:
+            raise RuntimeError(f"❌ ffprobe 执行失败: {stderr}")
+
+        return table.trim()
+
+    def presentation_order(self):
+        """按 pts 排序的下标（B 帧的包是解码顺序），缺失 pts 的包排除在外"""
+        np = _numpy()
+        valid = np.flatnonzero(~np.isnan(self.pts))
+
+        return valid[np.argsort(self.pts[valid], kind="stable")]
+
+    def intervals(self):
+        """相邻帧（按显示顺序）的时间间隔（秒）"""
+        np = _numpy()
+        return np.diff(self.pts[self.presentation_order()])
+
+    def bitrate(self, window=1.0):
+        """
+        按时间窗统计码率
+        :param window: 窗口长度（秒）
+        :return: (各窗口起点秒数, 各窗口码率 bit/s)，两个 numpy 数组
+        """
+        np = _numpy()
+        order = self.presentation_order()
+        if not len(order):
+            return np.empty(0), np.empty(0)
+        pts = self.pts[order]
+        start = pts[0]
+        bins = ((pts - start) // window).astype(np.int64)
+        bits = np.bincount(bins, weights=self.size[order] * 8.0)
+
+        return start + np.arange(len(bits)) * window, bits / window
+
+    def gop_lengths(self):
+        """
+        各 GOP 的长度：两个相邻关键帧之间的帧数与秒数（按显示顺序），最后一个不完整的 GOP 不计
+        :return: (帧数数组, 秒数数组)
+        """
+        np = _numpy()
+        order = self.presentation_order()
+        keys = np.flatnonzero(self.key[order])
+        if len(keys) < 2:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        return np.diff(keys), np.diff(self.pts[order][keys])
+
+    def gop_stats(self):
+        frames, seconds = self.gop_lengths()
+        if not len(frames):
+            return {"count": 0, "min": None, "max": None, "mean": None, "max_seconds": None, "fixed": None}
+
+        return {"count": int(len(frames)), "min": int(frames.min()), "max": int(frames.max()),
+                "mean": float(frames.mean()), "max_seconds": float(seconds.max()),
+                "fixed": bool(frames.min() == frames.max())}
+
+    def frame_rate(self, tolerance=0.1, nominal=()):
+        """
+        由实际时间戳判断帧率是否恒定
+        :param tolerance: 帧间隔偏离中位数的相对容差；容器时间基取整（如 mkv 的毫秒）造成的抖动不算变帧率
+        :param nominal: 流头部的标称帧率（r_frame_rate、avg_frame_rate），实测值在取整误差内与之一致时取标称值
+        :return: {"fps": 按中位间隔算的帧率, "fps_mean": 平均帧率, "measured": 实测帧率, "vfr": 是否变帧率,
+                  "irregular": 偏离中位间隔的比例, "min_interval", "max_interval"}
+        """
+        np = _numpy()
+        deltas = self.intervals()
+        deltas = deltas[deltas > 0]
+        if not len(deltas):
+            return {"fps": None, "fps_mean": None, "measured": None, "vfr": None, "irregular": None,
+                    "min_interval": None, "max_interval": None}
+
+        median = float(np.median(deltas))
+        allowed = max(median * tolerance, 0.0011)
+        irregular = float(np.mean(np.abs(deltas - median) > allowed))
+
+        # 中位间隔会被时间基整体取整（mkv 毫秒时间戳下 30 与 29.97 fps 都是 33ms，算出来都是 30.303），
+        # 平均帧率的取整误差只来自首尾两帧，再按这个误差范围对齐到标称帧率
+        span = float(deltas.sum())
+        fps_mean = len(deltas) / span
+        jitter = min(float(np.abs(deltas - median).max()), allowed)
+        bound = fps_mean * (2 * jitter / span + 1e-6)
+        close = [float(f) for f in nominal if f and abs(float(f) - fps_mean) <= bound]
+        measured = min(close, key=lambda f: abs(f - fps_mean)) if close else fps_mean
+
+        return {"fps": 1 / median, "fps_mean": fps_mean, "measured": measured,
+                "vfr": irregular > 0.01, "irregular": irregular,
+                "min_interval": float(deltas.min()), "max_interval": float(deltas.max())}
+
+    def summary(self, window=1.0, nominal=()):
+        """
+        可 JSON 序列化的汇总：包数、平均/峰值码率、GOP 统计、帧率判定
+        :param nominal: 标称帧率，见 frame_rate
+        """
+        _, rates = self.bitrate(window)
+        pts = self.pts[~_numpy().isnan(self.pts)]
+        span = float(pts.max() - pts.min()) if len(pts) else 0.0
+
+        return {"packets": len(self),
+                "bytes": int(self.size.sum()),
+                "span": span,
+                "bitrate_mean": float(self.size.sum() * 8 / span) if span > 0 else None,
+                "bitrate_peak": float(rates.max()) if len(rates) else None,
+                "gop": self.gop_stats(),
+                "frame_rate": self.frame_rate(nominal=nominal)}
+
+
+def _estimate_packets(path, stream):
+    # 容器时长 × 标称帧率，多留一成余量；估不出来时用默认容量，不够再扩
+    try:
+        info = core.ffprobe().input(path).show_entries("r_frame_rate,sample_rate,duration").export(core=True)
+        duration = core.media_duration(path)
+    except (RuntimeError, FileNotFoundError, ValueError):
+        return 65536
+    kind = stream.split(":", 1)[0]
+    st = next((s for s in info if s.get("codec_type", "")[:1] == kind), None)
+    if not st or not duration:
+        return 65536
+    try:
+        num, den = map(int, str(st.get("r_frame_rate", "0/0")).split("/"))
+        rate = num / den if den else 0
+    except ValueError:
+        rate = 0
+    if kind == "a":
+        # 音频一包约 1024 个采样
+        rate = float(st.get("sample_rate") or 0) / 1024
+    if not rate:
+        return 65536
+
+    return int(duration * rate * 1.1) + 16
+
+
+def _nominal_rates(path, stream):
+    # 流头部的 r_frame_rate / avg_frame_rate，拿不到时为空
+    try:
+        info = core.ffprobe().input(path).show_entries("r_frame_rate,avg_frame_rate").export(core=True)
+    except (RuntimeError, FileNotFoundError, ValueError):
+        return []
+    kind, _, index = stream.partition(":")
+    typed = [s for s in info if s.get("codec_type", "")[:1] == kind]
+    n = int(index or 0)
+    st = typed[n] if n < len(typed) else {}
+    rates = []
+    for key in ("r_frame_rate", "avg_frame_rate"):
+        try:
+            rate = Fraction(str(st.get(key)))
+        except (ValueError, ZeroDivisionError):
+            continue
+        if rate > 0:
+            rates.append(float(rate))
+
+    return rates
+
+
+def timing_summary(path, stream="v:0", cache=True):
+    """
+    流的逐包时间汇总（码率、GOP、帧率是否恒定），与探测结果一起按文件指纹缓存
+    """
+    probe_cache = resolve_cache(cache)
+    key = f"packet timing v2 {stream}"
+    if probe_cache is not None:
+        data = probe_cache.get(path, key)
+        if data is not None:
+            return data
+
+    data = PacketTable.read(path, stream).summary(nominal=_nominal_rates(path, stream))
+    if probe_cache is not None:
+        probe_cache.put(path, key, data)
+
+    return data
@@ -0,0 +1,178 @@
+import os
+import time
+import shutil
+import tempfile
+import subprocess
+
+import core
+import journal
+
+
+class Pipeline:
+    """
+    管道串联的多段处理：每个片段的前置处理写入命名管道（NUT/MPEG-TS 流式封装），
+    concat 分离器按顺序从管道读取并输出最终文件，中间结果不落盘。
+    前置进程与最终合并并发运行，最多同时保持 window 个前置进程。
+    """
+
+    def __init__(self, fmt="nut", window=4, work_dir=None):
+        """
+        :param fmt: 中间流封装格式，"nut" 或 "mpegts"
+        :param window: 同时运行的前置进程数；按顺序读取，靠后的进程写满管道缓冲后会自然阻塞
+        :param work_dir: 放置命名管道的目录，默认系统临时目录
+        """
+        if fmt not in ("nut", "mpegts"):
+            raise ValueError(f"❌ 不支持的中间流格式: {fmt}")
+        self.fmt = fmt
+        self.window = max(1, window)
+        self.work_dir = work_dir
+        self.stages = []
+        self.log_correct = ""
+        self.log_warning = ""
+        self.log_error = ""
+
+    def add(self, exe):
+        """
+        :param exe: 不带 output() 的 ffmpeg 构造器，输出由管道接管
+        """
+        if exe.end_cmd:
+            self.log_error += f"❌ 前置构造器不应指定输出: {exe.end_cmd}\n"
+        self.log_error += exe.log_error
+        self.stages.append(exe)
+
+        return self
+
+    def extend(self, builders):
+        for exe in builders:
+            self.add(exe)
+
+        return self
+
+    def concat(self, output_path, sink=None):
+        """
+        按添加顺序拼接所有片段
+        :param sink: 回调 sink(exe)，为最终构造器设置编码参数；默认音视频都 -c copy
+        :return: 是否成功
+        """
+        if not hasattr(os, "mkfifo"):
+            self.log_error += "❌ 当前平台不支持命名管道。\n"
+        if not self.stages:
+            self.log_error += "❌ 没有可拼接的片段。\n"
+        if self.log_error:
+            self.print_log()
+            return False
+
+        work_dir = tempfile.mkdtemp(prefix="clipforge_pipe_", dir=self.work_dir)
+        part = journal.part_path(output_path)
+        try:
+            fifos = []
+            list_path = os.path.join(work_dir, "concat_list.txt")
+            with open(list_path, "w", encoding="utf-8") as f:
+                for i in range(len(self.stages)):
+                    fifo = os.path.join(work_dir, f"{i:05d}.{self.fmt}")
+                    os.mkfifo(fifo)
+                    fifos.append(fifo)
+                    f.write(f"file '{fifo}'\n")
+
+            final = core.ffmpeg(hide_banner=True, overwrite=True).f(concat=True).safe(0).input(list_path)
+            if sink is not None:
+                sink(final)
+            else:
+                final.video_codec().audio_codec()
+            # 先写临时文件，失败或被终止时不留下半截输出
+            final.output(part)
+
+            ok = self._run(final.cmd(), fifos, work_dir)
+            if ok:
+                os.replace(part, output_path)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            if os.path.exists(part):
+                os.remove(part)
+
+        if ok:
+            self.log_correct += f"✅ 管道合并完成: {output_path}（{len(self.stages)} 段）\n"
+        self.print_log()
+
+        return ok
+
+    def _stage_args(self, exe, fifo):
+        cmd = exe.cmd()
+        # 管道已存在，必须 -y；-nostdin 防止多个进程抢终端输入
+        return cmd[:1] + ["-y", "-nostdin", "-loglevel", "error"] + cmd[1:] + ["-f", self.fmt, fifo]
+
+    def _run(self, final_args, fifos, work_dir):
+        def _spawn(args, name):
+            log = open(os.path.join(work_dir, f"{name}.log"), "w+", encoding="utf-8", errors="replace")
+            proc = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=log)
+            return proc, log
+
+        def _tail(log):
+            log.seek(0)
+            return "\n".join(log.read().strip().splitlines()[-5:])
+
+        consumer, consumer_log = _spawn(final_args, "concat")
+        running = {}
+        logs = [consumer_log]
+        next_stage = 0
+        failed = None
+
+        try:
+            while True:
+                while next_stage < len(self.stages) and len(running) < self.window:
+                    proc, log = _spawn(self._stage_args(self.stages[next_stage], fifos[next_stage]), next_stage)
+                    running[next_stage] = proc
+                    logs.append(log)
+                    next_stage += 1
+
+                for i, proc in list(running.items()):
+                    if proc.poll() is None:
+                        continue
+                    del running[i]
+                    if proc.returncode != 0:
+                        failed = (f"片段 {i} ({core.input_paths(self.stages[i].body_cmd)})",
+                                  _tail(logs[i + 1]))
+
+                # 任一前置失败时合并端会一直等它的管道，合并端退出后前置会一直写不出去，两种情况都要整体终止
+                if failed is not None or consumer.poll() is not None:
+                    break
+                time.sleep(0.05)
+
+            if failed is None:
+                consumer.wait()
+                if consumer.returncode != 0:
+                    failed = ("合并", _tail(consumer_log))
+                elif next_stage < len(self.stages):
+                    failed = ("合并", "合并提前结束，部分片段未被读取")
+            # 合并端读完最后一段时，对应的前置进程可能还没退出
+            for i, proc in list(running.items()):
+                if failed is not None:
+                    break
+                try:
+                    proc.wait(5)
+                except subprocess.TimeoutExpired:
+                    failed = (f"片段 {i}", "合并提前结束，片段未被完整读取")
+                    break
+                del running[i]
+                if proc.returncode != 0:
+                    failed = (f"片段 {i} ({core.input_paths(self.stages[i].body_cmd)})", _tail(logs[i + 1]))
+        finally:
+            for proc in list(running.values()) + [consumer]:
+                if proc.poll() is None:
+                    proc.kill()
+                    proc.wait()
+            for log in logs:
+                log.close()
+
+        if failed is not None:
+            self.log_error += f"❌ 管道执行失败: {failed[0]}\n{failed[1]}\n"
+            return False
+
+        return True
+
+    def print_log(self):
+        run_log = "LOG\n"
+        run_log += self.log_correct
+        run_log += self.log_warning
+        run_log += self.log_error
+        print(run_log)
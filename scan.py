@@ -0,0 +1,63 @@
+import os
+from fnmatch import fnmatch
+
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".mkv", ".avi", ".flv")
+
+
+def scan(root, recursive=False, extensions=VIDEO_EXTENSIONS, pattern=None, sort=False, follow_symlinks=False):
+    """
+    基于 os.scandir 的流式目录扫描，边发现边产出文件路径
+    :param recursive: 是否递归子目录
+    :param extensions: 扩展名过滤（不区分大小写），None 表示不过滤
+    :param pattern: 文件名 glob 过滤，如 "cam_*"
+    :param sort: False（默认）时按文件系统返回顺序立即产出，不缓存整个目录；
+                 True 时每个目录读完后按文件名排序、先文件后子目录，顺序稳定但要等整个目录读完才产出，
+                 只关心结果顺序的调用方应在探测完成后自行排序
+    :param follow_symlinks: 是否跟随目录软链接
+    """
+    if extensions is not None:
+        extensions = tuple(e.lower() for e in extensions)
+
+    def _accept(entry):
+        if not entry.is_file():
+            return False
+        if extensions is not None and not entry.name.lower().endswith(extensions):
+            return False
+        return pattern is None or fnmatch(entry.name, pattern)
+
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            it = os.scandir(directory)
+        except OSError:
+            continue
+
+        subdirs = []
+        with it:
+            if not sort:
+                for entry in it:
+                    if _accept(entry):
+                        yield entry.path
+                    elif recursive and entry.is_dir(follow_symlinks=follow_symlinks):
+                        subdirs.append(entry.path)
+                stack.extend(subdirs)
+                continue
+
+            entries = sorted(it, key=lambda e: e.name)
+
+        for entry in entries:
+            if _accept(entry):
+                yield entry.path
+            elif recursive and entry.is_dir(follow_symlinks=follow_symlinks):
+                subdirs.append(entry.path)
+        # 逆序压栈，出栈时按名称顺序深入
+        stack.extend(reversed(subdirs))
+
+
+def collect(paths, into):
+    """透传迭代器，同时把产出的路径记入 into 列表，方便扫描与探测重叠后仍能拿到完整清单"""
+    for p in paths:
+        into.append(p)
+        yield p
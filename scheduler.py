@@ -0,0 +1,430 @@
+import os
+import time
+import shlex
+import signal
+import threading
+import subprocess
+from collections import deque
+
+import caps
+import core
+import metrics
+import journal as journal_mod
+from cache import resolve_artifacts
+
+
+def is_copy_job(args):
+    # 所有编码器都是 copy 且没有滤镜，视为廉价的流复制任务
+    if any(a in caps.FILTER_FLAGS for a in args):
+        return False
+    codecs = [args[i + 1] for i, a in enumerate(args[:-1]) if a in caps.CODEC_FLAGS]
+
+    return bool(codecs) and all(c == "copy" for c in codecs)
+
+
+def device_of(path):
+    """路径所在设备号（st_dev）；输出文件还不存在时取最近一级已存在的上级目录"""
+    path = os.path.abspath(path)
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+
+def job_devices(args):
+    """命令读写的本地设备（输入、concat 清单里的文件、输出），网络地址与管道不计"""
+    paths = journal_mod.expanded_inputs(args) + core.output_paths(args)
+    devices = {device_of(p) for p in paths if journal_mod.is_file_output(p)}
+    devices.discard(None)
+
+    # 全是网络地址的任务归到一个公共的虚拟设备，同样受默认并发限制
+    return tuple(sorted(devices)) or (None,)
+
+
+class Job:
+    def __init__(self, cmd, name=None, threads=None, retries=None):
+        """
+        :param cmd: ffmpeg 构造器、参数列表或整条命令字符串
+        :param threads: 单任务 -threads 配额，默认由调度器按总预算平分
+        :param retries: 失败重试次数，默认沿用调度器设置
+        """
+        self.builder = None
+        self.error = ""
+        if isinstance(cmd, str):
+            args = shlex.split(cmd)
+        elif isinstance(cmd, (list, tuple)):
+            args = list(cmd)
+        else:
+            self.builder = cmd
+            args = cmd.cmd()
+            self.error = cmd.log_error + "".join(f"❌ {p}\n" for p in cmd.branch_problems())
+
+        self.args = args
+        self.name = name or (args[-1] if args else "")
+        self.copy = is_copy_job(args)
+        # 流复制任务的瓶颈是磁盘，按读写的设备做准入；转码任务只占 CPU 槽位
+        self.devices = job_devices(args) if self.copy else ()
+        self.threads = threads
+        self.retries = retries
+        self.status = "pending"  # pending / running / done / skipped / cached / failed / cancelled
+        self.returncode = None
+        self.attempts = 0
+        self.elapsed = 0.0
+        self.progress = None  # 最近一次进度快照
+        self.total = None
+        self.proc = None
+        self.record = None  # 最后一次执行的 metrics.JobRecord
+
+    @property
+    def ok(self):
+        return self.status in ("done", "skipped", "cached")
+
+    def __repr__(self):
+        return f"Job({self.name!r}, status={self.status}, returncode={self.returncode})"
+
+
+class Scheduler:
+    def __init__(self, workers=None, threads=None, retries=0, cancel_timeout=5, progress=None, journal=None,
+                 artifacts=None, validate=True, io_limits=None, io_limit=4):
+        """
+        :param workers: 同时运行的转码进程数（CPU 槽位）
+        :param threads: 所有转码任务共享的线程预算，默认 CPU 核数
+        :param retries: 失败后的重试次数
+        :param cancel_timeout: 取消时 SIGTERM 后等待多久再 SIGKILL
+        :param progress: 进度回调 progress(job, snapshot)，设置后每个任务都会挂载 -progress pipe:1
+        :param journal: 任务日志（journal.Journal 或日志文件路径），输入与命令都没变且输出完好的任务直接跳过
+        :param artifacts: 产物缓存（见 cache.ArtifactCache），命中时直接链接已有产物；构造器自带的设置同样生效
+        :param validate: 启动前按 ffmpeg 能力清单预检所有任务，不支持的编码器/像素格式/滤镜直接判失败
+        :param io_limits: 按挂载点限制流复制任务的并发，如 {"/mnt/nas": 2, "/data/nvme": 8}；
+                          一个任务读写多个设备时要在每个设备上都有空位才会启动
+        :param io_limit: 未单独配置的设备上流复制任务的默认并发
+        """
+        cpu = os.cpu_count() or 1
+        self.workers = workers or max(1, cpu // 4)
+        self.threads = threads or cpu
+        self.retries = retries
+        self.cancel_timeout = cancel_timeout
+        self.progress = progress
+        self.journal = journal_mod.Journal(journal) if isinstance(journal, str) else journal
+        self.artifacts = resolve_artifacts(artifacts)
+        self.validate = validate
+        self.io_limit = max(1, io_limit)
+        self.io_limits = {device_of(m): max(1, n) for m, n in (io_limits or {}).items()}
+        self.jobs = []
+        # 转码任务一个队列；流复制任务按所涉设备分队列，某个设备满了不会挡住其他设备上的任务
+        self._cpu_queue = deque()
+        self._io_queues = {}
+        self._cpu_busy = 0
+        self._io_busy = {}
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._cancelled = threading.Event()
+        self.log_correct = ""
+        self.log_warning = ""
+        self.log_error = ""
+
+    def add(self, cmd, name=None, threads=None, retries=None):
+        job = cmd if isinstance(cmd, Job) else Job(cmd, name=name, threads=threads, retries=retries)
+        with self._lock:
+            entry = (len(self.jobs), job)
+            if job.copy:
+                self._io_queues.setdefault(job.devices, deque()).append(entry)
+            else:
+                self._cpu_queue.append(entry)
+            self.jobs.append(job)
+            self._cond.notify_all()
+
+        return job
+
+    def extend(self, cmds):
+        return [self.add(c) for c in cmds]
+
+    def job_args(self, job):
+        args = list(job.args)
+        if self.progress is not None and "-progress" not in args and len(args) >= 2:
+            args = args[:1] + ["-progress", "pipe:1", "-nostats"] + args[1:]
+        if job.copy or "-threads" in args or len(args) < 2:
+            return args
+
+        # -threads 是输出选项，split 多路输出时每一路前面都要加；任务的配额由各路平分，总数不超过一个 CPU 槽位
+        indices = core.output_indices(args)
+        budget = job.threads or max(1, self.threads // self.workers)
+        threads = str(max(1, budget // max(1, len(indices))))
+        for i in reversed(indices):
+            args[i:i] = ["-threads", threads]
+
+        return args
+
+    def _communicate(self, job, proc):
+        """读完 stderr 并用 wait4 回收进程，返回 (stderr, rusage)"""
+        if self.progress is None:
+            # stdout 已丢弃，只有 stderr 一个管道，直接读到 EOF 不会互锁
+            stderr = proc.stderr.read()
+            proc.stderr.close()
+            return stderr, metrics.wait_rusage(proc)
+
+        # stdout 是进度流，stderr 另起线程收集，避免管道写满互相阻塞
+        tail = deque(maxlen=50)
+        drain = threading.Thread(target=lambda: tail.extend(proc.stderr), daemon=True)
+        drain.start()
+        if job.total is None:
+            job.total = job.builder.progress_total() if job.builder is not None else None
+            if job.total is None and core.input_paths(job.args):
+                job.total = core.media_duration(core.input_paths(job.args)[0])
+        for snapshot in core.read_progress(proc.stdout, job.total):
+            job.progress = snapshot
+            self.progress(job, snapshot)
+        usage = metrics.wait_rusage(proc)
+        drain.join()
+
+        return "".join(tail), usage
+
+    def preflight(self):
+        """逐个任务预检，有问题的任务记下原因，执行时直接判失败而不启动进程"""
+        for job in self.jobs:
+            if job.error or not job.args or job.status != "pending":
+                continue
+            registry = caps.capabilities(job.args[0])
+            if registry is None:
+                continue
+            problems = registry.validate(job.args)
+            if problems:
+                job.error = "❌ " + "；".join(problems)
+
+    def run(self):
+        self._cancelled.clear()
+        if self.validate:
+            self.preflight()
+
+        threads = []
+        try:
+            with self._cond:
+                while True:
+                    job = self._admit()
+                    if job is not None:
+                        t = threading.Thread(target=self._run_job, args=(job,), daemon=True)
+                        t.start()
+                        threads.append(t)
+                        continue
+                    if not self._cpu_busy and not any(self._io_busy.values()):
+                        break
+                    self._cond.wait(0.2)
+            for t in threads:
+                while t.is_alive():
+                    t.join(0.2)
+        except KeyboardInterrupt:
+            self.cancel()
+            for t in threads:
+                t.join()
+            raise
+        finally:
+            self._summarize()
+
+        return self.jobs
+
+    def _io_free(self, devices):
+        return all(self._io_busy.get(d, 0) < self.io_limits.get(d, self.io_limit) for d in devices)
+
+    def _admit(self):
+        """
+        在锁内取出下一个资源允许的任务并占用资源：转码占 CPU 槽位，流复制占所涉每个设备的 I/O 槽位
+        多个任务都能启动时按提交顺序
+        """
+        candidates = [q for q in self._io_queues.values() if q and self._io_free(q[0][1].devices)]
+        if self._cpu_queue and self._cpu_busy < self.workers:
+            candidates.append(self._cpu_queue)
+        if not candidates:
+            return None
+
+        _, job = min(candidates, key=lambda q: q[0][0]).popleft()
+        if job.copy:
+            for d in job.devices:
+                self._io_busy[d] = self._io_busy.get(d, 0) + 1
+        else:
+            self._cpu_busy += 1
+
+        return job
+
+    def _run_job(self, job):
+        try:
+            if self._cancelled.is_set():
+                job.status = "cancelled"
+            else:
+                self._execute(job)
+        finally:
+            with self._cond:
+                if job.copy:
+                    for d in job.devices:
+                        self._io_busy[d] -= 1
+                else:
+                    self._cpu_busy -= 1
+                self._cond.notify_all()
+
+    def cancel(self):
+        self._cancelled.set()
+        with self._lock:
+            running = [j.proc for j in self.jobs if j.status == "running" and j.proc is not None]
+        for proc in running:
+            self._terminate(proc)
+
+    def _execute(self, job):
+        if job.error:
+            job.status = "failed"
+            return
+
+        if self.journal is not None and self.journal.up_to_date(job.args):
+            job.status = "skipped"
+            return
+
+        # 没有 -y 时不覆盖别人的文件，只覆盖日志里记录过、由本批次产出的旧输出；split 多路输出逐个判断
+        outputs = core.output_paths(job.args)
+        final = outputs[-1] if outputs else ""
+        writable = {o for o in outputs if journal_mod.is_file_output(o)
+                    and ("-y" in job.args or (self.journal is not None and self.journal.owns(o))
+                         or not os.path.exists(o))}
+
+        artifacts = self.artifacts or getattr(job.builder, "artifacts", None)
+        artifact_key = artifacts.key(job.args) if artifacts is not None and final in writable else None
+        if artifact_key is not None and artifacts.fetch(artifact_key, final):
+            job.status = "cached"
+            if self.journal is not None:
+                self.journal.record(job.args)
+            return
+
+        args = self.job_args(job)
+        retries = self.retries if job.retries is None else job.retries
+        start = time.monotonic()
+
+        # 每个输出都先写临时文件，成功后原子改名，中断时不会留下看似完整的输出
+        parts = {}
+        for i in core.output_indices(args):
+            if args[i] in writable:
+                parts[args[i]] = journal_mod.part_path(args[i])
+                args[i] = parts[args[i]]
+
+        for _ in range(1 + retries):
+            job.attempts += 1
+            # 每次尝试前清掉上一次失败留下的半成品，否则没有 -y 的命令会卡在覆盖确认上直接退出
+            for part in parts.values():
+                if os.path.exists(part):
+                    os.remove(part)
+            attempt_start = time.monotonic()
+            try:
+                stdout = subprocess.PIPE if self.progress is not None else subprocess.DEVNULL
+                proc = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=stdout,
+                                        stderr=subprocess.PIPE, text=True, errors="replace",
+                                        start_new_session=(os.name == "posix"))
+            except OSError as e:
+                job.error = str(e)
+                break
+
+            with self._lock:
+                job.proc = proc
+                job.status = "running"
+            if self._cancelled.is_set():
+                self._terminate(proc, wait=False)
+
+            stderr, usage = self._communicate(job, proc)
+            job.returncode = proc.returncode
+            job.proc = None
+            job.record = metrics.JobRecord(job.name, args, proc.returncode, time.monotonic() - attempt_start,
+                                           usage, inputs=journal_mod.expanded_inputs(args))
+            if proc.returncode == 0:
+                job.status = "done"
+                job.error = ""
+                break
+
+            job.error = "\n".join(stderr.strip().splitlines()[-5:])
+            if self._cancelled.is_set():
+                job.status = "cancelled"
+                break
+
+        if job.status not in ("done", "cancelled"):
+            job.status = "failed"
+        job.elapsed = time.monotonic() - start
+
+        for output, part in parts.items():
+            if job.status == "done":
+                os.replace(part, output)
+            elif os.path.exists(part):
+                os.remove(part)
+        if job.record is not None:
+            job.record.status = job.status
+            if job.status == "done":
+                self._finish_record(job, outputs)
+        if job.status == "done" and artifact_key is not None:
+            artifacts.store(artifact_key, final)
+        if job.status == "done" and self.journal is not None:
+            self.journal.record(job.args)
+
+    def _finish_record(self, job, outputs):
+        # 输出落盘后补上输出大小（多路输出合计）与媒体时长（优先取进度里的 out_time，免得再探测一次）
+        record = job.record
+        output = outputs[-1] if outputs else ""
+        sizes = [size for size in map(metrics._file_size, outputs) if size is not None]
+        record.output_bytes = sum(sizes) if sizes else None
+        if job.progress is not None and job.progress.get("out_time"):
+            record.duration = job.progress["out_time"]
+        elif journal_mod.is_file_output(output):
+            record.duration = core.media_duration(output)
+        if record.duration and record.wall > 0:
+            record.speed = record.duration / record.wall
+
+    @property
+    def records(self):
+        return [j.record for j in self.jobs if j.record is not None]
+
+    def export_metrics(self, jsonl=None, prometheus=None):
+        """
+        :param jsonl: 追加写入的 JSON Lines 路径
+        :param prometheus: Prometheus textfile 路径
+        """
+        if jsonl:
+            metrics.write_jsonl(self.records, jsonl)
+        if prometheus:
+            metrics.write_prometheus(self.records, prometheus)
+
+        return self.records
+
+    def _terminate(self, proc, wait=True):
+        # 杀掉整个进程组，避免 ffmpeg 子进程残留；进程由工作线程 wait4 回收，这里只观察退出码
+        try:
+            if os.name == "posix":
+                os.killpg(proc.pid, signal.SIGTERM)
+            else:
+                proc.terminate()
+            deadline = time.monotonic() + self.cancel_timeout
+            while wait and proc.returncode is None and time.monotonic() < deadline:
+                time.sleep(0.1)
+            if wait and proc.returncode is None:
+                if os.name == "posix":
+                    os.killpg(proc.pid, signal.SIGKILL)
+                else:
+                    proc.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def _summarize(self):
+        counts = {}
+        for job in self.jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+            if job.status == "failed":
+                self.log_error += f"❌ 执行失败: {job.name} (退出码 {job.returncode})\n{job.error}\n"
+        self.log_correct += f"✅ {counts.get('done', 0)}/{len(self.jobs)} 个任务完成。\n"
+        if counts.get("skipped"):
+            self.log_correct += f"✅ {counts['skipped']} 个任务输出已是最新，已跳过。\n"
+        if counts.get("cached"):
+            self.log_correct += f"♻️ {counts['cached']} 个任务命中产物缓存。\n"
+        if counts.get("cancelled"):
+            self.log_warning += f"⚠️ {counts['cancelled']} 个任务已取消。\n"
+
+    def print_log(self):
+        run_log = "LOG\n"
+        run_log += self.log_correct
+        run_log += self.log_warning
+        run_log += self.log_error
+        print(run_log)
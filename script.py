@@ -1,21 +1,75 @@
 import os
+import caps
 import core
+import loudness as loudness_mod
+import scan
+import scheduler
 
 
 class Script:
-    def __init__(self, input_path):
+    def __init__(self, input_path, cache=True, recursive=False, pattern=None):
+        """
+        :param input_path: 视频列表或目录；目录源不在此处扫描，留到首次探测时边扫描边探测
+        :param recursive: 目录源是否递归子目录
+        :param pattern: 目录源的文件名 glob 过滤
+        """
+        self.input_videos = []
+        self._pending = None
         if isinstance(input_path, str):
-            ex = (".mp4", ".mov", ".mkv", ".avi", ".flv")
-            self.input_videos = [os.path.join(input_path, f) for f in os.listdir(input_path) if f.lower().endswith(ex)]
-            self.input_videos.sort()
+            self._pending = scan.scan(input_path, recursive=recursive, pattern=pattern)
         elif isinstance(input_path, (list, tuple)):
             self.input_videos = list(input_path)
+        self.cache = cache
         self.log_correct = ""
         self.log_warning = ""
         self.log_error = ""
         self.cmd_stack = []
+        self.output_dir = None
+
+    def videos(self):
+        """输入视频的迭代器：目录源首次迭代时流式扫描并记入 input_videos，之后直接复用"""
+        if self._pending is None:
+            return iter(self.input_videos)
+        pending, self._pending = self._pending, None
+
+        def _drain():
+            # 扫描按文件系统顺序边读边产出，读完后按文件名排好，之后的步骤顺序稳定
+            yield from scan.collect(pending, self.input_videos)
+            self.input_videos.sort()
 
-    v_params = "codec_name,pix_fmt,width,height,r_frame_rate",
+        return _drain()
+
+    def _resolve_encoder(self, registry, kind, codec):
+        if codec is None or registry.encoder_usable(codec) or registry.is_family(codec):
+            return codec
+        fallback = registry.best_encoder(codec)
+        if fallback is None:
+            self.log_error += f"❌ {kind}编码器不可用: {codec}\n"
+        else:
+            self.log_warning += f"⚠️ {kind}编码器 {codec} 不可用，改用 {fallback}。\n"
+
+        return fallback
+
+    def dedup(self, drop=True, threshold=8, frames=5, workers=None):
+        """
+        近重复检测，在 VideoAlign 之前调用，重复的素材不再转码
+        :param drop: True 时从输入中剔除重复项（每组保留最先出现的一个），False 只报告
+        :param threshold: 对齐关键帧的平均汉明距离上限（0~64），不超过的一定会被找到（见 dedup.DuplicateIndex）
+        :return: 重复组 [[保留的路径, 重复路径, ...], ...]
+        """
+        videos = list(self.videos())
+        fpu = core.FPU(cache=self.cache, workers=workers)
+        groups = fpu.videos_duplicate_detect(videos, threshold, frames)
+        self.log_warning += fpu.log_warning
+
+        dropped = {f for g in groups for f in g[1:]}
+        if drop and dropped:
+            self.input_videos = [f for f in videos if f not in dropped]
+            self.log_correct += f"✅ 已剔除 {len(dropped)} 个重复素材。\n"
+
+        return groups
+
+    v_params = "codec_name,pix_fmt,width,height,r_frame_rate"
     a_params = "codec_name,sample_rate,channels,channel_layout,sample_fmt"
 
     def VideoAlign(self,
@@ -29,12 +83,29 @@ class Script:
                    sample_rate=None,
                    channels=None,
                    channel_layout=None,
-                   sample_fmt=None):
+                   sample_fmt=None,
+                   loudness=None,
+                   workers=None):
+        """
+        :param loudness: 目标节目响度（LUFS，如 -23）；设置后先并行测量各文件响度（按文件指纹缓存），
+                         对齐时所有音轨一遍完成归一化
+        """
         os.makedirs(output_dir, exist_ok=True)
-
-        # 1. 检测信息
-        report = core.FPU().videos_consistency_detect(self.input_videos)
-        info_dict = core.FPU().videos_core_info_detect(self.input_videos)
+        self.output_dir = output_dir
+
+        # 0. 指定的编码器本机不可用时（如没有 N 卡却指定 h264_nvenc），回退到同格式最快的可用编码器
+        registry = caps.capabilities()
+        if registry is not None:
+            video_codec = self._resolve_encoder(registry, "视频", video_codec)
+            audio_codec = self._resolve_encoder(registry, "音频", audio_codec)
+            if self.log_error:
+                return self
+
+        # 1. 检测信息（并发探测一次，一致性检测复用结果）
+        fpu = core.FPU(cache=self.cache, workers=workers)
+        info_dict = fpu.videos_core_info_detect(self.videos(), self.v_params, self.a_params)
+        report = fpu.videos_consistency_detect(self.input_videos, self.v_params, self.a_params, info_dict=info_dict)
+        self.log_error += fpu.log_error
         print(report)
 
         # 2. 确定目标参数（指定 > 大部队 > None）
@@ -60,18 +131,28 @@ class Script:
             }
         }
 
+        # 响度测量只解码音频，结果缓存，重跑时不再测量
+        measured = {}
+        if loudness is not None:
+            measured = fpu.loudness_detect(list(info_dict), target=loudness, workers=workers)
+            self.log_warning += fpu.log_warning
+
         # 3. 遍历所有视频
         for f, data in info_dict.items():
             output_file = os.path.join(output_dir, os.path.basename(f))
+            loudnorm = None
+            if f in measured:
+                loudnorm = loudness_mod.loudnorm_filter(measured[f], target=loudness)
 
-            v_needs_reencode = any(
+            # 文件里没有的流不需要对齐（如无音轨的素材）
+            v_needs_reencode = data.has("video") and any(
                 data["video"][k] != target_specs["video"][k]
                 for k in ["codec_name", "pix_fmt", "width", "height", "r_frame_rate"]
             )
-            a_needs_reencode = any(
+            a_needs_reencode = data.has("audio") and (loudnorm is not None or any(
                 data["audio"][k] != target_specs["audio"][k]
                 for k in ["codec_name", "sample_rate", "channels", "channel_layout", "sample_fmt"]
-            )
+            ))
 
             if not v_needs_reencode and not a_needs_reencode:
                 # ✅ 参数一致 → 直接复制
@@ -93,7 +174,12 @@ class Script:
 
                 if size:
                     # 尺寸特殊处理，调用 video_margin_fill
-                    core.FPU().video_margin_fill(f, output_file, size, target_specs["video"]["codec_name"])
+                    exe = core.FPU(cache=self.cache).video_margin_fill(
+                        f, output_file, size, target_specs["video"]["codec_name"])
+                    if loudnorm is not None:
+                        exe.audio_codec(target_specs["audio"]["codec_name"]).add_args(["-af", loudnorm])
+                        exe.audio_sample_rate(target_specs["audio"]["sample_rate"] or 48000)
+                    self.cmd_stack.append(exe)
                     continue
                 cmd += f" -c:v {target_specs['video']['codec_name']}"
                 if pix_fmt:
@@ -106,7 +192,10 @@ class Script:
             # 音频部分
             if a_needs_reencode:
                 cmd += f" -c:a {target_specs['audio']['codec_name']}"
-                if sample_rate:
+                if loudnorm is not None:
+                    # loudnorm 输出 192kHz，必须指定输出采样率
+                    cmd += f" -af \"{loudnorm}\" -ar {sample_rate or target_specs['audio']['sample_rate'] or 48000}"
+                elif sample_rate:
                     cmd += f" -ar {sample_rate}"
                 if channels:
                     cmd += f" -ac {channels}"
@@ -121,3 +210,25 @@ class Script:
         self.log_correct += f"✅ 已生成 {len(self.cmd_stack)} 条对齐命令。\n"
 
         return self
+
+    journal_name = ".clipforge_journal.jsonl"
+
+    def run(self, workers=None, threads=None, retries=0, journal=True, io_limits=None, io_limit=4):
+        """
+        并发执行 cmd_stack 中的命令串与 ffmpeg 构造器，返回每个任务的 Job 记录
+        :param journal: True 时在输出目录记录任务日志，重跑时跳过已完成且未变化的任务；
+                        也可传日志文件路径，False 关闭
+        :param io_limits: 按挂载点限制流复制任务并发（见 scheduler.Scheduler），如 {"/mnt/nas": 2}
+        """
+        if journal is True:
+            journal = os.path.join(self.output_dir, self.journal_name) if self.output_dir else None
+        sched = scheduler.Scheduler(workers=workers, threads=threads, retries=retries, journal=journal or None,
+                                    io_limits=io_limits, io_limit=io_limit)
+        sched.extend(self.cmd_stack)
+        jobs = sched.run()
+
+        self.log_correct += sched.log_correct
+        self.log_warning += sched.log_warning
+        self.log_error += sched.log_error
+
+        return jobs
@@ -0,0 +1,26 @@
+import caps
+
+
+def _caps():
+    # 不调用 ffmpeg，直接给一份最小的能力清单
+    c = caps.Capabilities.__new__(caps.Capabilities)
+    c.encoders = {"libx264": {"type": "V", "codec": "h264"}, "aac": {"type": "A", "codec": "aac"}}
+    c.decoders = {"h264": {"type": "V", "codec": "h264"}, "aac": {"type": "A", "codec": "aac"}}
+    c.pix_fmts = {"yuv420p"}
+    c.filters = {"scale"}
+    c.usable = {}
+    return c
+
+
+def test_input_codec_is_checked_against_decoders():
+    c = _caps()
+    assert c.validate(["ffmpeg", "-c:v", "h264", "-i", "a.mp4", "-c:v", "libx264", "o.mp4"]) == []
+    assert c.validate(["ffmpeg", "-c:v", "libx264", "-i", "a.mp4", "-c", "copy", "o.mp4"]) == [
+        "解码器不可用: libx264"]
+
+
+def test_output_codecs_of_every_output_are_checked():
+    c = _caps()
+    args = ["ffmpeg", "-i", "a.mp4", "-c:v", "h264", "-i", "b.mp4", "-c:v", "libx264", "o1.mp4",
+            "-c:a", "nosuch", "o2.mp4"]
+    assert c.validate(args) == ["编码器不可用: nosuch"]
@@ -0,0 +1,66 @@
+import random
+
+import pytest
+
+import dedup
+
+
+def _flip(h, count, rng, positions=None):
+    # 在 positions（默认全部 64 位）里随机翻转 count 位
+    for bit in rng.sample(positions or range(64), count):
+        h ^= 1 << bit
+    return h
+
+
+def _sig(hashes, duration=10.0):
+    return {"duration": duration, "hashes": hashes}
+
+
+@pytest.mark.parametrize("threshold", [0, 1, 4, 8, 12])
+def test_pairs_at_threshold_are_always_found(threshold):
+    rng = random.Random(threshold)
+    index = dedup.DuplicateIndex(threshold)
+    for n in range(200):
+        base = [rng.getrandbits(64) for _ in range(5)]
+        # 每帧恰好差 threshold 位，差异集中在同一段里是抽屉原理的最坏情况
+        positions = list(range(64)) if n % 2 else list(range(21))
+        twin = [_flip(h, threshold, rng, positions) for h in base]
+        index.add(f"{n}a", _sig(base)).add(f"{n}b", _sig(twin))
+
+    groups = index.groups()
+    assert all([f"{n}a", f"{n}b"] in groups for n in range(200))
+
+
+def test_uneven_frames_with_mean_at_threshold_are_found():
+    rng = random.Random(1)
+    index = dedup.DuplicateIndex(8)
+    base = [rng.getrandbits(64) for _ in range(4)]
+    # 平均 8 位：只有一帧在阈值以内
+    twin = [_flip(h, d, rng) for h, d in zip(base, [2, 10, 10, 10])]
+    index.add("a", _sig(base)).add("b", _sig(twin))
+
+    assert index.groups() == [["a", "b"]]
+
+
+@pytest.mark.parametrize("order", [("black", "dim"), ("dim", "black")])
+def test_zero_hashes_are_recalled(order):
+    rng = random.Random(2)
+    sigs = {"black": _sig([0, 0, 0]), "dim": _sig([_flip(0, 8, rng) for _ in range(3)])}
+    index = dedup.DuplicateIndex(8)
+    for name in order:
+        index.add(name, sigs[name])
+    index.add("black2", _sig([0, 0, 0]))
+
+    assert index.groups() == [[order[0], order[1], "black2"]]
+
+
+def test_far_or_mismatched_clips_are_not_grouped():
+    rng = random.Random(3)
+    index = dedup.DuplicateIndex(8)
+    base = [rng.getrandbits(64) for _ in range(5)]
+    index.add("a", _sig(base))
+    index.add("far", _sig([_flip(h, 9, rng) for h in base]))
+    index.add("long", _sig(base, duration=20.0))
+    index.add("black", _sig([0] * 5))
+
+    assert index.groups() == []
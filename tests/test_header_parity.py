@@ -0,0 +1,115 @@
+import json
+import shutil
+import subprocess
+
+import pytest
+
+import header
+
+
+pytestmark = pytest.mark.skipif(not (shutil.which("ffmpeg") and shutil.which("ffprobe")),
+                                reason="需要 ffmpeg/ffprobe")
+
+FIELDS = ["codec_name", "codec_type", "width", "height", "pix_fmt", "r_frame_rate", "avg_frame_rate",
+          "time_base", "duration", "duration_ts", "nb_frames", "sample_rate", "channels",
+          "channel_layout", "sample_fmt"]
+
+# 快速路径只在没有编辑列表偏移时给出时长与帧数（B 帧延迟、AAC 预滚、分片 MP4、MKV 都不给），
+# 请求这些字段时整体回退 ffprobe；其余字段每个样本都必须全部解出
+TIMING = {"duration", "duration_ts", "nb_frames"}
+CORE = [k for k in FIELDS if k not in TIMING]
+WITH_TIMING = {"h264_intra.mp4"}
+# 分片 MP4 的帧率与时长都在 moof 里，整体交给 ffprobe（见下方单独的用例）
+FRAGMENTED = {"h264_fragmented.mp4"}
+
+SAMPLES = {
+    "h264_aac.mp4": ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-c:a", "aac"],
+    "h264_10bit_422.mov": ["-c:v", "libx264", "-pix_fmt", "yuv422p10le", "-c:a", "aac", "-ac", "1"],
+    "h264_fullrange.mp4": ["-c:v", "libx264", "-pix_fmt", "yuvj420p", "-an"],
+    "h264_intra.mp4": ["-c:v", "libx264", "-bf", "0", "-an"],
+    "h264_fragmented.mp4": ["-c:v", "libx264", "-c:a", "aac", "-movflags", "+frag_keyframe+empty_moov"],
+    "hevc_aac.mp4": ["-c:v", "libx265", "-x265-params", "log-level=error", "-tag:v", "hvc1",
+                     "-c:a", "aac", "-ar", "44100"],
+    "h264_opus.mkv": ["-c:v", "libx264", "-c:a", "libopus"],
+    "hevc_10bit.mkv": ["-c:v", "libx265", "-x265-params", "log-level=error", "-pix_fmt", "yuv420p10le",
+                       "-c:a", "aac"],
+    "ntsc.mkv": ["-r", "30000/1001", "-c:v", "libx264", "-c:a", "aac"],
+}
+
+
+@pytest.fixture(scope="module")
+def samples(tmp_path_factory):
+    root = tmp_path_factory.mktemp("parity")
+    paths = {}
+    for name, args in SAMPLES.items():
+        path = str(root / name)
+        result = subprocess.run(["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", "testsrc2=s=320x240:r=25:d=2",
+                                 "-f", "lavfi", "-i", "sine=f=440:r=48000:d=2", "-shortest"] + args + [path])
+        # 本机 ffmpeg 没编进对应编码器时只跳过这一个样本
+        paths[name] = path if result.returncode == 0 else None
+
+    return paths
+
+
+def _ffprobe(path):
+    result = subprocess.run(["ffprobe", "-v", "error", "-show_entries", "stream=index," + ",".join(FIELDS),
+                             "-of", "json", path], stdout=subprocess.PIPE, text=True, check=True)
+
+    return json.loads(result.stdout)["streams"]
+
+
+def _requested(stream, fields):
+    # 快速路径要给出的键：请求的字段去掉另一种流类型独有的字段，再加上 index
+    wanted = set(fields) | {"index"}
+    if stream["codec_type"] == "video":
+        return wanted - header.AUDIO_ONLY
+    return wanted - header.VIDEO_ONLY
+
+
+def _sample(samples, name):
+    path = samples[name]
+    if path is None:
+        pytest.skip(f"本机 ffmpeg 无法生成 {name}")
+    return path
+
+
+@pytest.mark.parametrize("name", [n for n in SAMPLES if n not in FRAGMENTED])
+def test_core_fields_match_ffprobe(samples, name):
+    path = _sample(samples, name)
+
+    # 请求字段缺任何一个 probe 都会返回 None，这里要求全部由快速路径解出，键集合与请求一致
+    parsed = header.probe(path, CORE)
+    expected = _ffprobe(path)
+    assert parsed is not None, "快速路径缺字段"
+    assert len(parsed["streams"]) == len(expected)
+    for got, want in zip(parsed["streams"], expected):
+        assert set(got) == _requested(want, CORE), f"{want['index']}"
+        for k in sorted(_requested(want, CORE)):
+            assert got[k] == want.get(k), f"{want['index']}:{k}"
+
+
+@pytest.mark.parametrize("name", [n for n in SAMPLES if n not in FRAGMENTED])
+def test_timing_fields_all_or_nothing(samples, name):
+    path = _sample(samples, name)
+
+    parsed = header.probe(path, FIELDS)
+    if name not in WITH_TIMING:
+        assert parsed is None
+        assert all(not TIMING & set(st) for st in header.read_streams(path))
+        return
+
+    expected = _ffprobe(path)
+    assert parsed is not None, "快速路径缺字段"
+    for got, want in zip(parsed["streams"], expected):
+        assert set(got) == _requested(want, FIELDS), f"{want['index']}"
+        for k in sorted(TIMING):
+            assert got[k] == want.get(k), f"{want['index']}:{k}"
+
+
+def test_fragmented_mp4_leaves_timing_to_ffprobe(samples):
+    path = _sample(samples, "h264_fragmented.mp4")
+
+    for stream in header.read_streams(path):
+        assert "duration" not in stream
+        assert "nb_frames" not in stream
+    assert header.probe(path, ["duration", "nb_frames"]) is None
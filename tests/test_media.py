@@ -0,0 +1,45 @@
+from fractions import Fraction
+
+import core
+from media import MediaInfo
+
+
+# ffprobe -of json 的原始输出：数值字段都是字符串
+RAW = {
+    "a.mp4": [
+        {"codec_type": "video", "codec_name": "h264", "width": "1920", "height": "1080", "pix_fmt": "yuv420p",
+         "r_frame_rate": "30000/1001"},
+        {"codec_type": "audio", "codec_name": "aac", "sample_rate": "48000", "channels": "2",
+         "channel_layout": "stereo", "sample_fmt": "fltp"},
+    ],
+    "b.mp4": [
+        {"codec_type": "video", "codec_name": "h264", "width": "1920", "height": "1080", "pix_fmt": "yuv420p",
+         "r_frame_rate": "30000/1001"},
+        {"codec_type": "audio", "codec_name": "aac", "sample_rate": "48000", "channels": "2",
+         "channel_layout": "stereo", "sample_fmt": "fltp"},
+    ],
+    "c.mp4": [
+        {"codec_type": "video", "codec_name": "h264", "width": "1280", "height": "720", "pix_fmt": "yuv420p",
+         "r_frame_rate": "25/1"},
+    ],
+}
+
+
+def _fake_probe(path, entries, cache):
+    return RAW[path]
+
+
+def test_clusters_match_between_probe_and_info_dict(monkeypatch):
+    monkeypatch.setattr(core, "_probe_streams", _fake_probe)
+    fpu = core.FPU(cache=False, workers=2)
+
+    probed = fpu.compatibility_clusters(list(RAW))
+    info_dict = {p: MediaInfo.from_streams(p, streams) for p, streams in RAW.items()}
+    given = fpu.compatibility_clusters(list(RAW), info_dict=info_dict)
+
+    assert probed == given
+    assert [c["members"] for c in probed] == [["a.mp4", "b.mp4"], ["c.mp4"]]
+    key = probed[0]["key"]
+    assert key["video.width"] == 1920
+    assert key["video.r_frame_rate"] == Fraction(30000, 1001)
+    assert key["audio.sample_rate"] == 48000
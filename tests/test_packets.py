@@ -0,0 +1,48 @@
+from fractions import Fraction
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import packets
+
+
+NTSC = float(Fraction(30000, 1001))
+
+
+def _table(fps, frames, timebase=None):
+    # mp4 的时间戳是精确的；mkv 按毫秒取整（timebase=0.001）
+    table = packets.PacketTable(frames)
+    for i in range(frames):
+        pts = i / fps
+        if timebase is not None:
+            pts = round(pts / timebase) * timebase
+        table.append(pts, pts, None, 1000, i % 30 == 0)
+
+    return table.trim()
+
+
+@pytest.mark.parametrize("fps", [30.0, NTSC])
+def test_mkv_and_mp4_measure_the_same_rate(fps):
+    mp4 = _table(fps, 120).frame_rate(nominal=[fps])
+    mkv = _table(fps, 120, timebase=0.001).frame_rate(nominal=[fps])
+
+    assert not mp4["vfr"] and not mkv["vfr"]
+    assert mp4["measured"] == pytest.approx(fps)
+    assert mkv["measured"] == pytest.approx(fps)
+    # 中位间隔被毫秒取整整体带偏，不能用来比较
+    assert mkv["fps"] == pytest.approx(1 / 0.033)
+
+
+def test_mkv_30_and_ntsc_are_distinguished():
+    a = _table(30.0, 120, timebase=0.001).frame_rate(nominal=[30.0])
+    b = _table(NTSC, 120, timebase=0.001).frame_rate(nominal=[NTSC])
+
+    assert round(a["measured"], 3) != round(b["measured"], 3)
+
+
+def test_nominal_rate_outside_rounding_error_is_not_adopted():
+    # 头部写着 30，实际是 29.97：片子够长时取整误差远小于两者之差
+    rate = _table(NTSC, 1800, timebase=0.001).frame_rate(nominal=[30.0])
+
+    assert rate["measured"] == pytest.approx(NTSC, rel=1e-4)
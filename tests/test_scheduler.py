@@ -0,0 +1,43 @@
+import scheduler
+
+
+def _threads(args):
+    return [args[i + 1] for i, a in enumerate(args) if a == "-threads"]
+
+
+def test_job_args_single_output_gets_whole_budget():
+    sched = scheduler.Scheduler(workers=2, threads=8, validate=False)
+    job = sched.add(["ffmpeg", "-i", "in.mp4", "-c:v", "libx264", "out.mp4"])
+
+    args = sched.job_args(job)
+    assert args[-3:] == ["-threads", "4", "out.mp4"]
+
+
+def test_job_args_split_outputs_share_budget():
+    sched = scheduler.Scheduler(workers=2, threads=8, validate=False)
+    job = sched.add(["ffmpeg", "-i", "in.mp4", "-filter_complex", "[0:v]split=3[a][b][c]",
+                     "-map", "[a]", "-c:v", "libx264", "a.mp4",
+                     "-map", "[b]", "-c:v", "libx264", "b.mp4",
+                     "-map", "[c]", "-an", "-c:v", "libx264", "c.mp4"])
+
+    args = sched.job_args(job)
+    assert _threads(args) == ["1", "1", "1"]
+    for out in ("a.mp4", "b.mp4", "c.mp4"):
+        assert args[args.index(out) - 2:args.index(out)] == ["-threads", "1"]
+
+
+def test_job_args_budget_never_below_one_thread():
+    sched = scheduler.Scheduler(workers=1, threads=2, validate=False)
+    job = sched.add(["ffmpeg", "-i", "in.mp4", "-map", "0:v", "-c:v", "libx264", "a.mp4",
+                     "-map", "0:v", "-c:v", "libx264", "b.mp4", "-map", "0:v", "-c:v", "libx264", "c.mp4"])
+
+    assert _threads(sched.job_args(job)) == ["1", "1", "1"]
+
+
+def test_job_args_keeps_explicit_threads_and_copy_jobs():
+    sched = scheduler.Scheduler(workers=2, threads=8, validate=False)
+    explicit = sched.add(["ffmpeg", "-i", "in.mp4", "-c:v", "libx264", "-threads", "3", "out.mp4"])
+    copy = sched.add(["ffmpeg", "-i", "in.mp4", "-c", "copy", "out.mkv"])
+
+    assert _threads(sched.job_args(explicit)) == ["3"]
+    assert _threads(sched.job_args(copy)) == []
@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+
+import pytest
+
+import core
+import journal
+import scheduler
+
+
+# 假 ffmpeg：记录每次调用的参数，把调用序号写进所有输出；前 STUB_FAIL 次写完后以退出码 1 失败；
+# 输出已存在且没有 -y 时像 ffmpeg 一样拒绝覆盖
+STUB = """#!{python}
+import os, sys, json
+args = sys.argv[1:]
+state = os.environ["STUB_STATE"]
+calls = []
+if os.path.exists(state):
+    with open(state) as f:
+        calls = [json.loads(line) for line in f]
+with open(state, "a") as f:
+    f.write(json.dumps(args) + "\\n")
+outputs = [a for i, a in enumerate(args) if i and not a.startswith("-") and not args[i - 1].startswith("-")]
+for out in outputs:
+    if os.path.exists(out) and "-y" not in args:
+        sys.stderr.write(f"File '{{out}}' already exists. Exiting.\\n")
+        sys.exit(1)
+for out in outputs:
+    with open(out, "w") as f:
+        f.write(f"run {{len(calls) + 1}}")
+sys.exit(1 if len(calls) < int(os.environ.get("STUB_FAIL", "0")) else 0)
+"""
+
+
+@pytest.fixture
+def stub(tmp_path, monkeypatch):
+    path = tmp_path / "ffmpeg"
+    path.write_text(STUB.format(python=sys.executable))
+    path.chmod(0o755)
+    state = tmp_path / "calls.jsonl"
+    monkeypatch.setenv("STUB_STATE", str(state))
+    # 输出是假的，不去探测时长
+    monkeypatch.setattr(core, "media_duration", lambda *a, **k: None)
+    (tmp_path / "in.mp4").write_text("input")
+
+    def calls():
+        if not state.exists():
+            return []
+        return [json.loads(line) for line in state.read_text().splitlines()]
+
+    return str(path), calls
+
+
+def _run(args, **kwargs):
+    sched = scheduler.Scheduler(workers=1, threads=1, validate=False, **kwargs)
+    job = sched.add(args)
+    sched.run()
+    return job
+
+
+def test_retry_clears_partial_output(stub, tmp_path, monkeypatch):
+    ffmpeg, calls = stub
+    monkeypatch.setenv("STUB_FAIL", "1")
+    out = str(tmp_path / "out.mp4")
+
+    job = _run([ffmpeg, "-i", str(tmp_path / "in.mp4"), "-c:v", "libx264", out], retries=1)
+
+    assert job.status == "done" and job.attempts == 2
+    # 第一次失败留下的半成品被清掉，第二次没有 -y 也能写
+    assert open(out).read() == "run 2"
+    assert not os.path.exists(journal.part_path(out))
+
+
+def test_failed_job_leaves_no_output(stub, tmp_path, monkeypatch):
+    ffmpeg, calls = stub
+    monkeypatch.setenv("STUB_FAIL", "5")
+    out = str(tmp_path / "out.mp4")
+
+    job = _run([ffmpeg, "-i", str(tmp_path / "in.mp4"), "-c:v", "libx264", out], retries=1)
+
+    assert job.status == "failed" and job.attempts == 2
+    assert not os.path.exists(out)
+    assert not os.path.exists(journal.part_path(out))
+
+
+def test_outputs_are_written_to_part_then_renamed(stub, tmp_path):
+    ffmpeg, calls = stub
+    a, b = str(tmp_path / "a.mp4"), str(tmp_path / "b.mkv")
+
+    job = _run([ffmpeg, "-i", str(tmp_path / "in.mp4"), "-map", "0:v", "-c:v", "libx264", a,
+                "-map", "0:v", "-c:v", "libx264", b])
+
+    assert job.status == "done"
+    args = calls()[0]
+    assert journal.part_path(a) in args and journal.part_path(b) in args
+    assert journal.part_path(b).endswith(".b.part.mkv")
+    assert open(a).read() == open(b).read() == "run 1"
+    assert not os.path.exists(journal.part_path(a)) and not os.path.exists(journal.part_path(b))
+
+
+def test_existing_output_without_y_is_not_overwritten(stub, tmp_path):
+    ffmpeg, calls = stub
+    out = tmp_path / "out.mp4"
+    out.write_text("mine")
+
+    job = _run([ffmpeg, "-i", str(tmp_path / "in.mp4"), "-c:v", "libx264", str(out)])
+
+    assert job.status == "failed"
+    assert out.read_text() == "mine"
+
+
+def test_journal_skips_up_to_date_jobs(stub, tmp_path):
+    ffmpeg, calls = stub
+    log = str(tmp_path / "journal.jsonl")
+    out = str(tmp_path / "out.mp4")
+    args = [ffmpeg, "-i", str(tmp_path / "in.mp4"), "-c:v", "libx264", out]
+
+    assert _run(args, journal=log).status == "done"
+    assert _run(args, journal=log).status == "skipped"
+    assert len(calls()) == 1
+
+    # 输入变了要重跑；旧输出是日志记录过的，没有 -y 也可以覆盖
+    os.utime(tmp_path / "in.mp4", ns=(0, 0))
+    assert _run(args, journal=log).status == "done"
+    assert len(calls()) == 2
+    assert open(out).read() == "run 2"
+
+    # 输出被改过也要重跑
+    with open(out, "a") as f:
+        f.write("!")
+    assert _run(args, journal=log).status == "done"
+    assert len(calls()) == 3
@@ -0,0 +1,184 @@
+import os
+import re
+import shutil
+import tempfile
+import subprocess
+
+import core
+import scheduler
+from cache import resolve_cache
+
+
+DEFAULT_PRESETS = ("veryfast", "faster", "fast", "medium", "slow")
+DEFAULT_CRFS = (20, 23, 26)
+
+
+class EncoderTuner:
+    """
+    编码参数自动调优
+    从片源均匀截取几段样本，按 preset × crf 网格并行试编码，测实时倍速与码率（可选 PSNR/SSIM），
+    返回满足目标倍速里码率最低的一组；结果按片源规格（编码、分辨率、帧率、像素格式）缓存。
+    """
+
+    def __init__(self, codec="libx264", presets=DEFAULT_PRESETS, crfs=DEFAULT_CRFS, samples=2, sample_seconds=4.0,
+                 workers=None, cache=True):
+        """
+        :param samples: 样本段数
+        :param sample_seconds: 每段样本时长（秒）
+        :param workers: 并行试编码数；测得的倍速是该并发下单任务的倍速，应与线上单节点并发一致
+        """
+        self.codec = codec
+        self.presets = list(presets)
+        self.crfs = list(crfs)
+        self.samples = samples
+        self.sample_seconds = sample_seconds
+        self.workers = workers
+        self.cache = cache
+        self.log_correct = ""
+        self.log_warning = ""
+        self.log_error = ""
+
+    def profile(self, video_path):
+        """片源规格，同规格的片源共用调参结果"""
+        try:
+            info = core.ffprobe(cache=self.cache).input(video_path, ("v", 0)) \
+                .show_entries("codec_name,width,height,r_frame_rate,pix_fmt").export(core=True)
+        except (RuntimeError, FileNotFoundError, ValueError):
+            return None
+        if not info:
+            return None
+        v = info[0]
+
+        return f"{v.get('codec_name')} {v.get('width')}x{v.get('height')} {v.get('r_frame_rate')} {v.get('pix_fmt')}"
+
+    def cache_key(self, profile, target_speed, quality, min_ssim):
+        grid = ",".join(self.presets) + "|" + ",".join(str(c) for c in self.crfs)
+        return (f"tune {self.codec} {profile} x{target_speed} {grid} {self.samples}x{self.sample_seconds} "
+                f"q={quality} ssim>={min_ssim}")
+
+    def tune(self, video_path, target_speed=1.0, quality=False, min_ssim=None, refresh=False):
+        """
+        :param target_speed: 目标实时倍速（媒体时长 / 墙钟时间）
+        :param quality: 是否用 ffmpeg 的 ssim/psnr 滤镜测画质
+        :param min_ssim: 画质下限，设置后隐含 quality=True
+        :param refresh: 忽略缓存重新调优
+        :return: {"preset", "crf", "speed", "bitrate", "ssim", "psnr", "met", "profile", "trials"}，失败时 None
+        """
+        quality = quality or min_ssim is not None
+        profile = self.profile(video_path)
+        duration = core.media_duration(video_path, self.cache)
+        if profile is None or not duration:
+            self.log_error += f"❌ 无法获取片源规格或时长: {video_path}\n"
+            return None
+
+        probe_cache = resolve_cache(self.cache)
+        key = self.cache_key(profile, target_speed, quality, min_ssim)
+        if probe_cache is not None and not refresh:
+            cached = probe_cache.get_value(key)
+            if cached is not None:
+                self.log_correct += f"✅ 命中调参缓存: {profile} -> {cached['preset']} crf {cached['crf']}\n"
+                return cached
+
+        # 样本均匀分布在片中，片源太短时整段作为一个样本
+        length = min(self.sample_seconds, duration)
+        count = max(1, min(self.samples, int(duration // length)))
+        starts = [max(0.0, duration * (i + 1) / (count + 1) - length / 2) for i in range(count)]
+
+        work_dir = tempfile.mkdtemp(prefix="clipforge_tune_")
+        try:
+            trials = self._run_grid(video_path, starts, length, work_dir, quality)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        if not trials:
+            return None
+
+        result = self._choose(trials, target_speed, min_ssim)
+        if result is None:
+            return None
+        result.update({"profile": profile, "target_speed": target_speed, "min_ssim": min_ssim, "trials": trials})
+        if probe_cache is not None:
+            probe_cache.put_value(key, result)
+
+        return result
+
+    def _run_grid(self, video_path, starts, length, work_dir, quality):
+        sched = scheduler.Scheduler(workers=self.workers)
+        grid = {}
+        for preset in self.presets:
+            for crf in self.crfs:
+                for n, ss in enumerate(starts):
+                    out = os.path.join(work_dir, f"{preset}_{crf}_{n}.mkv")
+                    exe = core.ffmpeg(hide_banner=True, overwrite=True).input(video_path, ss=ss, to=ss + length)
+                    exe.map("0:v:0").add_args(["-an"])
+                    exe.video_codec(self.codec).preset(preset).video_quality(crf)
+                    job = sched.add(exe.output(out))
+                    grid.setdefault((preset, crf), []).append((job, ss))
+
+        sched.run()
+        if not all(j.ok for j in sched.jobs):
+            self.log_error += sched.log_error
+            return []
+
+        trials = []
+        for (preset, crf), jobs in grid.items():
+            records = [job.record for job, _ in jobs]
+            media = sum(r.duration or length for r in records)
+            wall = sum(r.wall for r in records)
+            size = sum(r.output_bytes or 0 for r in records)
+            trial = {"preset": preset, "crf": crf, "speed": media / wall if wall else None,
+                     "bitrate": size * 8 / media if media else None,
+                     "cpu": sum(r.cpu or 0 for r in records), "ssim": None, "psnr": None}
+            if quality:
+                scores = [self._quality(job.args[-1], video_path, ss, length) for job, ss in jobs]
+                ssim = [s for s, _ in scores if s is not None]
+                psnr = [p for _, p in scores if p is not None]
+                trial["ssim"] = sum(ssim) / len(ssim) if ssim else None
+                trial["psnr"] = sum(psnr) / len(psnr) if psnr else None
+            trials.append(trial)
+
+        self.log_correct += f"✅ 已试编码 {len(trials)} 组参数（每组 {len(grid and next(iter(grid.values())))} 段样本）。\n"
+
+        return trials
+
+    @staticmethod
+    def _quality(encoded, source, ss, length):
+        # 编码结果与原片同一区间逐帧对比；mkv 时间戳取整到毫秒，按帧序号重排时间戳才能逐帧对齐
+        graph = ("[0:v]setpts=N/TB,split[a0][a1];[1:v]setpts=N/TB,split[b0][b1];"
+                 "[a0][b0]ssim;[a1][b1]psnr")
+        command = ["ffmpeg", "-hide_banner", "-nostdin", "-i", encoded, "-ss", f"{ss:.6f}", "-t", f"{length:.6f}",
+                   "-i", source, "-lavfi", graph, "-f", "null", "-"]
+        proc = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors="replace")
+        ssim = re.search(r"SSIM .*All:([\d.]+)", proc.stderr)
+        psnr = re.search(r"PSNR .*average:([\d.]+|inf)", proc.stderr)
+
+        return (float(ssim.group(1)) if ssim else None,
+                float(psnr.group(1)) if psnr else None)
+
+    def _choose(self, trials, target_speed, min_ssim):
+        # 拿不到进度或时长时测不出倍速/码率，这样的组不参与选择
+        measured = [t for t in trials if t["speed"] is not None and t["bitrate"] is not None]
+        if not measured:
+            self.log_error += "❌ 所有试编码都没有测到倍速或码率，无法选择参数。\n"
+            return None
+        ok = [t for t in measured if t["speed"] >= target_speed
+              and (min_ssim is None or (t["ssim"] is not None and t["ssim"] >= min_ssim))]
+        if ok:
+            best = min(ok, key=lambda t: t["bitrate"])
+            met = True
+            self.log_correct += (f"✅ 满足 {target_speed}x 的最低码率参数: preset {best['preset']} crf {best['crf']} "
+                                 f"({best['speed']:.2f}x, {best['bitrate'] / 1000:.0f} kb/s)\n")
+        else:
+            best = max(measured, key=lambda t: t["speed"])
+            met = False
+            self.log_warning += (f"⚠️ 没有参数达到 {target_speed}x，返回最快的一组: preset {best['preset']} "
+                                 f"crf {best['crf']} ({best['speed']:.2f}x)\n")
+
+        return {"preset": best["preset"], "crf": best["crf"], "speed": best["speed"], "bitrate": best["bitrate"],
+                "ssim": best["ssim"], "psnr": best["psnr"], "met": met}
+
+    def print_log(self):
+        run_log = "LOG\n"
+        run_log += self.log_correct
+        run_log += self.log_warning
+        run_log += self.log_error
+        print(run_log)